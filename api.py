@@ -1,4 +1,4 @@
-from fastapi import FastAPI, HTTPException, UploadFile, File
+from fastapi import FastAPI, HTTPException, Request, UploadFile, File
 from fastapi.responses import StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
@@ -7,16 +7,23 @@ import os
 import uuid
 import time
 import json
+import asyncio
 from contextlib import asynccontextmanager
 from datetime import datetime
 import shutil
 
 from nodes.document_processor_node import DocumentProcessorNode
 from nodes.retriever_node import Retriever
-from nodes.prompt_constructor_node import PromptConstructor
 from nodes.response_generator_node import ResponseGenerator
 from nodes.query_preprocessor_node import QueryPreprocessor
 from nodes.response_formatter_node import ResponseFormatter
+from utils.answer_cache import AnswerCache, SemanticAnswerCache
+from utils.faiss_client import FAISS_READ_ONLY
+from utils.ingestion_jobs import IngestionQueue, IngestionQueueFull
+from utils.pdf_extract import shutdown_pool as shutdown_pdf_pool
+from utils.pipeline_executor import executor_stats, run_blocking
+from utils.embedding_cache import get_embedding_cache
+from utils.embeddings import query_cache_stats
 
 # --- Modelos Pydantic ---
 class QueryRequest(BaseModel):
@@ -41,6 +48,11 @@ formatter = ResponseFormatter()
 chat_sessions: Dict[str, ChatSession] = {}
 query_metrics: List[Dict] = []
 
+# Intervalo (ms) con el que se agrupan los tokens del LLM en eventos de /ask/stream
+LLM_STREAM_FLUSH_MS = float(os.getenv("LLM_STREAM_FLUSH_MS", "50"))
+# Cada cuántos segundos /jobs/{job_id}/events comprueba si el trabajo avanzó
+JOB_EVENTS_INTERVAL = float(os.getenv("JOB_EVENTS_INTERVAL", "0.5"))
+
 # --- Carpeta de documentos ---
 DOCUMENTS_FOLDER = "documents"
 
@@ -48,18 +60,21 @@ DOCUMENTS_FOLDER = "documents"
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     # Startup
-    if os.path.exists(DOCUMENTS_FOLDER):
-        docs = [
-            f for f in os.listdir(DOCUMENTS_FOLDER)
-            if f.lower().endswith((".pdf", ".docx", ".txt"))
-        ]
-        if docs:
-            print("📂 Procesando documentos al inicio...")
-            for file in docs:
-                path = os.path.join(DOCUMENTS_FOLDER, file)
-                print(f"  ➜ Indexando {file}")
-                doc_processor.process(path, {"source": file})
-        else:
+    init_nodes()
+    if FAISS_READ_ONLY:
+        # Los workers de solo lectura sirven el índice que mantiene el proceso indexador
+        print("📖 Modo solo lectura: se omite la indexación inicial.")
+    elif os.path.exists(DOCUMENTS_FOLDER):
+        print("📂 Sincronizando documentos con el índice...")
+        # Solo se procesan los documentos nuevos o modificados desde el último arranque
+        # (manifest de documentos) y se borran los chunks de los eliminados de la carpeta
+        summary = retriever.client.sync_documents(DOCUMENTS_FOLDER)
+        print(
+            f"  ✔ {len(summary['added'])} nuevos, {len(summary['updated'])} actualizados, "
+            f"{len(summary['unchanged'])} sin cambios, {len(summary['removed'])} eliminados"
+            + (f", {len(summary['failed'])} con error" if summary["failed"] else "")
+        )
+        if not any(summary[k] for k in ("added", "updated", "unchanged", "failed")):
             print("⚠️ La carpeta 'documents/' está vacía. Agrega archivos para indexarlos.")
     else:
         print("⚠️ No existe la carpeta 'documents/'. Crea la carpeta y coloca tus archivos.")
@@ -67,6 +82,8 @@ async def lifespan(app: FastAPI):
     yield
     # Shutdown (si necesitas cleanup)
     print("🔄 Cerrando aplicación...")
+    ingestion_jobs.shutdown()
+    shutdown_pdf_pool()
 
 # --- Inicialización de FastAPI ---
 app = FastAPI(
@@ -78,10 +95,34 @@ app = FastAPI(
 
 # --- Nodos principales ---
 doc_processor = DocumentProcessorNode()
-retriever = Retriever()
-prompt_builder = PromptConstructor()
-generator = ResponseGenerator()
 preprocessor = QueryPreprocessor()
+# Se crean al arrancar (init_nodes), no al importar el módulo: los procesos del pool de extracción
+# de PDFs ("spawn") reimportan el módulo principal y no deben abrir el índice en escritura
+# (recortaría filas y borraría ficheros del proceso servidor) ni arrancar hilos ni colas propias
+retriever: Optional[Retriever] = None
+generator: Optional[ResponseGenerator] = None
+ingestion_jobs: Optional[IngestionQueue] = None
+
+
+def init_nodes():
+    """Crea el retriever (abre el índice), el generador y la cola de ingesta; solo la primera vez"""
+    global retriever, generator, ingestion_jobs
+    if retriever is not None:
+        return
+    retriever = Retriever()
+    # Las cachés de respuestas se vacían cuando cambia la generación del índice (subida, reindexado, borrado)
+    generator = ResponseGenerator(
+        answer_cache=AnswerCache(generation_fn=lambda: retriever.client.generation),
+        semantic_cache=SemanticAnswerCache(generation_fn=lambda: retriever.client.generation)
+    )
+    # /upload y /reindex encolan el documento y responden en seguida; un pool acotado lo procesa
+    ingestion_jobs = IngestionQueue(run_ingestion_job)
+
+
+def run_ingestion_job(job):
+    """Indexa (o reindexa) el documento de un trabajo informando del avance por etapas"""
+    chunks = retriever.client.upsert_document(job.path, {"source": job.source}, progress=job.progress)
+    return {"chunks": len(chunks)}
 
 @app.get("/")
 async def root():
@@ -128,22 +169,20 @@ async def ask_advanced(request: QueryRequest):
     start_time = time.time()
     
     try:
-        # Preprocesar query
-        clean_query = preprocessor.preprocess(request.query)
+        # Las etapas de CPU corren en el pool acotado de la pipeline y las de red se esperan
+        # de forma asíncrona: el worker atiende otras consultas mientras tanto
+        clean_query = await run_blocking(preprocessor.preprocess, request.query)
 
         # Recuperar contexto relevante con filtros
-        context = retriever.retrieve(
-            clean_query, 
+        context = await retriever.aretrieve(
+            clean_query,
             top_k=request.top_k,
             filters=request.filters,
             namespace=request.namespace
         )
 
-        # Construir el prompt
-        prompt = prompt_builder.construct(clean_query, context)
-
-        # Generar respuesta
-        response = generator.generate(clean_query, context)
+        # Generar respuesta (el prompt lo construye ResponseGenerator; la espera al LLM no bloquea el event loop)
+        response = await generator.agenerate(clean_query, context)
 
         # Calcular confianza mejorada
         confidence = calculate_confidence_score(context, response["answer"])
@@ -172,7 +211,8 @@ async def ask_advanced(request: QueryRequest):
         print(f"[DEBUG] force_bullets: {force_bullets}")
         print(f"[DEBUG] Answer before format: '{response['answer'][:100]}...'")
         
-        response["answer"] = formatter.format(
+        response["answer"] = await run_blocking(
+            formatter.format,
             response["answer"],
             force_bullets=force_bullets,
             is_unified_request=not is_narrative
@@ -202,39 +242,109 @@ async def ask_simple(query: str):
 
 
 # --- Subida de documentos ---
-@app.post("/upload")
+def ensure_writable():
+    """Rechaza operaciones de escritura cuando el índice se sirve en modo solo lectura"""
+    if FAISS_READ_ONLY:
+        raise HTTPException(status_code=409, detail="El índice se sirve en modo solo lectura (FAISS_READ_ONLY)")
+
+def enqueue_ingestion(kind: str, file_path: str, source: str):
+    """Encola un trabajo de ingesta; con la cola llena responde 503 para que el cliente reintente"""
+    try:
+        return ingestion_jobs.submit(kind, file_path, source)
+    except IngestionQueueFull as e:
+        raise HTTPException(status_code=503, detail=str(e))
+
+def save_upload(file: UploadFile, file_path: str):
+    with open(file_path, "wb") as buffer:
+        shutil.copyfileobj(file.file, buffer)
+
+@app.post("/upload", status_code=202)
 async def upload_file(file: UploadFile = File(...)):
+    ensure_writable()
     if not os.path.exists(DOCUMENTS_FOLDER):
         os.makedirs(DOCUMENTS_FOLDER)
     file_path = os.path.join(DOCUMENTS_FOLDER, file.filename)
-    with open(file_path, "wb") as buffer:
-        shutil.copyfileobj(file.file, buffer)
+    await run_blocking(save_upload, file, file_path)
 
-    # Procesar el documento subido
-    doc_processor.process(file_path, {"source": file.filename})
+    # El documento se procesa en segundo plano (si ya existía, sus chunks anteriores se reemplazan)
+    job = enqueue_ingestion("upload", file_path, file.filename)
 
-    return {"message": f"Archivo '{file.filename}' subido y procesado correctamente."}
+    return {
+        "message": f"Archivo '{file.filename}' subido; procesamiento en cola.",
+        "job_id": job.id,
+        "status_url": f"/jobs/{job.id}"
+    }
 
-@app.post("/reindex/{filename}")
+@app.post("/reindex/{filename}", status_code=202)
 async def reindex_document(filename: str):
     """Reindexar un documento específico con métodos de extracción mejorados"""
+    ensure_writable()
     file_path = os.path.join(DOCUMENTS_FOLDER, filename)
     
     if not os.path.exists(file_path):
         raise HTTPException(status_code=404, detail=f"Archivo '{filename}' no encontrado")
     
-    try:
-        # Limpiar índices existentes para este documento (si fuera necesario)
-        # Por ahora, simplemente reprocesar y agregar
-        print(f"🔄 Reindexando documento: {filename}")
-        doc_processor.process(file_path, {"source": filename})
-        
-        return {
-            "message": f"Documento '{filename}' reindexado exitosamente",
-            "file_path": file_path
-        }
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Error reindexando documento: {str(e)}")
+    # Los chunks anteriores del documento se marcan como borrados tras añadir los nuevos
+    print(f"🔄 Reindexando documento: {filename}")
+    job = enqueue_ingestion("reindex", file_path, filename)
+
+    return {
+        "message": f"Reindexado de '{filename}' en cola",
+        "file_path": file_path,
+        "job_id": job.id,
+        "status_url": f"/jobs/{job.id}"
+    }
+
+# --- Trabajos de ingesta ---
+def get_job_or_404(job_id: str):
+    job = ingestion_jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Trabajo '{job_id}' no encontrado")
+    return job
+
+@app.get("/jobs")
+async def list_jobs():
+    """Trabajos de ingesta recientes, del más nuevo al más antiguo"""
+    return {"jobs": [job.to_dict() for job in ingestion_jobs.jobs()], "stats": ingestion_jobs.stats()}
+
+@app.get("/jobs/{job_id}")
+async def get_job(job_id: str):
+    """Estado de un trabajo: etapa, páginas extraídas, chunks embebidos y errores"""
+    return get_job_or_404(job_id).to_dict()
+
+@app.get("/jobs/{job_id}/events")
+async def job_events(job_id: str, http_request: Request):
+    """Progreso de un trabajo por SSE: un evento por cambio, hasta que termina"""
+    job = get_job_or_404(job_id)
+
+    async def generate_events():
+        version = None
+        while True:
+            state = job.to_dict()
+            if state["version"] != version:
+                version = state["version"]
+                yield f"data: {json.dumps(state)}\n\n"
+            if state["status"] in ("done", "failed") or await http_request.is_disconnected():
+                return
+            await asyncio.sleep(JOB_EVENTS_INTERVAL)
+
+    return StreamingResponse(generate_events(), media_type="text/event-stream")
+
+@app.delete("/documents/{filename}")
+async def delete_document(filename: str):
+    """Eliminar un documento del índice (y de la carpeta de documentos)"""
+    ensure_writable()
+    # SQLite, tombstones y fsync del manifest: fuera del event loop
+    removed = await run_blocking(retriever.client.delete_document, filename)
+    file_path = os.path.join(DOCUMENTS_FOLDER, filename)
+    if os.path.exists(file_path):
+        os.remove(file_path)
+    elif removed == 0:
+        raise HTTPException(status_code=404, detail=f"Documento '{filename}' no encontrado")
+    return {
+        "message": f"Documento '{filename}' eliminado",
+        "chunks_removed": removed
+    }
 
 @app.get("/documents")
 async def list_documents():
@@ -317,69 +427,99 @@ async def get_chat_history(session_id: str):
 
 # --- Streaming Responses ---
 @app.post("/ask/stream")
-async def ask_stream(request: QueryRequest):
-    """Endpoint para respuestas streaming"""
+async def ask_stream(request: QueryRequest, http_request: Request):
+    """Endpoint para respuestas streaming: reenvía los tokens del LLM según se generan"""
     async def generate_response():
         start_time = time.time()
         qid = str(uuid.uuid4())
-        
-        # Preprocesar query
-        clean_query = preprocessor.preprocess(request.query)
         yield f"data: {json.dumps({'type': 'status', 'message': 'Procesando consulta...'})}\n\n"
-        
-        # Recuperar contexto
-        context = retriever.retrieve(
+
+        # Preprocesado y recuperación fuera del event loop
+        clean_query = await run_blocking(preprocessor.preprocess, request.query)
+        context = await retriever.aretrieve(
             clean_query,
             top_k=request.top_k,
             filters=request.filters,
             namespace=request.namespace
         )
         yield f"data: {json.dumps({'type': 'status', 'message': f'Encontrados {len(context)} fragmentos relevantes'})}\n\n"
-        
-        # Generar respuesta
-        response = generator.generate(clean_query, context)
-        
-        # Formatear respuesta
+
+        # Stream asíncrono del LLM: cada token se espera sin ocupar un hilo
+        answer_stream = await generator.agenerate_stream(clean_query, context)
+        events = answer_stream.__aiter__()
+        interval = LLM_STREAM_FLUSH_MS / 1000
+        response = None
+        pending = []
+        last_flush = None
+        next_event = None
+        try:
+            while True:
+                if next_event is None:
+                    next_event = asyncio.ensure_future(events.__anext__())
+                # El primer token sale en cuanto llega; los siguientes se agrupan por intervalo y
+                # salen al vencer el plazo aunque no llegue otro token (que puede tardar)
+                timeout = None if last_flush is None else max(0.0, last_flush + interval - time.monotonic())
+                done, _ = await asyncio.wait({next_event}, timeout=timeout)
+                if done:
+                    event, next_event = next_event, None
+                    try:
+                        kind, value = event.result()
+                    except StopAsyncIteration:
+                        break
+                    if kind == "complete":
+                        response = value
+                        break
+                    pending.append(value)
+                    if last_flush is not None and time.monotonic() - last_flush < interval:
+                        continue
+                # En cada plazo, con o sin tokens: una desconexión se detecta aunque el LLM esté parado
+                if await http_request.is_disconnected():
+                    print(f"🔌 Cliente desconectado, se cancela la generación ({qid})")
+                    return
+                if pending:
+                    yield f"data: {json.dumps({'type': 'content', 'content': ''.join(pending)})}\n\n"
+                    pending = []
+                last_flush = time.monotonic()
+            if pending:
+                yield f"data: {json.dumps({'type': 'content', 'content': ''.join(pending)})}\n\n"
+        finally:
+            if next_event is not None:
+                next_event.cancel()
+            # Desconexión o cancelación: cerrar la conexión con el LLM detiene la generación
+            await answer_stream.aclose()
+
+        if response is None:
+            return
+
+        # El formateo necesita el texto completo: la respuesta formateada va en el evento final
         query_lower = request.query.lower()
         explicit_list_keywords = ["lista", "listar", "enumera", "cuáles son", "qué tipos"]
         narrative_keywords = ["qué visión", "cómo", "por qué", "explica", "describe"]
-        
+
         is_explicit_list = any(keyword in query_lower for keyword in explicit_list_keywords)
         is_narrative = any(keyword in query_lower for keyword in narrative_keywords)
         force_bullets = is_explicit_list and not is_narrative
-        
-        formatted_answer = formatter.format(
+
+        formatted_answer = await run_blocking(
+            formatter.format,
             response["answer"],
             force_bullets=force_bullets,
             is_unified_request=not is_narrative
         )
-        
-        # Simular streaming de la respuesta
-        # Preservar espacios y saltos de línea durante el streaming
-        import re
-        tokens = re.split(r'(\s+)', formatted_answer)
-        total = max(1, len([t for t in tokens if t is not None]))
-        for i, token in enumerate(tokens):
-            if token is None:
-                continue
-            chunk = {
-                'type': 'content',
-                'content': token,
-                'progress': (i + 1) / total
-            }
-            yield f"data: {json.dumps(chunk)}\n\n"
-            time.sleep(0.02)  # Simular delay más fluido y conservar nuevos renglones
-        
+
         # Enviar fuentes y métricas finales
         final_data = {
             'type': 'complete',
+            'answer': formatted_answer,
+            'cached': response.get('cached', False),
+            'cache': response.get('cache'),
             'sources': response.get('sources', []),
             'confidence': calculate_confidence_score(context, response["answer"]),
             'response_time': round(time.time() - start_time, 3),
             'query_id': qid
         }
         yield f"data: {json.dumps(final_data)}\n\n"
-    
+
     return StreamingResponse(generate_response(), media_type="text/event-stream")
 
 # --- Monitoring y Analytics ---
@@ -408,6 +548,22 @@ async def get_metrics():
         "active_chat_sessions": len(chat_sessions)
     }
 
+@app.get("/metrics/memory")
+async def get_memory_metrics():
+    """Memoria compartida (índice mapeado) vs privada de este worker"""
+    return {"pid": os.getpid(), **retriever.client.memory_stats()}
+
+@app.get("/metrics/cache")
+async def get_cache_metrics():
+    """Aciertos y fallos de las cachés de embeddings y de respuestas"""
+    cache = get_embedding_cache()
+    return {
+        "embeddings": cache.stats() if cache is not None else {"enabled": False},
+        "query_embeddings": query_cache_stats(),
+        "answers": generator.answer_cache.stats(),
+        "semantic_answers": generator.semantic_cache.stats()
+    }
+
 @app.get("/health")
 async def health_check():
     """Health check endpoint"""
@@ -417,7 +573,9 @@ async def health_check():
         "version": "2.0.0",
         "documents_folder_exists": os.path.exists(DOCUMENTS_FOLDER),
         "indexed_documents": len([f for f in os.listdir(DOCUMENTS_FOLDER) 
-                                 if f.lower().endswith((".pdf", ".docx", ".txt"))]) if os.path.exists(DOCUMENTS_FOLDER) else 0
+                                 if f.lower().endswith((".pdf", ".docx", ".txt"))]) if os.path.exists(DOCUMENTS_FOLDER) else 0,
+        "pipeline": executor_stats(),
+        "ingestion": ingestion_jobs.stats()
     }
 
 # --- Ejecutar servidor ---
@@ -426,4 +584,5 @@ if __name__ == "__main__":
     print(" Iniciando PocketFlow Assistant API...")
     print(" Servidor disponible en: http://127.0.0.1:8000")
     print(" Documentación en: http://127.0.0.1:8000/docs")
-    uvicorn.run(app, host="127.0.0.1", port=8000)
+    # Por nombre de módulo: el servidor usa "api", no "__main__" (ver README)
+    uvicorn.run("api:app", host="127.0.0.1", port=8000)
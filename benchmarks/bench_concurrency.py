@@ -0,0 +1,162 @@
+"""
+Benchmark de concurrencia de /ask: throughput y latencia p50/p99 con N clientes simultáneos.
+
+Con --url mide un servidor en marcha (uvicorn api:app). Sin --url ejecuta la pipeline en
+proceso, sin red: backend de embeddings hashing, chunks sintéticos, cachés desactivadas y
+un LLM simulado que tarda --llm-ms. Compara la pipeline actual (etapas de CPU en el pool,
+LLM esperado de forma asíncrona) con el camino bloqueante anterior (todo dentro de la
+corrutina): el segundo no escala con los clientes porque el event loop queda ocupado.
+
+Uso:
+    python -m benchmarks.bench_concurrency --clients 1 4 16 64 --llm-ms 300
+    python -m benchmarks.bench_concurrency --url http://127.0.0.1:8000 --clients 1 4 16
+"""
+import argparse
+import asyncio
+import contextlib
+import io
+import json
+import os
+import sys
+import tempfile
+import time
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.bench_index_types import percentile_ms  # noqa: E402
+
+QUERIES = [
+    "¿qué lugares visitó el viajero?", "¿cómo describe el paisaje?", "¿qué ciudades se mencionan?",
+    "¿quién acompañaba al protagonista?", "¿qué tradiciones aparecen?", "¿cuándo comienza el viaje?",
+]
+
+
+def query_for(i: int) -> str:
+    # Consultas distintas: ninguna caché evita el trabajo
+    return f"{QUERIES[i % len(QUERIES)]} ({i})"
+
+
+def report(clients, latencies, elapsed):
+    print(
+        f"{clients:>8} {len(latencies):>9} {len(latencies) / elapsed:>9.1f} "
+        f"{percentile_ms(latencies, 50):>9} {percentile_ms(latencies, 99):>9}"
+    )
+
+
+def header(title):
+    print(f"\n{title}")
+    print(f"{'clientes':>8} {'peticiones':>9} {'req/s':>9} {'p50_ms':>9} {'p99_ms':>9}")
+
+
+# ---------------- Servidor en marcha ----------------
+def run_http(url, clients_list, per_client):
+    def ask(i):
+        body = json.dumps({"query": query_for(i)}).encode("utf-8")
+        request = urllib.request.Request(f"{url}/ask", data=body, headers={"Content-Type": "application/json"})
+        t0 = time.perf_counter()
+        with urllib.request.urlopen(request) as response:
+            response.read()
+        return time.perf_counter() - t0
+
+    header(f"HTTP {url}")
+    for clients in clients_list:
+        with ThreadPoolExecutor(max_workers=clients) as pool:
+            t0 = time.perf_counter()
+            latencies = list(pool.map(ask, range(clients * per_client)))
+            report(clients, latencies, time.perf_counter() - t0)
+
+
+# ---------------- En proceso ----------------
+def setup_in_process(n_chunks, llm_ms):
+    os.environ.setdefault("EMBEDDING_BACKEND", "hashing")
+    os.environ["FAISS_INDEX_DIR"] = tempfile.mkdtemp(prefix="bench_concurrency_")
+    for var in ("ANSWER_CACHE_MAX_ENTRIES", "SEMANTIC_CACHE_MAX_ENTRIES", "QUERY_CACHE_MAX_ENTRIES"):
+        os.environ[var] = "0"
+    os.environ["EMBEDDING_CACHE_ENABLED"] = "0"
+
+    import api
+    import utils.llm_client as llm_client
+    from utils.embeddings import generate_embeddings
+
+    api.init_nodes()
+
+    texts = [
+        f"Fragmento {i}: el viajero recorre {QUERIES[i % len(QUERIES)]} y describe sus impresiones del camino."
+        for i in range(n_chunks)
+    ]
+    metas = [{"text": t, "source": "sintetico.txt", "page": i // 10 + 1, "chunk_index": i} for i, t in enumerate(texts)]
+    api.retriever.client.add_embeddings(generate_embeddings(texts), metas)
+
+    answer = "El viajero recorre varias ciudades y describe el paisaje con detalle."
+
+    def completion():
+        return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=answer))])
+
+    async def acreate(**kwargs):
+        await asyncio.sleep(llm_ms / 1000)
+        return completion()
+
+    def create(**kwargs):
+        time.sleep(llm_ms / 1000)
+        return completion()
+
+    # LLM simulado con latencia fija: asíncrono para la pipeline, bloqueante para el camino anterior
+    llm_client.get_async_client = lambda: SimpleNamespace(chat=SimpleNamespace(completions=SimpleNamespace(create=acreate)))
+    llm_client.client = SimpleNamespace(chat=SimpleNamespace(completions=SimpleNamespace(create=create)))
+    return api
+
+
+async def blocking_ask(api, query):
+    """Camino anterior: todas las etapas síncronas dentro de la corrutina"""
+    clean_query = api.preprocessor.preprocess(query)
+    context = api.retriever.retrieve(clean_query, top_k=5)
+    response = api.generator.generate(clean_query, context)
+    api.formatter.format(response["answer"], force_bullets=False, is_unified_request=True)
+
+
+async def measure(handler, clients, per_client):
+    latencies = []
+
+    async def client(c):
+        for j in range(per_client):
+            t0 = time.perf_counter()
+            await handler(query_for(c * per_client + j))
+            latencies.append(time.perf_counter() - t0)
+
+    t0 = time.perf_counter()
+    await asyncio.gather(*(client(c) for c in range(clients)))
+    return latencies, time.perf_counter() - t0
+
+
+def run_in_process(clients_list, per_client, n_chunks, llm_ms):
+    with contextlib.redirect_stdout(io.StringIO()):
+        api = setup_in_process(n_chunks, llm_ms)
+    handlers = {
+        "pipeline no bloqueante": lambda q: api.ask_advanced(api.QueryRequest(query=q)),
+        "camino bloqueante (anterior)": lambda q: blocking_ask(api, q),
+    }
+    print(f"{n_chunks} chunks, LLM simulado de {llm_ms} ms, {per_client} peticiones por cliente")
+    for title, handler in handlers.items():
+        header(title)
+        for clients in clients_list:
+            # Los nodos imprimen trazas de depuración por consulta: se silencian durante la medida
+            with contextlib.redirect_stdout(io.StringIO()):
+                latencies, elapsed = asyncio.run(measure(handler, clients, per_client))
+            report(clients, latencies, elapsed)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", default="", help="Servidor a medir; vacío = pipeline en proceso")
+    parser.add_argument("--clients", type=int, nargs="+", default=[1, 2, 4, 8, 16, 32])
+    parser.add_argument("--requests-per-client", type=int, default=5)
+    parser.add_argument("--chunks", type=int, default=20000)
+    parser.add_argument("--llm-ms", type=float, default=300)
+    args = parser.parse_args()
+    if args.url:
+        run_http(args.url.rstrip("/"), args.clients, args.requests_per_client)
+    else:
+        run_in_process(args.clients, args.requests_per_client, args.chunks, args.llm_ms)
@@ -0,0 +1,69 @@
+"""
+Benchmark de embeddings de dimensión reducida (256/512/1024/1536).
+
+Parte de los vectores completos del corpus (log vectors.f32 de FAISS_INDEX_DIR,
+indexado con text-embedding-3 a 1536 dimensiones) y los trunca y renormaliza a cada
+dimensión, que es lo que devuelve la API con dimensions=N. Una parte del corpus se
+aparta como consultas; el recall@k se mide contra la búsqueda exacta a dimensión completa.
+Sin índice, usa vectores sintéticos.
+
+Uso:
+    python -m benchmarks.bench_dimensions --index-dir faiss_store --dims 256 512 1024 1536
+"""
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.bench_index_types import percentile_ms  # noqa: E402
+from benchmarks.bench_quantization import load_corpus, recall  # noqa: E402
+from utils.embedding_backends import reduce_dimensions  # noqa: E402
+from utils.index_factory import INDEX_TYPES, index_memory_bytes, search_parameters, train_and_fill  # noqa: E402
+
+
+def run(corpus, dims, n_queries, top_k, index_type):
+    full_dim = corpus.shape[1]
+    rng = np.random.default_rng(0)
+    order = rng.permutation(len(corpus))
+    queries, base = corpus[order[:n_queries]], corpus[order[n_queries:]]
+
+    exact = train_and_fill(full_dim, "flat", np.array(reduce_dimensions(base, full_dim), dtype="float32"))
+    _, truth = exact.search(np.array(reduce_dimensions(queries, full_dim), dtype="float32"), top_k)
+
+    print(f"{len(base)} vectores, índice {index_type}, {n_queries} consultas\n")
+    print(f"{'dim':>5} {'MiB':>8} {'p50_ms':>8} {'p99_ms':>8} {'recall@' + str(top_k):>10}")
+    for dim in sorted(d for d in dims if d <= full_dim):
+        reduced = np.array(reduce_dimensions(base, dim), dtype="float32")
+        reduced_queries = np.array(reduce_dimensions(queries, dim), dtype="float32")
+        index = train_and_fill(dim, index_type, reduced)
+        params = search_parameters(index)
+
+        latencies, found = [], []
+        for q in reduced_queries:
+            t0 = time.perf_counter()
+            _, ids = index.search(q[None, :], top_k, params=params)
+            latencies.append(time.perf_counter() - t0)
+            found.append(ids[0])
+        print(
+            f"{dim:>5} {index_memory_bytes(index) / 2**20:>8.1f} {percentile_ms(latencies, 50):>8} "
+            f"{percentile_ms(latencies, 99):>8} {recall(np.array(found), truth, top_k):>10.3f}"
+        )
+        del index
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--index-dir", default=os.getenv("FAISS_INDEX_DIR", "faiss_store"))
+    parser.add_argument("--dim", type=int, default=1536, help="Dimensión de los vectores del log")
+    parser.add_argument("--dims", type=int, nargs="+", default=[256, 512, 1024, 1536])
+    parser.add_argument("--synthetic-size", type=int, default=100000)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--top-k", type=int, default=10)
+    parser.add_argument("--type", default="flat", choices=INDEX_TYPES)
+    args = parser.parse_args()
+    corpus = load_corpus(args.index_dir, args.dim, args.synthetic_size)
+    run(corpus, args.dims, args.queries, args.top_k, args.type)
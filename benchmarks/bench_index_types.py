@@ -0,0 +1,75 @@
+"""
+Benchmark de tipos de índice FAISS frente al baseline flat.
+
+Mide recall@k (contra la búsqueda exacta) y latencia p50/p99 por consulta
+para flat, ivf, hnsw e ivfpq sobre vectores sintéticos agrupados.
+
+Uso:
+    python -m benchmarks.bench_index_types --sizes 10000 100000 1000000 --dim 1536
+"""
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils.index_factory import INDEX_TYPES, search_parameters, train_and_fill  # noqa: E402
+
+
+def synthetic_vectors(n: int, dim: int, n_clusters: int = 256, seed: int = 0) -> np.ndarray:
+    """Vectores agrupados (mezcla de gaussianas), más realistas que ruido uniforme"""
+    rng = np.random.default_rng(seed)
+    centers = rng.standard_normal((n_clusters, dim)).astype("float32")
+    labels = rng.integers(0, n_clusters, size=n)
+    data = centers[labels] + 0.35 * rng.standard_normal((n, dim)).astype("float32")
+    return data.astype("float32")
+
+
+def percentile_ms(samples, q):
+    return round(float(np.percentile(samples, q)) * 1000, 3)
+
+
+def run(sizes, dim, n_queries, top_k, types):
+    print(f"{'n':>9} {'tipo':>6} {'build_s':>8} {'recall@' + str(top_k):>10} {'p50_ms':>8} {'p99_ms':>8}")
+    for n in sizes:
+        base = synthetic_vectors(n, dim)
+        queries = synthetic_vectors(n_queries, dim, seed=1)
+
+        exact = train_and_fill(dim, "flat", base)
+        _, truth = exact.search(queries, top_k)
+
+        for index_type in types:
+            start = time.perf_counter()
+            index = exact if index_type == "flat" else train_and_fill(dim, index_type, base)
+            build_s = time.perf_counter() - start
+
+            params = search_parameters(index)
+            latencies = []
+            hits = 0
+            for i in range(n_queries):
+                t0 = time.perf_counter()
+                _, ids = index.search(queries[i:i + 1], top_k, params=params)
+                latencies.append(time.perf_counter() - t0)
+                hits += len(set(ids[0].tolist()) & set(truth[i].tolist()))
+
+            recall = hits / (n_queries * top_k)
+            print(
+                f"{n:>9} {index_type:>6} {build_s:>8.2f} {recall:>10.3f} "
+                f"{percentile_ms(latencies, 50):>8} {percentile_ms(latencies, 99):>8}"
+            )
+            if index is not exact:
+                del index
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10000, 100000, 1000000])
+    parser.add_argument("--dim", type=int, default=1536)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--top-k", type=int, default=10)
+    parser.add_argument("--types", nargs="+", default=list(INDEX_TYPES), choices=INDEX_TYPES)
+    args = parser.parse_args()
+    run(args.sizes, args.dim, args.queries, args.top_k, args.types)
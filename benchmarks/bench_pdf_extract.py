@@ -0,0 +1,79 @@
+"""
+Benchmark de extracción de texto de PDFs con PyMuPDF por número de procesos.
+
+Extrae todas las páginas de los PDFs (por defecto, los de documents/) con 1 proceso
+(extracción secuencial en el propio proceso) y con N workers del pool, que extraen rangos
+de páginas en paralelo y los reensamblan en orden. Comprueba que el texto es idéntico y
+muestra páginas/s y aceleración. "frío" incluye el arranque de los procesos del pool;
+"caliente" reutiliza el pool, como ocurre a partir del segundo documento.
+
+Uso:
+    python -m benchmarks.bench_pdf_extract --workers 1 2 4 8
+    python -m benchmarks.bench_pdf_extract --pdf documents/libro.pdf --pages-per-task 16
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import utils.pdf_extract as pdf_extract  # noqa: E402
+
+
+def extract(path: str, workers: int) -> list:
+    return list(pdf_extract.iter_pymupdf_pages(path, lambda stage, **counters: None, workers=workers))
+
+
+def timed(path: str, workers: int, repeat: int):
+    best, pages = None, None
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        pages = extract(path, workers)
+        elapsed = time.perf_counter() - t0
+        best = elapsed if best is None else min(best, elapsed)
+    return best, pages
+
+
+def run(paths, workers_list, repeat):
+    print(f"CPUs: {os.cpu_count()}, páginas por tarea: {pdf_extract.PDF_EXTRACT_PAGES_PER_TASK}")
+    for path in paths:
+        print(f"\n{os.path.basename(path)}")
+        print(f"{'workers':>8} {'páginas':>8} {'frío_s':>8} {'caliente_s':>10} {'págs/s':>8} {'aceleración':>11}")
+        baseline_time, baseline_pages = timed(path, 1, repeat)
+        print(
+            f"{1:>8} {len(baseline_pages):>8} {'-':>8} {baseline_time:>10.3f} "
+            f"{len(baseline_pages) / baseline_time:>8.1f} {1.0:>10.2f}x"
+        )
+        for workers in workers_list:
+            if workers <= 1:
+                continue
+            pdf_extract.shutdown_pool()
+            t0 = time.perf_counter()
+            cold_pages = extract(path, workers)
+            cold = time.perf_counter() - t0
+            warm, pages = timed(path, workers, repeat)
+            if pages != baseline_pages or cold_pages != baseline_pages:
+                raise SystemExit(f"El texto extraído con {workers} workers no coincide con el secuencial")
+            print(
+                f"{workers:>8} {len(pages):>8} {cold:>8.3f} {warm:>10.3f} "
+                f"{len(pages) / warm:>8.1f} {baseline_time / warm:>10.2f}x"
+            )
+    pdf_extract.shutdown_pool()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--pdf", nargs="*", default=None, help="PDFs a extraer; por defecto los de documents/")
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4, 8])
+    parser.add_argument("--pages-per-task", type=int, default=pdf_extract.PDF_EXTRACT_PAGES_PER_TASK)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+    pdf_extract.PDF_EXTRACT_PAGES_PER_TASK = args.pages_per_task
+    pdf_extract.PDF_EXTRACT_MIN_PAGES = 0
+    paths = args.pdf or sorted(
+        os.path.join("documents", f) for f in os.listdir("documents") if f.lower().endswith(".pdf")
+    )
+    if not paths:
+        raise SystemExit("No hay PDFs que extraer (usa --pdf o coloca PDFs en documents/)")
+    run(paths, args.workers, args.repeat)
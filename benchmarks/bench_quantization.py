@@ -0,0 +1,91 @@
+"""
+Benchmark de almacenamiento cuantizado (fp16, sq8, ivfpq) frente a flat float32.
+
+Usa los vectores reales del corpus (log vectors.f32 de FAISS_INDEX_DIR); si no hay
+índice, genera vectores sintéticos. Una parte del corpus se aparta como consultas.
+Para cada tipo informa la memoria del índice, lo ahorrado frente a float32 y el
+recall@k perdido, sin re-rank y con re-rank exacto de top_k * factor candidatos.
+
+Uso:
+    python -m benchmarks.bench_quantization --index-dir faiss_store --dim 1536
+"""
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.bench_index_types import percentile_ms, synthetic_vectors  # noqa: E402
+from utils.index_factory import (  # noqa: E402
+    QUANTIZED_TYPES, index_memory_bytes, search_parameters, train_and_fill
+)
+from utils.segment_store import VECTOR_LOG_FILE  # noqa: E402
+
+
+def load_corpus(index_dir: str, dim: int, synthetic_size: int) -> np.ndarray:
+    log_path = os.path.join(index_dir, VECTOR_LOG_FILE)
+    if os.path.exists(log_path):
+        vectors = np.fromfile(log_path, dtype="float32").reshape(-1, dim)
+        print(f"Corpus: {len(vectors)} vectores de {log_path}")
+        return vectors
+    print(f"No existe {log_path}: se usan {synthetic_size} vectores sintéticos")
+    return synthetic_vectors(synthetic_size, dim)
+
+
+def recall(ids, truth, top_k):
+    return sum(len(set(row[:top_k].tolist()) & set(t.tolist())) for row, t in zip(ids, truth)) / (len(truth) * top_k)
+
+
+def run(corpus, n_queries, top_k, factors, types):
+    dim = corpus.shape[1]
+    rng = np.random.default_rng(0)
+    order = rng.permutation(len(corpus))
+    queries, base = corpus[order[:n_queries]], corpus[order[n_queries:]]
+    ids = np.arange(len(base), dtype="int64")
+
+    exact = train_and_fill(dim, "flat", base, ids)
+    _, truth = exact.search(queries, top_k)
+    flat_bytes = index_memory_bytes(exact)
+    print(f"flat float32: {flat_bytes / 2**20:.1f} MiB ({len(base)} vectores, {dim} dims)\n")
+
+    print(f"{'tipo':>6} {'MiB':>8} {'ahorro':>7} {'rerank':>7} {'recall@' + str(top_k):>10} {'pérdida':>8} {'p50_ms':>8}")
+    for index_type in types:
+        index = train_and_fill(dim, index_type, base, ids)
+        size = index_memory_bytes(index)
+        params = search_parameters(index)
+        for factor in factors:
+            fetch = top_k * factor if factor else top_k
+            latencies, found = [], []
+            for q in queries:
+                t0 = time.perf_counter()
+                _, cand = index.search(q[None, :], fetch, params=params)
+                cand = cand[0][cand[0] >= 0]
+                if factor:
+                    # Re-rank exacto con los vectores float32 (en producción, el log mapeado en memoria)
+                    distances = ((base[cand] - q) ** 2).sum(axis=1)
+                    cand = cand[np.argsort(distances)]
+                latencies.append(time.perf_counter() - t0)
+                found.append(np.pad(cand[:top_k], (0, top_k - len(cand[:top_k])), constant_values=-1))
+            r = recall(np.array(found), truth, top_k)
+            print(
+                f"{index_type:>6} {size / 2**20:>8.1f} {1 - size / flat_bytes:>7.1%} {factor or '-':>7} "
+                f"{r:>10.3f} {1 - r:>8.3f} {percentile_ms(latencies, 50):>8}"
+            )
+        del index
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--index-dir", default=os.getenv("FAISS_INDEX_DIR", "faiss_store"))
+    parser.add_argument("--dim", type=int, default=1536)
+    parser.add_argument("--synthetic-size", type=int, default=100000)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--top-k", type=int, default=10)
+    parser.add_argument("--rerank-factors", type=int, nargs="+", default=[0, 2, 4, 8], help="0 = sin re-rank")
+    parser.add_argument("--types", nargs="+", default=list(QUANTIZED_TYPES), choices=QUANTIZED_TYPES)
+    args = parser.parse_args()
+    corpus = load_corpus(args.index_dir, args.dim, args.synthetic_size)
+    run(corpus, args.queries, args.top_k, args.rerank_factors, args.types)
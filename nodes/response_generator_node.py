@@ -1,5 +1,6 @@
-from utils.llm_client import call_llm 
-import re, uuid
+from utils.llm_client import LLM_MODEL, acall_llm, call_llm
+from utils.pipeline_executor import run_blocking
+import copy, re, uuid
 from collections import defaultdict
 
 try:
@@ -7,10 +8,72 @@ try:
 except Exception:
     fitz = None
 
+# Versión del prompt: forma parte de la clave de la caché de respuestas (súbela al cambiar el prompt)
+PROMPT_VERSION = "1"
+
+
+class AsyncAnswerStream:
+    """
+    Eventos de una respuesta en streaming, se itera con async for. aclose() cierra la conexión
+    con el LLM (por ejemplo, cuando el cliente se desconecta) y detiene la generación.
+    """
+
+    def __init__(self, events, llm_stream=None):
+        self._events = events
+        self.llm_stream = llm_stream
+
+    def __aiter__(self):
+        return self._events
+
+    async def aclose(self):
+        if self.llm_stream is not None:
+            await self.llm_stream.aclose()
+
+
+async def _aiter(items):
+    for item in items:
+        yield item
+
+
+class _PrefixFilter:
+    """Retiene el comienzo de un stream de tokens hasta saber si trae un prefijo "Respuesta:" y lo quita"""
+
+    def __init__(self, strip, prefixes):
+        self.strip = strip
+        self.prefixes = prefixes
+        self.pending = ""
+        self.done = False
+
+    def feed(self, token: str) -> str:
+        if self.done:
+            return token
+        self.pending += token
+        head = self.pending.lstrip().lower()
+        undecided = (
+            any(p.startswith(head) for p in self.prefixes)
+            or (head.startswith(self.prefixes) and ":" not in head)
+        )
+        if undecided and len(head) < 200:
+            return ""
+        return self.finish()
+
+    def finish(self) -> str:
+        if self.done:
+            return ""
+        self.done = True
+        return self.strip(self.pending.lstrip())
+
 
 class ResponseGenerator:
-    def __init__(self):
+    # Prefijos que el LLM antepone a veces a la respuesta y que se eliminan
+    _ANSWER_PREFIXES = ("respuesta", "la respuesta")
+
+    def __init__(self, answer_cache=None, semantic_cache=None):
         self.page_offsets = {}
+        # AnswerCache opcional: evita repetir la llamada al LLM para la misma consulta y los mismos chunks
+        self.answer_cache = answer_cache
+        # SemanticAnswerCache opcional: reutiliza respuestas de preguntas parecidas con las mismas fuentes
+        self.semantic_cache = semantic_cache
 
     # ---------------- Detección de referencias legales ----------------
     def _is_legal_reference_query(self, query: str) -> bool:
@@ -248,8 +311,13 @@ class ResponseGenerator:
         q = query.lower()
         return "qué documento" in q or "cual documento" in q or "qué archivos" in q
 
-    # ---------------- Generar respuesta ----------------
-    def generate(self, query: str, context_chunks=None, threshold: float = 0.05):
+    # ---------------- Preparar respuesta ----------------
+    def _prepare(self, query: str, context_chunks, threshold: float):
+        """
+        Filtra los chunks y resuelve los casos que no necesitan LLM.
+        Devuelve (resultado, None, chunks) si la respuesta ya está decidida
+        o (None, prompt, chunks) si hay que llamar al LLM.
+        """
         context_chunks = context_chunks or []
         
         # Debug: mostrar chunks recibidos
@@ -275,7 +343,7 @@ class ResponseGenerator:
                 "answer": "No se encontró información suficiente",
                 "sources": [],
                 "confidence": "low",
-            }
+            }, None, filtered_chunks
 
         # ✅ Caso especial: Query legal solo cuando piden documentos explícitamente
         if (
@@ -298,7 +366,7 @@ class ResponseGenerator:
                 "answer": answer,
                 "sources": sources,
                 "confidence": confidence,
-            }
+            }, None, filtered_chunks
 
         # ✅ Caso: "qué documento..."
         if self._should_answer_with_docs(query):
@@ -329,7 +397,7 @@ class ResponseGenerator:
                     "answer": answer,
                     "sources": sources,
                     "confidence": confidence,
-                }
+                }, None, filtered_chunks
 
         # ---- Flujo normal con LLM ----
         context_texts = [c.get("text", "") for c in filtered_chunks]
@@ -353,48 +421,53 @@ Instrucciones CRÍTICAS:
 
 Respuesta:"""
 
-        answer = call_llm(prompt).strip()
-        answer = re.sub(
+        return None, prompt, filtered_chunks
+
+    # ---------------- Limpieza de la respuesta del LLM ----------------
+    def _strip_answer_prefix(self, answer: str) -> str:
+        return re.sub(
             r"^(respuesta.*?:|la respuesta.*?:|respuesta con citas.*?:)\s*",
             "",
             answer,
             flags=re.IGNORECASE,
-        ).strip()
+        )
 
+    # ---------------- Selección de fuentes ----------------
+    def _content_tokens(self, s: str):
+        words = re.findall(r"[A-Za-zÁÉÍÓÚáéíóúñÑ]{3,}", s.lower())
+        stop = {"los","las","una","uno","unos","unas","del","con","por","para","como","que","segun","entre","sobre","este","esta","estos","estas","de","en","al","el","la","y","o"}
+        return {w for w in words if w not in stop}
+
+    def _select_relevant_sources(self, ans: str, chunks):
+        """Selección de fuentes relevantes según solapamiento con la respuesta"""
+        tokenize = self._content_tokens
+        ans_tokens = tokenize(ans)
+        scored = []
+        for c in chunks:
+            text = c.get("text", "")
+            chunk_tokens = tokenize(text)
+            if not chunk_tokens or not ans_tokens:
+                score = 0.0
+            else:
+                inter = len(ans_tokens & chunk_tokens)
+                union = len(ans_tokens | chunk_tokens)
+                score = inter / max(1, union)
+            scored.append((score, c))
+
+        # ordenar por score y score de relevancia base
+        scored.sort(key=lambda t: (t[0], t[1].get("relevance_score", 0.0)), reverse=True)
+
+        # Mantener top 3 o los que superen umbral mínimo
+        selected = []
+        for score, c in scored[:5]:
+            if score >= 0.02 or len(selected) < 3:
+                selected.append(c)
+        return [self._format_source(c) for c in selected]
+
+    def _build_result(self, answer: str, filtered_chunks):
         # NO aplicar postprocesado automático de listas - solo mantener el texto como viene del LLM
         # El formateo se manejará únicamente en el ResponseFormatter con control explícito
-
-        # Selección de fuentes relevantes según solapamiento con la respuesta
-        def _select_relevant_sources(ans: str, chunks):
-            def tokenize(s: str):
-                words = re.findall(r"[A-Za-zÁÉÍÓÚáéíóúñÑ]{3,}", s.lower())
-                stop = {"los","las","una","uno","unos","unas","del","con","por","para","como","que","segun","entre","sobre","este","esta","estos","estas","de","en","al","el","la","y","o"}
-                return {w for w in words if w not in stop}
-
-            ans_tokens = tokenize(ans)
-            scored = []
-            for c in chunks:
-                text = c.get("text", "")
-                chunk_tokens = tokenize(text)
-                if not chunk_tokens or not ans_tokens:
-                    score = 0.0
-                else:
-                    inter = len(ans_tokens & chunk_tokens)
-                    union = len(ans_tokens | chunk_tokens)
-                    score = inter / max(1, union)
-                scored.append((score, c))
-
-            # ordenar por score y score de relevancia base
-            scored.sort(key=lambda t: (t[0], t[1].get("relevance_score", 0.0)), reverse=True)
-
-            # Mantener top 3 o los que superen umbral mínimo
-            selected = []
-            for score, c in scored[:5]:
-                if score >= 0.02 or len(selected) < 3:
-                    selected.append(c)
-            return [self._format_source(c) for c in selected]
-
-        sources = _select_relevant_sources(answer, filtered_chunks)
+        sources = self._select_relevant_sources(answer, filtered_chunks)
         avg_score = sum(c.get("relevance_score", 0.0) for c in filtered_chunks) / len(filtered_chunks)
         confidence = "high" if avg_score >= 0.7 else ("medium" if avg_score >= 0.4 else "low")
 
@@ -405,6 +478,134 @@ Respuesta:"""
             "confidence": confidence,
         }
 
+    # ---------------- Caché de respuestas ----------------
+    def _cache_key(self, query: str, context_chunks, threshold: float):
+        """Clave: query preprocesada + ids de los chunks recuperados (en orden) + modelo + versión del prompt"""
+        if (self.answer_cache is None and self.semantic_cache is None) or not context_chunks:
+            return None
+        ids = tuple(c.get("chunk_id") for c in context_chunks)
+        if None in ids:
+            return None
+        return (query, ids, threshold, LLM_MODEL, PROMPT_VERSION)
+
+    def _from_cache(self, cached, kind: str):
+        result = copy.deepcopy(cached)
+        result["query_id"] = str(uuid.uuid4())
+        result["cached"] = True
+        result["cache"] = kind
+        return result
+
+    def _lookup(self, query: str, context_chunks, threshold: float):
+        """
+        Busca la respuesta en la caché exacta (misma query, mismos chunks) y después en la
+        semántica (paráfrasis con fuentes solapadas). Devuelve (resultado o None, clave, sonda).
+        """
+        key = self._cache_key(query, context_chunks, threshold)
+        if key is None:
+            return None, None, None
+        cached = self.answer_cache.get(key) if self.answer_cache is not None else None
+        if cached is not None:
+            return self._from_cache(cached, "exact"), key, None
+        if self.semantic_cache is None:
+            return None, key, None
+        probe = self.semantic_cache.lookup(query, key[1])
+        # Un acierto muestreado para auditoría se regenera y se compara al guardar
+        if probe.entry is not None and not probe.audit:
+            return self._from_cache(probe.entry.value, "semantic"), key, None
+        return None, key, probe
+
+    def _answer_agreement(self, a: str, b: str) -> float:
+        a_tokens, b_tokens = self._content_tokens(a), self._content_tokens(b)
+        if not a_tokens and not b_tokens:
+            return 1.0
+        return len(a_tokens & b_tokens) / max(1, len(a_tokens | b_tokens))
+
+    def _store_result(self, key, result, probe=None, complete: bool = True):
+        result["cached"] = False
+        result["cache"] = None
+        if key is None or not complete:
+            return result
+        if self.answer_cache is not None:
+            self.answer_cache.put(key, copy.deepcopy(result))
+        if probe is not None:
+            if probe.entry is not None:
+                agreement = self._answer_agreement(probe.entry.value["answer"], result["answer"])
+                self.semantic_cache.record_audit(probe, agreement)
+            self.semantic_cache.put(probe, copy.deepcopy(result))
+        return result
+
+    def _prepare_and_lookup(self, query: str, context_chunks, threshold: float):
+        """
+        Etapas previas al LLM (limpieza y filtrado de chunks, cachés de respuestas):
+        (resultado ya disponible o None, prompt, chunks filtrados, clave, sonda)
+        """
+        result, prompt, filtered_chunks = self._prepare(query, context_chunks, threshold)
+        if result is not None:
+            return self._store_result(None, result), prompt, filtered_chunks, None, None
+        cached, key, probe = self._lookup(query, context_chunks, threshold)
+        return cached, prompt, filtered_chunks, key, probe
+
+    def _finish(self, answer: str, filtered_chunks, key, probe):
+        """Resultado final (fuentes con su página real, que puede abrir el PDF) guardado en las cachés"""
+        answer = self._strip_answer_prefix(answer.strip()).strip()
+        return self._store_result(key, self._build_result(answer, filtered_chunks), probe)
+
+    # ---------------- Generar respuesta ----------------
+    def generate(self, query: str, context_chunks=None, threshold: float = 0.05):
+        result, prompt, filtered_chunks, key, probe = self._prepare_and_lookup(query, context_chunks, threshold)
+        if result is not None:
+            return result
+        return self._finish(call_llm(prompt), filtered_chunks, key, probe)
+
+    async def agenerate(self, query: str, context_chunks=None, threshold: float = 0.05):
+        """
+        Como generate, pero sin bloquear el event loop: las etapas de CPU, el embedding de la
+        caché semántica y el cálculo de páginas corren en el pool de la pipeline y el LLM se
+        espera con el cliente asíncrono compartido.
+        """
+        result, prompt, filtered_chunks, key, probe = await run_blocking(
+            self._prepare_and_lookup, query, context_chunks, threshold
+        )
+        if result is not None:
+            return result
+        answer = await acall_llm(prompt)
+        return await run_blocking(self._finish, answer, filtered_chunks, key, probe)
+
+    # ---------------- Generar respuesta en streaming ----------------
+    async def agenerate_stream(self, query: str, context_chunks=None, threshold: float = 0.05):
+        """
+        Como agenerate, pero devuelve un AsyncAnswerStream: eventos ("token", texto) según los
+        produce el LLM y un último ("complete", resultado) con la respuesta, fuentes y confianza.
+        Las etapas bloqueantes, antes y después del LLM, corren en el pool de la pipeline.
+        """
+        result, prompt, filtered_chunks, key, probe = await run_blocking(
+            self._prepare_and_lookup, query, context_chunks, threshold
+        )
+        if result is not None:
+            return AsyncAnswerStream(_aiter([("token", result["answer"]), ("complete", result)]))
+
+        llm_stream = await acall_llm(prompt, stream=True)
+        return AsyncAnswerStream(self._astream_events(llm_stream, filtered_chunks, key, probe), llm_stream)
+
+    async def _astream_events(self, llm_stream, filtered_chunks, key=None, probe=None):
+        answer = ""
+        prefix = _PrefixFilter(self._strip_answer_prefix, self._ANSWER_PREFIXES)
+        async for token in llm_stream:
+            text = prefix.feed(token)
+            if text:
+                answer += text
+                yield "token", text
+        text = prefix.finish()
+        if text:
+            answer += text
+            yield "token", text
+        yield "complete", await run_blocking(self._stream_result, answer, filtered_chunks, key, probe, llm_stream)
+
+    def _stream_result(self, answer: str, filtered_chunks, key, probe, llm_stream):
+        # Una respuesta cortada (cliente desconectado) no se guarda en la caché
+        result = self._build_result(answer.strip(), filtered_chunks)
+        return self._store_result(key, result, probe, complete=getattr(llm_stream, "completed", False))
+
     # ---------------- Limpieza de texto ----------------
     def _clean_text(self, text: str) -> str:
         if not text:
@@ -1,80 +1,107 @@
 # nodes/retriever_node.py
-from utils.embeddings import generate_embeddings
-from utils.faiss_client import FAISSClient
+import numpy as np
+from utils.embeddings import aembed_query, embed_query
+from utils.faiss_client import get_client
+from utils.pipeline_executor import run_blocking
 from typing import List, Dict
 
+
+def _basename_no_ext(path: str) -> str:
+    if not path:
+        return ""
+    # obtener basename sin usar os (válido para / y \\)
+    name = str(path).rsplit("/", 1)[-1].rsplit("\\", 1)[-1]
+    return name.rsplit(".", 1)[0].lower()
+
+
+def _str(s) -> str:
+    return str(s or "").strip().lower()
+
+
+def _match_value(meta_val, filter_val, key: str) -> bool:
+    """Coincidencia flexible para strings (source/section)."""
+    if isinstance(filter_val, list):
+        return any(_match_value(meta_val, fv, key) for fv in filter_val)
+
+    fv = _str(filter_val)
+    if fv == "":
+        return True  # filtro vacío no restringe
+
+    # Normalizar meta_val
+    mv = _str(meta_val)
+
+    # Reglas específicas
+    if key in ("source", "source_path"):
+        # comparar por basename y por el valor directo
+        mv_base = _basename_no_ext(meta_val)
+        return fv in mv or fv in mv_base
+    if key in ("section",):
+        return fv in mv
+
+    # Comparación por igualdad como fallback
+    return mv == fv
+
+
 class Retriever:
-    def __init__(self, dim: int = 1536):
-        self.client = FAISSClient(dim)
+    def __init__(self, dim: int = None):
+        # Mismo índice que usa DocumentProcessor: lo subido es consultable al instante.
+        # La dimensión la fija el backend de embeddings (EMBEDDING_BACKEND)
+        self.client = get_client(dim)
+
+    def _allowed_ids(self, filters: Dict = None, namespace: str = None):
+        """
+        Traduce filtros de metadata a los ids de FAISS que los cumplen, usando el índice
+        invertido del chunk store. None = sin restricción.
+        """
+        chunks = self.client.chunks
+        allowed = None
+        for filter_key, filter_value in (filters or {}).items():
+            if _str(filter_value) == "" and not isinstance(filter_value, list):
+                continue  # filtro vacío no restringe
+            ids = chunks.ids_matching(
+                filter_key, lambda value, fk=filter_key, fv=filter_value: _match_value(value, fv, fk)
+            )
+            allowed = ids if allowed is None else np.intersect1d(allowed, ids, assume_unique=True)
+
+        # Filtro de namespace solo si los chunks contienen ese metadato
+        if namespace and chunks.field_values("namespace"):
+            ns = _str(namespace)
+            ids = chunks.ids_matching("namespace", lambda value: _str(value) == ns)
+            allowed = ids if allowed is None else np.intersect1d(allowed, ids, assume_unique=True)
+        return allowed
 
     def retrieve(self, query: str, top_k: int = 5, filters: Dict = None, namespace: str = None) -> List[Dict]:
         """
         Recupera chunks relevantes y aplica filtros de forma tolerante:
-        - Los metadatos vienen en el propio dict del chunk (no en "metadata")
+        - Los filtros se resuelven a ids con el índice invertido del chunk store y se aplican
+          dentro de la búsqueda: se devuelven top_k chunks que cumplen el filtro en una pasada
         - 'source' y 'section' aceptan coincidencia parcial y case-insensitive
         - 'source' permite escribir sin extensión o con prefijo del nombre
         - 'namespace' solo filtra si los chunks lo incluyen; si no existe, no descarta resultados
         """
-        qv = generate_embeddings([query])[0]
-        raw = self.client.query(qv, top_k * 3)  # pedimos varios
-
-        def _basename_no_ext(path: str) -> str:
-            if not path:
-                return ""
-            # obtener basename sin usar os (válido para / y \)
-            name = path.rsplit("/", 1)[-1].rsplit("\\", 1)[-1]
-            return name.rsplit(".", 1)[0].lower()
-
-        def _str(s) -> str:
-            return str(s or "").strip().lower()
-
-        def _match_value(meta_val, filter_val, key: str) -> bool:
-            """Coincidencia flexible para strings (source/section)."""
-            if isinstance(filter_val, list):
-                return any(_match_value(meta_val, fv, key) for fv in filter_val)
-
-            fv = _str(filter_val)
-            if fv == "":
-                return True  # filtro vacío no restringe
-
-            # Normalizar meta_val
-            mv = _str(meta_val)
-
-            # Reglas específicas
-            if key in ("source", "source_path"):
-                # comparar por basename y por el valor directo
-                mv_base = _basename_no_ext(meta_val)
-                return fv in mv or fv in mv_base
-            if key in ("section",):
-                return fv in mv
-
-            # Comparación por igualdad como fallback
-            return mv == fv
-
-        # Aplicar filtros de metadata si se proporcionan (sobre el dict 'r' completo)
-        if filters:
-            filtered_raw = []
-            for r in raw:
-                record = r  # metadatos vienen al nivel superior
-                match = True
-                for filter_key, filter_value in filters.items():
-                    meta_value = record.get(filter_key)  # p. ej., 'source', 'section'
-                    if not _match_value(meta_value, filter_value, filter_key):
-                        match = False
-                        break
-                if match:
-                    filtered_raw.append(r)
-            raw = filtered_raw
-
-        # Aplicar filtro de namespace solo si los chunks contienen ese metadato
-        if namespace:
-            ns = _str(namespace)
-            if any("namespace" in r for r in raw):
-                raw = [r for r in raw if _str(r.get("namespace")) == ns]
+        # La query llega preprocesada: consultas repetidas no vuelven a la API
+        return self.search(embed_query(query), top_k, filters, namespace)
+
+    async def aretrieve(self, query: str, top_k: int = 5, filters: Dict = None, namespace: str = None) -> List[Dict]:
+        """Como retrieve, sin bloquear el event loop: el embedding se espera de forma asíncrona
+        y la búsqueda corre en el pool de la pipeline"""
+        qv = await aembed_query(query)
+        return await run_blocking(self.search, qv, top_k, filters, namespace)
+
+    def search(self, qv, top_k: int = 5, filters: Dict = None, namespace: str = None) -> List[Dict]:
+        """Búsqueda, filtros, dedup y orden a partir del embedding de la consulta"""
+        allowed = self._allowed_ids(filters, namespace)
+
+        # query_coalesced agrupa con las búsquedas concurrentes de otras peticiones (FAISS_COALESCE_WAIT_MS)
+        raw = []
+        if allowed is None:
+            raw = self.client.query_coalesced(qv, top_k)
+        elif len(allowed):
+            raw = self.client.query_coalesced(qv, top_k, allowed_ids=allowed)
 
-        # Si los filtros eliminaron todo, relajar: volver a los mejores sin filtro
+        # Si ningún chunk cumple los filtros, relajar: volver a los mejores sin filtro
         if not raw:
-            raw = self.client.query(qv, top_k * 3)
+            raw = self.client.query_coalesced(qv, top_k)
 
         # dedup por (archivo, página, fragmento)
         seen = {}
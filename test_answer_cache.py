@@ -0,0 +1,161 @@
+import asyncio
+import os
+import unittest
+from types import SimpleNamespace
+from unittest import mock
+
+os.environ.setdefault("OPENAI_API_KEY", "test")
+import utils.llm_client as llm_client  # noqa: E402
+from nodes.response_generator_node import ResponseGenerator  # noqa: E402
+from utils.answer_cache import AnswerCache, SemanticAnswerCache  # noqa: E402
+
+
+class CountingClient:
+    def __init__(self, answer="El centro abre de lunes a viernes."):
+        self.answer = answer
+        self.calls = 0
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self.create))
+
+    def create(self, model, messages, stream=False):
+        self.calls += 1
+        return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=self.answer))])
+
+
+def chunks(*ids):
+    return [
+        {"chunk_id": i, "text": f"El centro {i} abre de lunes a viernes por la mañana.", "source": "a.txt",
+         "page": i, "relevance_score": 0.8}
+        for i in ids
+    ]
+
+
+class TestAnswerCache(unittest.TestCase):
+    def setUp(self):
+        self.generation = 1
+        self.cache = AnswerCache(generation_fn=lambda: self.generation, max_entries=10, ttl=0)
+        self.generator = ResponseGenerator(answer_cache=self.cache)
+        self.client = CountingClient()
+        patcher = mock.patch.object(llm_client, "client", self.client)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_same_query_and_chunks_skip_the_llm(self):
+        first = self.generator.generate("¿cuándo abre el centro?", chunks(1, 2))
+        second = self.generator.generate("¿cuándo abre el centro?", chunks(1, 2))
+        self.assertEqual(self.client.calls, 1)
+        self.assertFalse(first["cached"])
+        self.assertTrue(second["cached"])
+        self.assertEqual(first["answer"], second["answer"])
+        self.assertNotEqual(first["query_id"], second["query_id"])
+
+    def test_key_includes_chunk_ids_and_order(self):
+        self.generator.generate("¿cuándo abre el centro?", chunks(1, 2))
+        self.generator.generate("¿cuándo abre el centro?", chunks(2, 1))
+        self.generator.generate("¿cuándo abre el centro?", chunks(1, 3))
+        self.generator.generate("¿a qué hora abre el centro?", chunks(1, 2))
+        self.assertEqual(self.client.calls, 4)
+
+    def test_generation_change_invalidates(self):
+        self.generator.generate("¿cuándo abre el centro?", chunks(1, 2))
+        self.generation = 2
+        result = self.generator.generate("¿cuándo abre el centro?", chunks(1, 2))
+        self.assertFalse(result["cached"])
+        self.assertEqual(self.client.calls, 2)
+        self.assertEqual(self.cache.stats()["invalidations"], 1)
+
+    def test_cached_result_is_isolated_from_callers(self):
+        first = self.generator.generate("¿cuándo abre el centro?", chunks(1))
+        first["answer"] = "formateada"
+        first["sources"].clear()
+        second = self.generator.generate("¿cuándo abre el centro?", chunks(1))
+        self.assertEqual(second["answer"], "El centro abre de lunes a viernes.")
+        self.assertTrue(second["sources"])
+
+    def test_stream_hits_and_fills_the_cache(self):
+        async def tokens():
+            for token in ("El centro ", "abre."):
+                yield token
+
+        async def collect(events):
+            return [item async for item in events]
+
+        async def stream(query):
+            return await collect(await self.generator.agenerate_stream(query, chunks(1)))
+
+        events = asyncio.run(collect(self.generator._astream_events(tokens(), chunks(1), key=("k",))))
+        self.assertFalse(events[-1][1]["cached"])
+        # Un iterador simple no marca completed: la respuesta no se guarda
+        self.assertIsNone(self.cache.get(("k",)))
+
+        answer = self.generator.generate("¿cuándo abre el centro?", chunks(1))
+        streamed = asyncio.run(stream("¿cuándo abre el centro?"))
+        self.assertEqual(self.client.calls, 1)
+        self.assertEqual(streamed[0], ("token", answer["answer"]))
+        self.assertTrue(streamed[-1][1]["cached"])
+
+
+# Vectores fijos por consulta: las dos primeras son paráfrasis, la tercera no
+VECTORS = {
+    "¿qué recursos didácticos se mencionan?": [1.0, 0.0, 0.0],
+    "lista los recursos didácticos": [0.98, 0.2, 0.0],
+    "¿quién escribió el documento?": [0.0, 0.0, 1.0],
+}
+
+
+class TestSemanticAnswerCache(unittest.TestCase):
+    def setUp(self):
+        self.cache = SemanticAnswerCache(
+            embed_fn=VECTORS.__getitem__, max_entries=10, ttl=0, threshold=0.9, min_overlap=0.5, audit_rate=0.0
+        )
+        self.generator = ResponseGenerator(semantic_cache=self.cache)
+        self.client = CountingClient()
+        patcher = mock.patch.object(llm_client, "client", self.client)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_paraphrase_with_overlapping_sources_hits(self):
+        first = self.generator.generate("¿qué recursos didácticos se mencionan?", chunks(1, 2, 3))
+        second = self.generator.generate("lista los recursos didácticos", chunks(1, 2, 4))
+        self.assertEqual(self.client.calls, 1)
+        self.assertEqual(second["cache"], "semantic")
+        self.assertEqual(second["answer"], first["answer"])
+        self.assertEqual(self.cache.stats()["hits"], 1)
+
+    def test_different_question_or_sources_miss(self):
+        self.generator.generate("¿qué recursos didácticos se mencionan?", chunks(1, 2))
+        self.generator.generate("¿quién escribió el documento?", chunks(1, 2))
+        self.generator.generate("lista los recursos didácticos", chunks(7, 8))
+        self.assertEqual(self.client.calls, 3)
+        self.assertEqual(self.cache.stats()["rejected_overlap"], 1)
+
+    def test_audit_counts_false_hits_and_drops_entry(self):
+        self.cache.audit_rate = 1.0
+        self.generator.generate("¿qué recursos didácticos se mencionan?", chunks(1, 2))
+        self.client.answer = "Pizarras digitales y cuadernos de ejercicios."
+        audited = self.generator.generate("lista los recursos didácticos", chunks(1, 2))
+        self.assertEqual(self.client.calls, 2)
+        self.assertEqual(audited["answer"], "Pizarras digitales y cuadernos de ejercicios.")
+        stats = self.cache.stats()
+        self.assertEqual((stats["audits"], stats["false_hits"]), (1, 1))
+        self.assertTrue(stats["recent_audits"][0]["false_hit"])
+        # Queda solo la respuesta regenerada
+        self.assertEqual(stats["entries"], 1)
+
+    def test_eviction_and_generation_reset(self):
+        generation = [1]
+        cache = SemanticAnswerCache(
+            generation_fn=lambda: generation[0], embed_fn=VECTORS.__getitem__, max_entries=2, ttl=0,
+            threshold=0.999, audit_rate=0.0
+        )
+        generator = ResponseGenerator(semantic_cache=cache)
+        for query in VECTORS:
+            generator.generate(query, chunks(1))
+        self.assertEqual(cache.stats()["entries"], 2)
+        self.assertEqual(cache.stats()["evictions"], 1)
+        generation[0] = 2
+        cache.lookup("lista los recursos didácticos", (1,))
+        self.assertEqual(cache.stats()["entries"], 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
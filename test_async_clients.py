@@ -0,0 +1,154 @@
+import asyncio
+import os
+import threading
+import time
+import unittest
+from types import SimpleNamespace
+from unittest import mock
+
+os.environ.setdefault("OPENAI_API_KEY", "test")
+import utils.embeddings as embeddings  # noqa: E402
+import utils.llm_client as llm_client  # noqa: E402
+from nodes.response_generator_node import ResponseGenerator  # noqa: E402
+from utils.openai_clients import get_async_client, limiter  # noqa: E402
+from utils.pipeline_executor import run_blocking  # noqa: E402
+
+
+class FakeCompletions:
+    def __init__(self, delay=0.0, answer="Respuesta: abre de lunes a viernes."):
+        self.delay = delay
+        self.answer = answer
+        self.active = 0
+        self.max_active = 0
+        self.kwargs = []
+
+    async def create(self, **kwargs):
+        self.kwargs.append(kwargs)
+        self.active += 1
+        self.max_active = max(self.max_active, self.active)
+        await asyncio.sleep(self.delay)
+        self.active -= 1
+        return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=self.answer))])
+
+
+def fake_llm_client(completions):
+    return SimpleNamespace(chat=SimpleNamespace(completions=completions))
+
+
+class FakeEmbeddings:
+    def __init__(self):
+        self.calls = []
+
+    async def create(self, model, input, **extra):
+        self.calls.append(list(input))
+        await asyncio.sleep(0)
+        return SimpleNamespace(data=[SimpleNamespace(embedding=[float(t.split()[0])]) for t in input])
+
+
+CHUNKS = [
+    {"text": "El centro abre de lunes a viernes por la mañana.", "source": "a.txt", "page": 1, "relevance_score": 0.8},
+]
+
+
+class TestAsyncLLM(unittest.TestCase):
+    def test_semaphore_bounds_concurrent_calls(self):
+        completions = FakeCompletions(delay=0.01)
+
+        async def run():
+            with mock.patch.object(llm_client, "get_async_client", return_value=fake_llm_client(completions)), \
+                    mock.patch.object(llm_client, "LLM_CONCURRENCY", 3):
+                return await asyncio.gather(*(llm_client.acall_llm(f"p{i}") for i in range(10)))
+
+        answers = asyncio.run(run())
+        self.assertEqual(len(answers), 10)
+        self.assertEqual(completions.max_active, 3)
+        self.assertTrue(all("timeout" in kwargs for kwargs in completions.kwargs))
+
+    def test_agenerate_matches_generate(self):
+        completions = FakeCompletions()
+        generator = ResponseGenerator()
+        with mock.patch.object(llm_client, "get_async_client", return_value=fake_llm_client(completions)):
+            result = asyncio.run(generator.agenerate("¿Cuándo abre el centro?", CHUNKS))
+
+        sync_client = SimpleNamespace(chat=SimpleNamespace(completions=SimpleNamespace(
+            create=lambda **kwargs: SimpleNamespace(
+                choices=[SimpleNamespace(message=SimpleNamespace(content=completions.answer))]
+            )
+        )))
+        with mock.patch.object(llm_client, "client", sync_client):
+            expected = generator.generate("¿Cuándo abre el centro?", CHUNKS)
+        self.assertEqual(result["answer"], "abre de lunes a viernes.")
+        self.assertEqual(result["answer"], expected["answer"])
+        self.assertEqual(result["sources"], expected["sources"])
+
+    def test_client_and_semaphores_are_shared_per_loop(self):
+        async def run():
+            return get_async_client(), get_async_client(), limiter("llm", 2), limiter("llm", 2)
+
+        first = asyncio.run(run())
+        self.assertIs(first[0], first[1])
+        self.assertIs(first[2], first[3])
+        # Otro event loop tiene su propio cliente
+        self.assertIsNot(asyncio.run(run())[0], first[0])
+
+
+class TestPipelineExecutor(unittest.TestCase):
+    def test_blocking_stages_run_off_the_event_loop(self):
+        async def run():
+            loop_thread = threading.current_thread().name
+            ticks = 0
+
+            async def ticker():
+                nonlocal ticks
+                while True:
+                    ticks += 1
+                    await asyncio.sleep(0.005)
+
+            task = asyncio.create_task(ticker())
+            name = await run_blocking(lambda: time.sleep(0.1) or threading.current_thread().name)
+            task.cancel()
+            return loop_thread, name, ticks
+
+        loop_thread, worker, ticks = asyncio.run(run())
+        self.assertNotEqual(worker, loop_thread)
+        self.assertTrue(worker.startswith("pipeline"))
+        # El event loop siguió atendiendo otras tareas mientras la etapa bloqueante corría
+        self.assertGreater(ticks, 5)
+
+    def test_agenerate_runs_blocking_steps_in_the_pool(self):
+        completions = FakeCompletions()
+        generator = ResponseGenerator()
+        threads = {}
+        for name in ("_prepare", "_build_result"):
+            original = getattr(generator, name)
+
+            def record(*args, _name=name, _original=original, **kwargs):
+                threads[_name] = threading.current_thread().name
+                return _original(*args, **kwargs)
+
+            setattr(generator, name, record)
+
+        with mock.patch.object(llm_client, "get_async_client", return_value=fake_llm_client(completions)):
+            result = asyncio.run(generator.agenerate("¿Cuándo abre el centro?", CHUNKS))
+        self.assertEqual(result["answer"], "abre de lunes a viernes.")
+        self.assertTrue(all(name.startswith("pipeline") for name in threads.values()), threads)
+        self.assertEqual(set(threads), {"_prepare", "_build_result"})
+
+    def test_aembed_query_batches_on_the_async_client(self):
+        fake = FakeEmbeddings()
+        with mock.patch.object(embeddings, "_get_async_client", return_value=SimpleNamespace(embeddings=fake)), \
+                mock.patch.object(embeddings, "_backend", embeddings.OpenAIBackend()), \
+                mock.patch.object(embeddings, "query_cache", embeddings.LRUCache(10)), \
+                mock.patch.object(embeddings, "_embed_api", side_effect=AssertionError("cliente síncrono")):
+            async def run():
+                return await asyncio.gather(*(embeddings.aembed_query(f"{i} consulta") for i in range(1, 6)))
+
+            vectors = asyncio.run(run())
+        self.assertEqual(vectors, [[float(i)] for i in range(1, 6)])
+        # Las cinco consultas concurrentes van en una sola petición del cliente asíncrono
+        self.assertEqual(len(fake.calls), 1)
+        self.assertEqual(len(fake.calls[0]), 5)
+
+
+if __name__ == "__main__":
+    unittest.main()
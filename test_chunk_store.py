@@ -0,0 +1,71 @@
+import os
+import pickle
+import shutil
+import tempfile
+import unittest
+
+from utils.chunk_store import ChunkStore, convert_metadata_pickle
+
+
+class TestChunkStore(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmp, "chunks.db")
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def test_roundtrip_keeps_text_and_extra_fields(self):
+        store = ChunkStore(self.path)
+        store.add(0, [
+            {"text": "Max Estrella " * 50, "source": "luces.pdf", "page": 3, "chunk_index": 0, "autor": "Valle"},
+            {"text": "otro", "source": "luces.pdf", "page": 4, "chunk_index": 1, "namespace": "teatro"},
+        ])
+
+        rows = store.get([1, 0])
+        self.assertEqual(rows[0]["text"], "Max Estrella " * 50)
+        self.assertEqual(rows[0]["autor"], "Valle")
+        self.assertNotIn("namespace", rows[0])
+        self.assertEqual(rows[1]["namespace"], "teatro")
+        self.assertEqual(store.dedup_key(1), ("luces.pdf", 4, 1))
+
+    def test_compact_columns_reload_and_truncate(self):
+        store = ChunkStore(self.path)
+        store.add(0, [{"text": str(i), "source": f"doc{i % 2}.txt", "page": None, "chunk_index": i} for i in range(5)])
+        store.close()
+
+        reopened = ChunkStore(self.path)
+        self.assertEqual(reopened.count, 5)
+        self.assertEqual(reopened.dedup_key(3), ("doc1.txt", None, 3))
+
+        reopened.truncate(2)
+        self.assertEqual(reopened.count, 2)
+        self.assertEqual(sorted(reopened.get(range(5))), [0, 1])
+
+    def test_ids_matching_uses_inverted_index_and_extra_fields(self):
+        store = ChunkStore(self.path)
+        store.add(0, [
+            {"text": str(i), "source": f"doc{i % 3}.txt", "chunk_index": i, "autor": "Valle" if i < 2 else "Lorca"}
+            for i in range(6)
+        ])
+        self.assertEqual(store.ids_matching("source", lambda v: v == "doc1.txt").tolist(), [1, 4])
+        self.assertEqual(store.ids_matching("autor", lambda v: v == "Valle").tolist(), [0, 1])
+        self.assertEqual(store.ids_matching("section", lambda v: True).tolist(), [])
+
+        store.truncate(4)
+        self.assertEqual(store.ids_matching("source", lambda v: v == "doc1.txt").tolist(), [1])
+        store.purge([1])
+        self.assertEqual(store.ids_matching("source", lambda v: v == "doc1.txt").tolist(), [])
+
+    def test_convert_metadata_pickle(self):
+        pkl = os.path.join(self.tmp, "metadata.pkl")
+        with open(pkl, "wb") as f:
+            pickle.dump([{"text": "hola", "source": "a.txt", "page": 1, "chunk_index": 0}], f)
+
+        store = ChunkStore(self.path)
+        self.assertEqual(convert_metadata_pickle(pkl, store), 1)
+        self.assertEqual(store.get([0])[0]["text"], "hola")
+
+
+if __name__ == "__main__":
+    unittest.main()
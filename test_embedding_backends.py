@@ -0,0 +1,118 @@
+import asyncio
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+import numpy as np
+
+import utils.embeddings as embeddings
+from utils.embedding_backends import HashingBackend, reduce_dimensions
+from utils.segment_store import SegmentStore
+
+
+def cosine(a, b):
+    return float(np.dot(a, b))
+
+
+class TestHashingBackend(unittest.TestCase):
+    def test_vectors_are_deterministic_and_normalized(self):
+        backend = HashingBackend(dim=256)
+        first, second = backend.embed(["La inflación subió", "La inflación subió"])
+        self.assertEqual(first, second)
+        self.assertEqual(len(first), 256)
+        self.assertAlmostEqual(float(np.linalg.norm(first)), 1.0, places=5)
+        self.assertEqual(backend.embed([""])[0], [0.0] * 256)
+
+    def test_lexical_overlap_is_closer(self):
+        backend = HashingBackend(dim=512)
+        query, related, unrelated = backend.embed([
+            "tasa de inflacion en 2023",
+            "La inflación de 2023 fue alta según el banco central",
+            "Receta de tortilla de patatas con cebolla",
+        ])
+        self.assertGreater(cosine(query, related), cosine(query, unrelated))
+
+
+class TestReducedDimensions(unittest.TestCase):
+    def test_truncate_and_renormalize(self):
+        reduced = reduce_dimensions([[3.0, 4.0, 12.0], [0.0, 0.0, 1.0]], 2)
+        np.testing.assert_allclose(reduced, [[0.6, 0.8], [0.0, 0.0]], rtol=1e-6)
+
+    def test_openai_backend_requests_or_truncates_dimensions(self):
+        calls = []
+
+        def fake_openai(texts, dimensions=None):
+            calls.append(dimensions)
+            return [[1.0] * 1536 for _ in texts]
+
+        with mock.patch.object(embeddings, "_embed_openai", fake_openai):
+            native = embeddings.OpenAIBackend("text-embedding-3-small", dimensions=256)
+            self.assertEqual((native.dim, native.model), (256, "text-embedding-3-small@256"))
+            native.embed(["a"])
+
+            legacy = embeddings.OpenAIBackend("text-embedding-ada-002", dimensions=512)
+            vector = legacy.embed(["a"])[0]
+        self.assertEqual(calls, [256, None])
+        self.assertEqual(len(vector), 512)
+        self.assertAlmostEqual(float(np.linalg.norm(vector)), 1.0, places=5)
+
+    def test_manifest_records_embedding_model(self):
+        tmp = tempfile.mkdtemp()
+        try:
+            store = SegmentStore(tmp, 256, "text-embedding-3-small@256")
+            store.commit(store._empty_manifest())
+            self.assertEqual(SegmentStore(tmp, 256, "text-embedding-3-small@256").load_manifest()["embedding_model"],
+                             "text-embedding-3-small@256")
+            with self.assertRaises(ValueError):
+                SegmentStore(tmp, 256, "hashing-v1-256").load_manifest()
+        finally:
+            shutil.rmtree(tmp)
+
+
+class TestBackendSelection(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.cwd = os.getcwd()
+        os.chdir(self.tmp)
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+        shutil.rmtree(self.tmp)
+
+    def test_unknown_backend_is_rejected(self):
+        with mock.patch.object(embeddings, "EMBEDDING_BACKEND", "nope"), mock.patch.object(embeddings, "_backend", None):
+            with self.assertRaises(ValueError):
+                embeddings.get_backend()
+
+    def test_index_and_search_offline_with_local_backend(self):
+        import utils.faiss_client as faiss_client
+        from nodes.retriever_node import Retriever
+
+        with open("economia.txt", "w", encoding="utf-8") as f:
+            for i in range(60):
+                f.write(f"En el trimestre {i} la inflación de 2023 siguió alta y el banco central revisó los tipos de interés. ")
+                f.write(f"La cosecha número {i} de trigo dependió de la lluvia caída en primavera. ")
+
+        with mock.patch.object(embeddings, "EMBEDDING_BACKEND", "hashing"), \
+                mock.patch.object(embeddings, "_backend", None), \
+                mock.patch.object(embeddings, "get_embedding_cache", lambda: None), \
+                mock.patch.dict(os.environ, {"OPENAI_API_KEY": ""}), \
+                mock.patch.object(faiss_client, "_shared_client", None):
+            self.assertEqual(embeddings.embedding_dim(), HashingBackend().dim)
+            client = faiss_client.get_client()
+            self.assertEqual(client.dim, HashingBackend().dim)
+            try:
+                client.upsert_document("economia.txt")
+                results = Retriever().retrieve("tipos de interés del banco central", top_k=2)
+                async_results = asyncio.run(Retriever().aretrieve("tipos de interés del banco central", top_k=2))
+            finally:
+                client.stop_watcher()
+        self.assertEqual(len(results), 2)
+        self.assertEqual(results[0]["source"], "economia.txt")
+        self.assertEqual(async_results, results)
+
+
+if __name__ == "__main__":
+    unittest.main()
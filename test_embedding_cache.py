@@ -0,0 +1,71 @@
+import os
+import shutil
+import tempfile
+import unittest
+from types import SimpleNamespace
+from unittest import mock
+
+from utils.embedding_cache import EmbeddingCache, cache_key
+
+
+class TestEmbeddingCache(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmp, "embeddings.db")
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def test_key_depends_on_model_and_normalized_text(self):
+        self.assertEqual(cache_key("m", "hola  mundo\n"), cache_key("m", "hola mundo"))
+        self.assertNotEqual(cache_key("m", "hola"), cache_key("otro", "hola"))
+        self.assertNotEqual(cache_key("m", "Hola"), cache_key("m", "hola"))
+
+    def test_hits_survive_reopen(self):
+        cache = EmbeddingCache(self.path)
+        self.assertEqual(cache.get_many("m", ["a", "b"]), [None, None])
+        cache.put_many("m", ["a", "b"], [[1.0, 2.0], [3.0, 4.0]])
+        cache.close()
+
+        reopened = EmbeddingCache(self.path)
+        self.assertEqual(reopened.get_many("m", ["b", "c", "a"]), [[3.0, 4.0], None, [1.0, 2.0]])
+        stats = reopened.stats()
+        self.assertEqual((stats["hits"], stats["misses"], stats["entries"]), (2, 1, 2))
+
+    def test_evicts_least_recently_used(self):
+        # 1 KiB de máximo, vectores de 256 bytes
+        cache = EmbeddingCache(self.path, max_mb=1 / 1024)
+        for i in range(4):
+            cache.put_many("m", [str(i)], [[float(i)] * 64])
+        cache.get_many("m", ["0"])
+        cache.put_many("m", ["4"], [[4.0] * 64])
+
+        self.assertLessEqual(cache.stats()["bytes"], 1024)
+        self.assertIsNotNone(cache.get_many("m", ["0"])[0])
+        self.assertIsNone(cache.get_many("m", ["1"])[0])
+        self.assertGreater(cache.stats()["evictions"], 0)
+
+    def test_generate_embeddings_only_calls_api_for_misses(self):
+        os.environ.setdefault("OPENAI_API_KEY", "test")
+        import utils.embeddings as embeddings
+
+        calls = []
+
+        def create(model, input):
+            calls.append(list(input))
+            return SimpleNamespace(data=[SimpleNamespace(embedding=[float(len(t)), 0.5]) for t in input])
+
+        fake_client = SimpleNamespace(api_key="test", embeddings=SimpleNamespace(create=create))
+        cache = EmbeddingCache(self.path)
+        with mock.patch.object(embeddings, "client", fake_client), \
+                mock.patch.object(embeddings, "get_embedding_cache", lambda: cache):
+            first = embeddings.generate_embeddings(["uno", "dos", "uno"])
+            second = embeddings.generate_embeddings(["dos", "uno", "tres"])
+
+        self.assertEqual(first, [[3.0, 0.5], [3.0, 0.5], [3.0, 0.5]])
+        self.assertEqual(second, [[3.0, 0.5], [3.0, 0.5], [4.0, 0.5]])
+        self.assertEqual(calls, [["uno", "dos"], ["tres"]])
+
+
+if __name__ == "__main__":
+    unittest.main()
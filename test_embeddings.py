@@ -0,0 +1,190 @@
+import asyncio
+import os
+import threading
+import unittest
+from types import SimpleNamespace
+from unittest import mock
+
+os.environ.setdefault("OPENAI_API_KEY", "test")
+import openai  # noqa: E402
+import utils.embeddings as embeddings  # noqa: E402
+from utils.lru_cache import LRUCache  # noqa: E402
+from utils.micro_batcher import AsyncMicroBatcher, MicroBatcher  # noqa: E402
+
+
+def fake_client(create):
+    return SimpleNamespace(api_key="test", embeddings=SimpleNamespace(create=create))
+
+
+def echo_create(model, input):
+    return SimpleNamespace(data=[SimpleNamespace(embedding=[float(t.split()[0])]) for t in input])
+
+
+class TestBatchEmbeddings(unittest.TestCase):
+    def test_batches_respect_token_and_size_limits(self):
+        texts = [f"{i} " + "palabra " * 20 for i in range(50)]
+        batches = embeddings.make_batches(texts, max_tokens=200, max_size=8)
+        self.assertTrue(all(tokens <= 200 and len(batch) <= 8 for _, batch, tokens in batches))
+        self.assertEqual([t for _, batch, _ in batches for t in batch], texts)
+        self.assertEqual([offset for offset, _, _ in batches], [0] + [
+            sum(len(b) for _, b, _ in batches[:i]) for i in range(1, len(batches))
+        ])
+
+    def test_concurrent_batches_keep_input_order(self):
+        texts = [f"{i} texto" for i in range(300)]
+        threads = set()
+
+        def create(model, input):
+            threads.add(threading.current_thread().name)
+            return echo_create(model, input)
+
+        with mock.patch.object(embeddings, "client", fake_client(create)), \
+                mock.patch.object(embeddings, "EMBEDDING_BATCH_SIZE", 16), \
+                mock.patch.object(embeddings, "EMBEDDING_CONCURRENCY", 4):
+            vectors = embeddings._embed_api(texts)
+        self.assertEqual(vectors, [[float(i)] for i in range(300)])
+        self.assertGreater(len(threads), 1)
+
+    def test_rate_limit_honours_retry_after(self):
+        calls = []
+
+        def create(model, input):
+            calls.append(len(input))
+            if len(calls) == 1:
+                # 429 con cabecera Retry-After (sin depender del cliente HTTP que use openai)
+                error = openai.RateLimitError.__new__(openai.RateLimitError)
+                error.response = SimpleNamespace(headers={"retry-after": "2"})
+                raise error
+            return echo_create(model, input)
+
+        sleeps = []
+        with mock.patch.object(embeddings, "client", fake_client(create)), \
+                mock.patch.object(embeddings.time, "sleep", sleeps.append):
+            vectors = embeddings._embed_api(["1 a", "2 b"])
+        self.assertEqual(vectors, [[1.0], [2.0]])
+        self.assertEqual(len(calls), 2)
+        self.assertTrue(2.0 <= sleeps[0] <= 2.5)
+
+    def test_token_budget_waits_when_exhausted(self):
+        budget = embeddings.TokenBudget(tokens_per_minute=600)
+        sleeps = []
+        with mock.patch.object(embeddings.time, "sleep", lambda s: (sleeps.append(s), setattr(
+            budget, "updated", budget.updated - s))):
+            budget.acquire(600)
+            budget.acquire(60)
+        self.assertEqual(len(sleeps), 1)
+        self.assertAlmostEqual(sleeps[0], 6.0, delta=0.1)
+
+
+class TestQueryCache(unittest.TestCase):
+    def test_lru_evicts_oldest_and_expires(self):
+        cache = LRUCache(max_entries=2, ttl=0)
+        cache.put("a", 1)
+        cache.put("b", 2)
+        cache.get("a")
+        cache.put("c", 3)
+        self.assertIsNone(cache.get("b"))
+        self.assertEqual((cache.get("a"), cache.get("c")), (1, 3))
+
+        expiring = LRUCache(max_entries=2, ttl=10)
+        expiring.put("a", 1)
+        with mock.patch("utils.lru_cache.time.monotonic", return_value=embeddings.time.monotonic() + 11):
+            self.assertIsNone(expiring.get("a"))
+        self.assertEqual(cache.stats()["hit_rate"], round(3 / 4, 4))
+
+    def test_repeated_query_skips_api(self):
+        calls = []
+
+        def create(model, input):
+            calls.append(list(input))
+            return SimpleNamespace(data=[SimpleNamespace(embedding=[1.0, 2.0]) for _ in input])
+
+        with mock.patch.object(embeddings, "client", fake_client(create)), \
+                mock.patch.object(embeddings, "query_cache", LRUCache(10, 60)):
+            first = embeddings.embed_query("qué es la inflación")
+            second = embeddings.embed_query("qué es la inflación")
+            stats = embeddings.query_cache_stats()
+        self.assertEqual(first, second)
+        self.assertEqual(len(calls), 1)
+        self.assertEqual((stats["hits"], stats["misses"]), (1, 1))
+
+
+class TestMicroBatcher(unittest.TestCase):
+    def test_concurrent_calls_share_one_batch(self):
+        batches = []
+        release = threading.Event()
+
+        def fn(items):
+            batches.append(list(items))
+            return [item * 10 for item in items]
+
+        batcher = MicroBatcher(fn, max_batch=8, max_wait=0.2)
+        results = {}
+
+        def worker(i):
+            release.wait()
+            results[i] = batcher(i)
+
+        threads = [threading.Thread(target=worker, args=(i,)) for i in range(5)]
+        for t in threads:
+            t.start()
+        release.set()
+        for t in threads:
+            t.join()
+
+        self.assertEqual(results, {i: i * 10 for i in range(5)})
+        self.assertEqual(len(batches), 1)
+        self.assertEqual(batcher.stats()["avg_batch_size"], 5)
+
+    def test_max_batch_and_errors_fan_out(self):
+        batcher = MicroBatcher(lambda items: [len(items)] * len(items), max_batch=2, max_wait=0.2)
+        futures = [batcher.submit(i) for i in range(3)]
+        self.assertEqual([f.result() for f in futures], [2, 2, 1])
+
+        def fail(items):
+            raise RuntimeError("API caída")
+
+        failing = MicroBatcher(fail, max_wait=0.01)
+        with self.assertRaises(RuntimeError):
+            failing("x")
+
+    def test_query_batcher_sends_one_request(self):
+        calls = []
+
+        def create(model, input):
+            calls.append(list(input))
+            return SimpleNamespace(data=[SimpleNamespace(embedding=[float(len(t))]) for t in input])
+
+        batcher = MicroBatcher(embeddings._embed_query_batch, max_batch=16, max_wait=0.2)
+        with mock.patch.object(embeddings, "client", fake_client(create)):
+            futures = [batcher.submit(q) for q in ("a", "bb", "a", "ccc")]
+            results = [f.result() for f in futures]
+        self.assertEqual(results, [[1.0], [2.0], [1.0], [3.0]])
+        self.assertEqual(calls, [["a", "bb", "ccc"]])
+
+    def test_cancelled_async_flush_releases_callers(self):
+        started = asyncio.Event()
+
+        async def slow(items):
+            started.set()
+            await asyncio.sleep(10)
+
+        batcher = AsyncMicroBatcher(slow, max_wait=0.01)
+
+        async def run():
+            callers = [asyncio.ensure_future(batcher.submit(i)) for i in range(3)]
+            await started.wait()
+            for task in list(batcher._tasks):
+                task.cancel()
+            done = await asyncio.wait_for(asyncio.gather(*callers, return_exceptions=True), 1)
+            # Una ventana nueva sigue funcionando tras la cancelación
+            batcher.fn = lambda items: asyncio.sleep(0, [item * 2 for item in items])
+            return done, await batcher.submit(4)
+
+        done, after = asyncio.run(run())
+        self.assertTrue(all(isinstance(r, asyncio.CancelledError) for r in done))
+        self.assertEqual(after, 8)
+
+
+if __name__ == "__main__":
+    unittest.main()
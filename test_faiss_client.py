@@ -0,0 +1,426 @@
+import os
+import pickle
+import shutil
+import tempfile
+import time
+import unittest
+from unittest import mock
+
+import numpy as np
+
+import utils.index_factory as index_factory
+from utils.faiss_client import FAISSClient
+
+
+def random_vectors(n, dim, seed=0):
+    rng = np.random.default_rng(seed)
+    return rng.standard_normal((n, dim)).astype("float32")
+
+
+class TestIndexFactory(unittest.TestCase):
+    def test_build_all_types(self):
+        vectors = random_vectors(2000, 32)
+        for index_type in index_factory.INDEX_TYPES:
+            index = index_factory.train_and_fill(32, index_type, vectors)
+            self.assertEqual(index.ntotal, 2000)
+            self.assertEqual(index_factory.index_type_of(index), index_type)
+
+    def test_pq_subquantizers_divide_dim(self):
+        self.assertEqual(index_factory.pq_subquantizers(1536, 64), 64)
+        self.assertEqual(index_factory.pq_subquantizers(100, 64), 50)
+
+    def test_migrate_keeps_nearest_neighbours(self):
+        tmp = tempfile.mkdtemp()
+        try:
+            vectors = random_vectors(3000, 16)
+            flat = index_factory.train_and_fill(16, "flat", vectors)
+            path = os.path.join(tmp, "faiss_index.bin")
+            index_factory.faiss.write_index(flat, path)
+
+            index_factory.migrate_index_file(path, "hnsw")
+            migrated = index_factory.faiss.read_index(path)
+            self.assertEqual(index_factory.index_type_of(migrated), "hnsw")
+            _, ids = migrated.search(vectors[:5], 1)
+            self.assertEqual(ids[:, 0].tolist(), [0, 1, 2, 3, 4])
+        finally:
+            shutil.rmtree(tmp)
+
+
+class TestFAISSClient(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.cwd = os.getcwd()
+        os.chdir(self.tmp)
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+        shutil.rmtree(self.tmp)
+
+    def test_trains_configured_type_once_enough_vectors(self):
+        original = index_factory.FAISS_MIN_TRAIN_SIZE
+        index_factory.FAISS_MIN_TRAIN_SIZE = 500
+        try:
+            client = FAISSClient(dim=16, index_type="ivf")
+            vectors = random_vectors(600, 16)
+            client.add_embeddings(vectors[:300], [{"text": str(i), "source": "a.txt"} for i in range(300)])
+            client.merge_segments()
+            self.assertEqual(index_factory.index_type_of(client.index), "flat")
+
+            client.add_embeddings(vectors[300:], [{"text": str(i), "source": "a.txt"} for i in range(300, 600)])
+            client.merge_segments()
+            self.assertEqual(index_factory.index_type_of(client.index), "ivf")
+
+            results = client.query(vectors[42], top_k=1)
+            self.assertEqual(results[0]["text"], "42")
+        finally:
+            index_factory.FAISS_MIN_TRAIN_SIZE = original
+
+    def test_add_appends_segments_and_replays_on_restart(self):
+        client = FAISSClient(dim=8)
+        vectors = random_vectors(30, 8)
+        for i in range(3):
+            client.add_embeddings(vectors[i * 10:(i + 1) * 10], [{"text": str(j)} for j in range(i * 10, (i + 1) * 10)])
+        self.assertEqual(len(client.store.manifest["segments"]), 3)
+        self.assertIsNone(client.base)
+
+        reopened = FAISSClient(dim=8)
+        self.assertEqual(reopened.ntotal, 30)
+        self.assertEqual(reopened.query(vectors[25], top_k=1)[0]["text"], "25")
+
+    def test_merge_compacts_segments_into_base(self):
+        client = FAISSClient(dim=8)
+        vectors = random_vectors(20, 8)
+        client.add_embeddings(vectors[:10], [{"text": str(j)} for j in range(10)])
+        client.add_embeddings(vectors[10:], [{"text": str(j)} for j in range(10, 20)])
+        client.merge_segments()
+        self.assertEqual(client.store.manifest["segments"], [])
+        self.assertEqual(client.base.ntotal, 20)
+
+        client.add_embeddings(vectors[:1] + 0.01, [{"text": "nuevo"}])
+        reopened = FAISSClient(dim=8)
+        self.assertEqual(reopened.ntotal, 21)
+        self.assertEqual(reopened.query(vectors[15], top_k=1)[0]["text"], "15")
+        stale = [name for name in os.listdir(client.store.root)
+                 if name.startswith(("base-", "seg-")) and name not in client.store.live_files(client.store.manifest)]
+        self.assertEqual(stale, [])
+
+    def test_merge_keeps_other_writers_tmp_files(self):
+        client = FAISSClient(dim=8)
+        client.add_embeddings(random_vectors(10, 8), [{"text": str(j)} for j in range(10)])
+        # documents.json.tmp lo escribe el manifest de documentos sin el lock del store
+        foreign = os.path.join(client.store.root, "documents.json.tmp")
+        with open(foreign, "w") as f:
+            f.write("{}")
+        half_written = client.store.path("base-999999.faiss.tmp")
+        with open(half_written, "wb") as f:
+            f.write(b"x")
+        client.merge_segments()
+        self.assertTrue(os.path.exists(foreign))
+        self.assertFalse(os.path.exists(half_written))
+
+    def test_uncommitted_log_tail_is_discarded(self):
+        client = FAISSClient(dim=8)
+        vectors = random_vectors(10, 8)
+        client.add_embeddings(vectors[:5], [{"text": str(j)} for j in range(5)])
+        # Simula una caída tras escribir vectores pero antes de publicar el manifest
+        client.store.append_vectors(vectors[5:])
+
+        reopened = FAISSClient(dim=8)
+        self.assertEqual(reopened.ntotal, 5)
+        reopened.add_embeddings(vectors[5:], [{"text": str(j)} for j in range(5, 10)])
+        self.assertEqual(reopened.query(vectors[7], top_k=1)[0]["text"], "7")
+
+    def test_misaligned_log_is_rejected_before_writing(self):
+        client = FAISSClient(dim=8)
+        vectors = random_vectors(10, 8)
+        client.add_embeddings(vectors[:5], [{"text": str(j)} for j in range(5)])
+        client.store.append_vectors(vectors[5:7])
+        log_path = client.store.path("vectors.f32")
+        size = os.path.getsize(log_path)
+        with self.assertRaises(RuntimeError):
+            client.add_embeddings(vectors[7:], [{"text": str(j)} for j in range(7, 10)])
+        self.assertEqual(os.path.getsize(log_path), size)
+        self.assertEqual(client.ntotal, 5)
+
+    def test_imports_legacy_index(self):
+        vectors = random_vectors(10, 8)
+        legacy = index_factory.train_and_fill(8, "flat", vectors)
+        index_factory.faiss.write_index(legacy, "faiss_index.bin")
+        with open("metadata.pkl", "wb") as f:
+            pickle.dump([{"text": str(j)} for j in range(10)], f)
+
+        client = FAISSClient(dim=8)
+        self.assertEqual(client.ntotal, 10)
+        self.assertEqual(client.query(vectors[3], top_k=1)[0]["text"], "3")
+
+    def test_read_only_client_maps_base_and_rejects_writes(self):
+        writer = FAISSClient(dim=8)
+        vectors = random_vectors(20, 8)
+        writer.add_embeddings(vectors[:15], [{"text": str(j)} for j in range(15)])
+        writer.merge_segments()
+        writer.add_embeddings(vectors[15:], [{"text": str(j)} for j in range(15, 20)])
+
+        reader = FAISSClient(dim=8, read_only=True)
+        self.assertEqual(reader.ntotal, 20)
+        self.assertEqual(reader.query(vectors[17], top_k=1)[0]["text"], "17")
+        with self.assertRaises(RuntimeError):
+            reader.add_embeddings(vectors[:1], [{"text": "x"}])
+
+        stats = reader.memory_stats()
+        if stats["available"]:
+            self.assertIn(writer.store.manifest["base"]["index"], stats["index_mapped"]["files"])
+
+    def test_other_process_generation_is_swapped_in_by_refresh(self):
+        serving = FAISSClient(dim=8)
+        vectors = random_vectors(10, 8)
+        serving.add_embeddings(vectors[:5], [{"text": str(j)} for j in range(5)])
+        base_before = serving.base
+
+        # Otra instancia (otro proceso) publica un segmento nuevo
+        other = FAISSClient(dim=8)
+        other.add_embeddings(vectors[5:], [{"text": str(j)} for j in range(5, 10)])
+
+        # La consulta no toca el disco: sigue en la generación actual hasta el swap
+        self.assertEqual(serving.ntotal, 5)
+        self.assertNotEqual(serving.query(vectors[8], top_k=1)[0]["text"], "8")
+
+        self.assertTrue(serving.refresh())
+        self.assertEqual(serving.query(vectors[8], top_k=1)[0]["text"], "8")
+        self.assertIs(serving.base, base_before)
+        self.assertEqual(serving.generation, other.generation)
+        self.assertFalse(serving.refresh())
+
+    def test_in_flight_generation_survives_merge(self):
+        client = FAISSClient(dim=8)
+        vectors = random_vectors(10, 8)
+        client.add_embeddings(vectors, [{"text": str(j)} for j in range(10)])
+        old = client._current
+        client.merge_segments()
+        self.assertIsNot(client._current, old)
+        self.assertEqual(old.search(vectors[3:4], 1)[0][1], 3)
+
+    def test_watcher_swaps_foreign_merge(self):
+        serving = FAISSClient(dim=8)
+        serving.start_watcher(interval=0.05)
+        try:
+            other = FAISSClient(dim=8)
+            vectors = random_vectors(10, 8)
+            other.add_embeddings(vectors, [{"text": str(j)} for j in range(10)])
+            other.merge_segments()
+            deadline = time.time() + 5
+            while serving.generation != other.generation and time.time() < deadline:
+                time.sleep(0.02)
+            self.assertEqual(serving.base_upto, 10)
+            self.assertEqual(serving.query(vectors[6], top_k=1)[0]["text"], "6")
+        finally:
+            serving.stop_watcher()
+
+    def test_deleted_ids_are_excluded_and_survive_restart(self):
+        client = FAISSClient(dim=8)
+        vectors = random_vectors(20, 8)
+        client.add_embeddings(vectors, [{"text": str(j), "source": f"d{j % 2}.txt", "chunk_index": j} for j in range(20)])
+        client.merge_segments()
+
+        # Sin compactación automática: los borrados viven solo como tombstones
+        with mock.patch("utils.faiss_client.FAISS_COMPACT_RATIO", 1.0):
+            self.assertEqual(client.delete_document("d0.txt"), 10)
+        self.assertEqual(client.base.ntotal, 20)
+        hits = client.query(vectors[4], top_k=20)
+        self.assertEqual(len(hits), 10)
+        self.assertTrue(all(hit["source"] == "d1.txt" for hit in hits))
+
+        reopened = FAISSClient(dim=8)
+        self.assertEqual(len(reopened.query(vectors[4], top_k=20)), 10)
+
+    def test_compaction_purges_deleted_chunks(self):
+        client = FAISSClient(dim=8)
+        vectors = random_vectors(20, 8)
+        client.add_embeddings(vectors, [{"text": str(j), "source": "a.txt", "chunk_index": j} for j in range(20)])
+        client.merge_segments()
+        client.delete_ids(range(5))
+        client.compact()
+
+        self.assertEqual(client.base.ntotal, 15)
+        self.assertEqual(client.chunks.tombstones(), frozenset())
+        self.assertEqual(client.chunks.get(range(5)), {})
+        self.assertEqual(client.query(vectors[7], top_k=1)[0]["text"], "7")
+
+        # Los ids no se reutilizan: lo añadido después sigue detrás del log
+        client.add_embeddings(random_vectors(2, 8, seed=1), [{"text": "x", "source": "b.txt"}] * 2)
+        self.assertEqual(client.ntotal, 22)
+
+    def test_upsert_replaces_previous_chunks(self):
+        os.environ.setdefault("OPENAI_API_KEY", "test")
+        import utils.document_processor as document_processor
+
+        def fake_embeddings(texts):
+            return [random_vectors(1, 8, seed=len(t))[0] for t in texts]
+
+        with open("doc.txt", "w", encoding="utf-8") as f:
+            f.write("uno dos tres " * 100)
+        client = FAISSClient(dim=8)
+        with mock.patch.object(document_processor, "generate_embeddings", fake_embeddings):
+            first = client.upsert_document("doc.txt")
+            second = client.upsert_document("doc.txt")
+
+        self.assertEqual(len(first), len(second))
+        live = client.chunks.ids_for_source("doc.txt")
+        self.assertEqual(len(live), len(second))
+        self.assertEqual(min(live), client.ntotal - len(second))
+
+    def test_sync_documents_only_processes_new_or_changed_files(self):
+        os.environ.setdefault("OPENAI_API_KEY", "test")
+        import utils.document_processor as document_processor
+
+        embedded = []
+
+        def fake_embeddings(texts):
+            embedded.extend(texts)
+            return [random_vectors(1, 8, seed=len(t))[0] for t in texts]
+
+        os.mkdir("docs")
+        for name, words in (("a.txt", "uno dos tres "), ("b.txt", "cuatro cinco "), ("c.md", "seis ")):
+            with open(os.path.join("docs", name), "w", encoding="utf-8") as f:
+                f.write(words * 100)
+
+        with mock.patch.object(document_processor, "generate_embeddings", fake_embeddings):
+            first = FAISSClient(dim=8).sync_documents("docs")
+            self.assertEqual((first["added"], first["unchanged"]), (["a.txt", "b.txt"], []))
+
+            # Reinicio sin cambios: nada se reprocesa, aunque cambie el mtime
+            embedded.clear()
+            os.utime(os.path.join("docs", "a.txt"), ns=(1, 1))
+            client = FAISSClient(dim=8)
+            ntotal = client.ntotal
+            second = client.sync_documents("docs")
+            self.assertEqual(second["unchanged"], ["a.txt", "b.txt"])
+            self.assertEqual((embedded, client.ntotal), ([], ntotal))
+
+            # Un fichero modificado se reindexa y uno borrado sale del índice
+            with open(os.path.join("docs", "a.txt"), "a", encoding="utf-8") as f:
+                f.write("siete ocho")
+            os.remove(os.path.join("docs", "b.txt"))
+            client = FAISSClient(dim=8)
+            third = client.sync_documents("docs")
+        self.assertEqual((third["updated"], third["removed"]), (["a.txt"], ["b.txt"]))
+        self.assertEqual(client.chunks.ids_for_source("b.txt"), [])
+        self.assertEqual(client.documents.sources(), ["a.txt"])
+        self.assertTrue(embedded)
+
+        # Cambiar el chunking obliga a reindexar
+        with mock.patch.object(document_processor, "CHUNK_SIZE", 50), \
+                mock.patch.object(document_processor, "generate_embeddings", fake_embeddings):
+            self.assertEqual(FAISSClient(dim=8).sync_documents("docs")["updated"], ["a.txt"])
+
+    def test_filtered_query_returns_top_k_matching_chunks(self):
+        original = index_factory.FAISS_MIN_TRAIN_SIZE
+        index_factory.FAISS_MIN_TRAIN_SIZE = 500
+        try:
+            client = FAISSClient(dim=16, index_type="ivf")
+            vectors = random_vectors(2000, 16)
+            # Filtro muy selectivo: 8 de 2000 chunks
+            metas = [{"text": str(j), "source": "raro.txt" if j % 250 == 0 else "comun.txt", "chunk_index": j}
+                     for j in range(2000)]
+            client.add_embeddings(vectors, metas)
+            client.merge_segments()
+            self.assertEqual(index_factory.index_type_of(client.index), "ivf")
+
+            allowed = client.chunks.ids_matching("source", lambda v: v == "raro.txt")
+            for exact_max in (0, 4096):  # selector dentro del índice IVF y camino exacto
+                with mock.patch("utils.faiss_client.FAISS_FILTER_EXACT_MAX", exact_max):
+                    hits = client.query(vectors[3], top_k=5, allowed_ids=allowed)
+                self.assertEqual(len(hits), 5)
+                self.assertTrue(all(hit["source"] == "raro.txt" for hit in hits))
+
+            # Los borrados no cuentan aunque estén en el filtro
+            client.delete_ids([0])
+            hits = client.query(vectors[0], top_k=10, allowed_ids=allowed)
+            self.assertEqual(len(hits), 7)
+            self.assertNotIn("0", [hit["text"] for hit in hits])
+        finally:
+            index_factory.FAISS_MIN_TRAIN_SIZE = original
+
+    def test_quantized_base_is_reranked_with_exact_vectors(self):
+        client = FAISSClient(dim=32, index_type="sq8")
+        vectors = random_vectors(500, 32)
+        client.add_embeddings(vectors, [{"text": str(j), "source": "a.txt", "chunk_index": j} for j in range(500)])
+        client.merge_segments()
+        self.assertEqual(index_factory.index_type_of(client.index), "sq8")
+
+        query = vectors[10] + 0.01
+        exact = np.argsort(((vectors - query) ** 2).sum(axis=1))[:5]
+        hits = client.query(query, top_k=5)
+        self.assertEqual([int(hit["text"]) for hit in hits], exact.tolist())
+        self.assertEqual(hits[0]["relevance_score"], round(1 / (1 + float(((vectors[10] - query) ** 2).sum())), 4))
+
+        report = client.index_memory()
+        self.assertTrue(report["quantized"])
+        self.assertLess(report["bytes"], report["float32_bytes"])
+        self.assertEqual(report["saved_bytes"], report["float32_bytes"] - report["bytes"])
+
+    def test_query_batch_matches_single_queries(self):
+        client = FAISSClient(dim=8)
+        vectors = random_vectors(60, 8)
+        metas = [{"text": str(j), "source": f"d{j % 3}.txt", "chunk_index": j} for j in range(60)]
+        client.add_embeddings(vectors[:40], metas[:40])
+        client.merge_segments()
+        client.add_embeddings(vectors[40:], metas[40:])  # base + segmento delta
+
+        allowed = client.chunks.ids_matching("source", lambda v: v == "d1.txt")
+        queries = vectors[[3, 45, 7]]
+        batch = client.query_batch(queries, top_k=4, allowed_ids=[None, None, allowed])
+        expected = [client.query(queries[0], 4), client.query(queries[1], 4),
+                    client.query(queries[2], 4, allowed_ids=allowed)]
+        self.assertEqual(batch, expected)
+        self.assertTrue(all(hit["source"] == "d1.txt" for hit in batch[2]))
+
+    def test_coalescer_merges_concurrent_searches(self):
+        import threading
+
+        client = FAISSClient(dim=8)
+        vectors = random_vectors(30, 8)
+        client.add_embeddings(vectors, [{"text": str(j), "chunk_index": j} for j in range(30)])
+        calls = []
+        original = client.query_batch
+
+        def counting_batch(*args, **kwargs):
+            calls.append(len(args[0]))
+            return original(*args, **kwargs)
+
+        results = {}
+        start = threading.Event()
+
+        def worker(i):
+            start.wait()
+            results[i] = client.query_coalesced(vectors[i], top_k=1 + i % 3)
+
+        with mock.patch("utils.faiss_client.FAISS_COALESCE_WAIT_MS", 200), \
+                mock.patch.object(client, "query_batch", counting_batch):
+            client._coalescer.max_wait = 0.2
+            threads = [threading.Thread(target=worker, args=(i,)) for i in range(6)]
+            for t in threads:
+                t.start()
+            start.set()
+            for t in threads:
+                t.join()
+
+        self.assertEqual(sum(calls), 6)
+        self.assertLess(len(calls), 6)
+        for i in range(6):
+            self.assertEqual(len(results[i]), 1 + i % 3)
+            self.assertEqual(results[i][0]["text"], str(i))
+
+    def test_get_client_is_shared(self):
+        import utils.faiss_client as faiss_client
+        faiss_client._shared_client = None
+        try:
+            first = faiss_client.get_client(dim=8)
+            self.assertIs(faiss_client.get_client(dim=8), first)
+            with self.assertRaises(ValueError):
+                faiss_client.get_client(dim=16)
+        finally:
+            faiss_client._shared_client = None
+
+
+if __name__ == "__main__":
+    unittest.main()
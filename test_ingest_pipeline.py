@@ -0,0 +1,153 @@
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+from unittest import mock
+
+import numpy as np
+
+os.environ.setdefault("OPENAI_API_KEY", "test")
+import utils.document_processor as document_processor  # noqa: E402
+import utils.pdf_extract as pdf_extract  # noqa: E402
+from utils.faiss_client import FAISSClient  # noqa: E402
+from utils.ingest_pipeline import batched, iter_in_thread, map_ahead  # noqa: E402
+
+
+def fake_embeddings(texts):
+    rng = np.random.default_rng(len(texts))
+    return rng.standard_normal((len(texts), 8)).astype("float32")
+
+
+class TestStages(unittest.TestCase):
+    def test_iter_in_thread_applies_backpressure(self):
+        produced = []
+
+        def pages():
+            for i in range(100):
+                produced.append(i)
+                yield i
+
+        items = iter_in_thread(pages(), 3, "test")
+        self.assertEqual(next(items), 0)
+        time.sleep(0.1)
+        # El productor se detiene cuando la cola está llena (+1 elemento en la mano)
+        self.assertLessEqual(len(produced), 6)
+        items.close()
+        self.assertLess(len(produced), 100)
+
+    def test_iter_in_thread_propagates_errors(self):
+        def pages():
+            yield 1
+            raise ValueError("página corrupta")
+
+        with self.assertRaises(ValueError):
+            list(iter_in_thread(pages(), 2, "test"))
+
+    def test_map_ahead_keeps_order_with_calls_in_flight(self):
+        active, peak = [0], [0]
+        lock = threading.Lock()
+
+        def slow(i):
+            with lock:
+                active[0] += 1
+                peak[0] = max(peak[0], active[0])
+            time.sleep(0.01 * (5 - i % 5))
+            with lock:
+                active[0] -= 1
+            return i * 2
+
+        self.assertEqual(list(map_ahead(slow, range(10), 3, "test")), [i * 2 for i in range(10)])
+        self.assertEqual(peak[0], 3)
+        self.assertEqual(list(batched(range(5), 2)), [[0, 1], [2, 3], [4]])
+
+
+class TestStreamingIngestion(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.cwd = os.getcwd()
+        os.chdir(self.tmp)
+        self.client = FAISSClient(dim=8)
+        self.processor = document_processor.DocumentProcessor(self.client)
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+        shutil.rmtree(self.tmp)
+
+    def pages(self, n):
+        for page in range(1, n + 1):
+            yield page, f"Página {page}. " + "el viajero recorre los caminos del norte. " * 60
+
+    def test_pages_are_chunked_embedded_and_written_in_batches(self):
+        with mock.patch.object(document_processor, "generate_embeddings", fake_embeddings), \
+                mock.patch.object(document_processor, "INGEST_EMBED_BATCH", 4), \
+                mock.patch.object(document_processor, "INGEST_INDEX_BATCH", 8):
+            metadatas = self.processor._ingest(self.pages(12), "libro.pdf", {"source": "libro.pdf"})
+
+        self.assertEqual([m["chunk_index"] for m in metadatas], list(range(len(metadatas))))
+        self.assertEqual(sorted({m["page"] for m in metadatas}), list(range(1, 13)))
+        self.assertEqual(len(self.client.chunks.ids_for_source("libro.pdf")), len(metadatas))
+        # Varios segmentos: el índice se escribe por lotes, no al final
+        self.assertGreater(len(self.client.store.manifest["segments"]), 1)
+
+    def test_failure_rolls_back_written_chunks(self):
+        calls = [0]
+
+        def failing_embeddings(texts):
+            calls[0] += 1
+            if calls[0] == 4:
+                raise RuntimeError("API caída")
+            return fake_embeddings(texts)
+
+        with mock.patch.object(document_processor, "generate_embeddings", failing_embeddings), \
+                mock.patch.object(document_processor, "INGEST_EMBED_BATCH", 2), \
+                mock.patch.object(document_processor, "INGEST_EMBED_CONCURRENCY", 1), \
+                mock.patch.object(document_processor, "INGEST_INDEX_BATCH", 2):
+            with self.assertRaises(RuntimeError):
+                self.processor._ingest(self.pages(12), "libro.pdf", {"source": "libro.pdf"})
+        self.assertGreater(self.client.ntotal, 0)
+        self.assertEqual(self.client.chunks.ids_for_source("libro.pdf"), [])
+
+    def test_pdf_fallback_discards_method_with_little_content(self):
+        def empty_pages(path, progress):
+            yield from ("", "  ", "x")
+
+        def good_pages(path, progress):
+            yield from ("a" * 80, "b" * 80, "c")
+
+        with mock.patch.object(self.processor, "_pymupdf_pages", empty_pages), \
+                mock.patch.object(self.processor, "_pdfplumber_pages", good_pages), \
+                mock.patch.object(document_processor, "HAS_PYMUPDF", True), \
+                mock.patch.object(document_processor, "HAS_PDFPLUMBER", True):
+            pages = list(self.processor._iter_pdf_pages("libro.pdf"))
+        self.assertEqual(pages, [(1, "a" * 80), (2, "b" * 80), (3, "c")])
+
+
+BUNDLED_PDF = os.path.join(os.path.dirname(os.path.abspath(__file__)), "documents",
+                           "el-viaje-romantico-peregrinaciones-y-descubrimientos-1266092.pdf")
+
+
+@unittest.skipUnless(pdf_extract.HAS_PYMUPDF and os.path.exists(BUNDLED_PDF), "requiere PyMuPDF y el PDF de ejemplo")
+class TestParallelPdfExtraction(unittest.TestCase):
+    def tearDown(self):
+        pdf_extract.shutdown_pool()
+
+    def test_process_pool_reassembles_pages_in_order(self):
+        progress = []
+
+        def record(stage, **counters):
+            progress.append(counters)
+
+        with mock.patch.object(pdf_extract, "PDF_EXTRACT_PAGES_PER_TASK", 40), \
+                mock.patch.object(pdf_extract, "PDF_EXTRACT_MIN_PAGES", 0):
+            parallel = list(pdf_extract.iter_pymupdf_pages(BUNDLED_PDF, record, workers=2))
+        sequential = list(pdf_extract.iter_pymupdf_pages(BUNDLED_PDF, lambda stage, **c: None, workers=1))
+
+        self.assertEqual(parallel, sequential)
+        self.assertEqual(progress[0]["pages_total"], len(sequential))
+        self.assertEqual(progress[-1]["pages_done"], len(sequential))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,114 @@
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+from unittest import mock
+
+import numpy as np
+
+os.environ.setdefault("OPENAI_API_KEY", "test")
+import utils.document_processor as document_processor  # noqa: E402
+from utils.faiss_client import FAISSClient  # noqa: E402
+from utils.ingestion_jobs import DONE, FAILED, IngestionQueue, IngestionQueueFull  # noqa: E402
+
+
+def fake_embeddings(texts):
+    rng = np.random.default_rng(len(texts))
+    return rng.standard_normal((len(texts), 8)).astype("float32")
+
+
+class TestIngestionQueue(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.cwd = os.getcwd()
+        os.chdir(self.tmp)
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+        shutil.rmtree(self.tmp)
+
+    def test_job_reports_progress_per_stage(self):
+        with open("doc.txt", "w", encoding="utf-8") as f:
+            f.write("uno dos tres cuatro. " * 400)
+        client = FAISSClient(dim=8)
+        stages = []
+
+        def run(job):
+            def progress(stage, **counters):
+                stages.append((stage, counters))
+                job.progress(stage, **counters)
+            return {"chunks": len(client.upsert_document(job.path, {"source": job.source}, progress=progress))}
+
+        jobs = IngestionQueue(run, workers=1)
+        with mock.patch.object(document_processor, "generate_embeddings", fake_embeddings), \
+                mock.patch.object(document_processor, "INGEST_EMBED_BATCH", 2):
+            job = jobs.submit("upload", "doc.txt", "doc.txt")
+            jobs.join()
+
+        state = job.to_dict()
+        self.assertEqual(state["status"], DONE)
+        self.assertEqual(state["result"]["chunks"], len(client.chunks.ids_for_source("doc.txt")))
+        self.assertEqual(state["chunks_embedded"], state["chunks_total"])
+        self.assertEqual(
+            [s for s, _ in stages if s != "embedding"], ["extracting", "chunking", "indexing"]
+        )
+        # El embedding se informa por tandas
+        embedded = [c["chunks_embedded"] for s, c in stages if s == "embedding"]
+        total = state["chunks_total"]
+        self.assertEqual(embedded, list(range(2, total, 2)) + [total])
+        self.assertGreater(state["version"], len(stages))
+
+    def test_failed_job_keeps_error_and_stage(self):
+        def run(job):
+            job.progress("extracting", pages_done=0, pages_total=3)
+            raise ValueError("PDF ilegible")
+
+        jobs = IngestionQueue(run, workers=1)
+        job = jobs.submit("reindex", "x.pdf", "x.pdf")
+        jobs.join()
+        self.assertEqual(job.status, FAILED)
+        self.assertEqual(job.errors, ["extracting: PDF ilegible"])
+        self.assertEqual(jobs.stats()["failed"], 1)
+
+    def test_queue_is_bounded_and_workers_limited(self):
+        release = threading.Event()
+        running = threading.Semaphore(0)
+        active, peak = [0], [0]
+        lock = threading.Lock()
+
+        def run(job):
+            with lock:
+                active[0] += 1
+                peak[0] = max(peak[0], active[0])
+            running.release()
+            release.wait(5)
+            with lock:
+                active[0] -= 1
+
+        jobs = IngestionQueue(run, workers=2, max_pending=3)
+        submitted = [jobs.submit("upload", f"{i}.txt", f"{i}.txt") for i in range(2)]
+        self.assertTrue(running.acquire(timeout=5) and running.acquire(timeout=5))
+        # Los dos workers están ocupados: caben 3 en espera y el siguiente se rechaza
+        submitted += [jobs.submit("upload", f"{i}.txt", f"{i}.txt") for i in range(2, 5)]
+        with self.assertRaises(IngestionQueueFull):
+            jobs.submit("upload", "5.txt", "5.txt")
+        self.assertEqual(jobs.stats()["queued"], 3)
+        release.set()
+        jobs.join()
+        self.assertEqual(peak[0], 2)
+        self.assertTrue(all(job.status == DONE for job in submitted))
+
+    def test_history_drops_oldest_finished_jobs(self):
+        jobs = IngestionQueue(lambda job: None, workers=1, history=2)
+        first = jobs.submit("upload", "a.txt", "a.txt")
+        jobs.join()
+        for name in ("b.txt", "c.txt", "d.txt"):
+            jobs.submit("upload", name, name)
+            jobs.join()
+        self.assertIsNone(jobs.get(first.id))
+        self.assertEqual([job.source for job in jobs.jobs()][:2], ["d.txt", "c.txt"])
+
+
+if __name__ == "__main__":
+    unittest.main()
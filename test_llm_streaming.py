@@ -0,0 +1,99 @@
+import asyncio
+import os
+import unittest
+from types import SimpleNamespace
+from unittest import mock
+
+os.environ.setdefault("OPENAI_API_KEY", "test")
+import utils.llm_client as llm_client  # noqa: E402
+from nodes.response_generator_node import ResponseGenerator  # noqa: E402
+
+
+def chunk(content):
+    return SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=content))])
+
+
+class FakeStream:
+    def __init__(self, tokens):
+        self.tokens = tokens
+        self.sent = 0
+        self.closed = False
+
+    async def __aiter__(self):
+        for token in self.tokens:
+            if self.closed:
+                return
+            self.sent += 1
+            await asyncio.sleep(0)
+            yield chunk(token)
+
+    async def close(self):
+        self.closed = True
+
+
+def fake_client(stream):
+    async def create(model, messages, stream=False, **kwargs):
+        return stream_obj if stream else SimpleNamespace(
+            choices=[SimpleNamespace(message=SimpleNamespace(content="".join(stream_obj.tokens)))]
+        )
+    stream_obj = stream
+    return SimpleNamespace(chat=SimpleNamespace(completions=SimpleNamespace(create=create)))
+
+
+async def collect(stream):
+    return [item async for item in stream]
+
+
+CHUNKS = [
+    {"text": "El centro abre de lunes a viernes por la mañana.", "source": "a.txt", "page": 1, "relevance_score": 0.8},
+]
+
+
+class TestLLMStreaming(unittest.TestCase):
+    def test_acall_llm_stream_yields_deltas(self):
+        stream = FakeStream(["Hola", None, " mundo"])
+
+        async def run():
+            return await collect(await llm_client.acall_llm("p", stream=True))
+
+        with mock.patch.object(llm_client, "get_async_client", return_value=fake_client(stream)):
+            self.assertEqual(asyncio.run(run()), ["Hola", " mundo"])
+        self.assertTrue(stream.closed)
+
+    def test_agenerate_stream_matches_agenerate(self):
+        tokens = ["Respuesta", ": El centro", " abre de lunes", " a viernes."]
+        generator = ResponseGenerator()
+
+        async def run():
+            events = await collect(await generator.agenerate_stream("¿Cuándo abre el centro?", CHUNKS))
+            return events, await generator.agenerate("¿Cuándo abre el centro?", CHUNKS)
+
+        with mock.patch.object(llm_client, "get_async_client", return_value=fake_client(FakeStream(tokens))):
+            events, expected = asyncio.run(run())
+
+        streamed = "".join(value for kind, value in events if kind == "token")
+        self.assertEqual(streamed, "El centro abre de lunes a viernes.")
+        kind, result = events[-1]
+        self.assertEqual(kind, "complete")
+        self.assertEqual(result["answer"], expected["answer"])
+        self.assertEqual(result["sources"], expected["sources"])
+
+    def test_aclose_stops_generation(self):
+        stream = FakeStream([f"t{i} " for i in range(100)])
+
+        async def run():
+            answer = await ResponseGenerator().agenerate_stream("¿Cuándo abre el centro?", CHUNKS)
+            events = answer.__aiter__()
+            await events.__anext__()
+            await answer.aclose()
+            return await collect(events)
+
+        with mock.patch.object(llm_client, "get_async_client", return_value=fake_client(stream)):
+            rest = asyncio.run(run())
+        self.assertTrue(stream.closed)
+        self.assertLess(stream.sent, 5)
+        self.assertEqual(rest[-1][0], "complete")
+
+
+if __name__ == "__main__":
+    unittest.main()
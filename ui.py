@@ -27,8 +27,9 @@ uploaded_file = st.sidebar.file_uploader("Sube un documento (.pdf, .docx, .txt)"
 if uploaded_file is not None:
     files = {"file": (uploaded_file.name, uploaded_file.getvalue())}
     resp = requests.post("http://127.0.0.1:8000/upload", files=files)
-    if resp.status_code == 200:
-        st.sidebar.success(f"Archivo '{uploaded_file.name}' subido y procesado correctamente.")
+    if resp.status_code in (200, 202):
+        # El procesamiento sigue en segundo plano; su avance se consulta en /jobs/{job_id}
+        st.sidebar.success(f"Archivo '{uploaded_file.name}' subido; procesando en segundo plano (trabajo {resp.json().get('job_id')}).")
     else:
         st.sidebar.error(f"Error al subir el archivo: {resp.text}")
 
@@ -105,8 +106,8 @@ reindex_file = st.sidebar.selectbox(
 if st.sidebar.button("🔄 Reindexar") and reindex_file != "Seleccionar...":
     try:
         resp = requests.post(f"http://127.0.0.1:8000/reindex/{reindex_file}")
-        if resp.status_code == 200:
-            st.sidebar.success(f"Documento '{reindex_file}' reindexado exitosamente")
+        if resp.status_code in (200, 202):
+            st.sidebar.success(f"Reindexado de '{reindex_file}' en cola (trabajo {resp.json().get('job_id')})")
         else:
             st.sidebar.error(f"Error: {resp.text}")
     except Exception as e:
@@ -205,7 +206,8 @@ if query:
             except Exception as e:
                 st.warning(f"Error parseando stream: {e}")
 
-            answer = "".join(answer_chunks).strip()
+            # El evento final trae la respuesta ya formateada; los tokens son el texto en bruto
+            answer = (final_meta.get("answer") or "".join(answer_chunks)).strip()
 
             # Guardamos en historial
             st.session_state.messages.append({"role": "user", "content": query})
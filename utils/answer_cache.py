@@ -0,0 +1,263 @@
+import os
+import random
+import threading
+import time
+from collections import OrderedDict, deque
+
+import faiss
+import numpy as np
+
+from utils.lru_cache import LRUCache
+
+# Respuestas del LLM en memoria (0 = desactivada) y caducidad en segundos (0 = sin caducidad)
+ANSWER_CACHE_MAX_ENTRIES = int(os.getenv("ANSWER_CACHE_MAX_ENTRIES", "500"))
+ANSWER_CACHE_TTL = float(os.getenv("ANSWER_CACHE_TTL", "86400"))
+
+
+class AnswerCache:
+    """
+    Caché de respuestas generadas. La clave la construye el llamante (query preprocesada,
+    ids de los chunks recuperados en orden, modelo y versión del prompt); el valor es el
+    resultado de ResponseGenerator. generation_fn devuelve la generación activa del índice:
+    cuando cambia (subida, reindexado, borrado, compactación) la caché se vacía entera.
+    """
+
+    def __init__(self, generation_fn=None, max_entries: int = None, ttl: float = None):
+        self.generation_fn = generation_fn
+        self._lru = LRUCache(
+            ANSWER_CACHE_MAX_ENTRIES if max_entries is None else max_entries,
+            ANSWER_CACHE_TTL if ttl is None else ttl,
+        )
+        self.generation = None
+        self.invalidations = 0
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        return self._lru.max_entries > 0
+
+    def _sync_generation(self):
+        if self.generation_fn is None:
+            return
+        generation = self.generation_fn()
+        with self._lock:
+            if generation == self.generation:
+                return
+            if self.generation is not None:
+                self._lru.clear()
+                self.invalidations += 1
+            self.generation = generation
+
+    def get(self, key):
+        if not self.enabled:
+            return None
+        self._sync_generation()
+        return self._lru.get(key)
+
+    def put(self, key, value):
+        if not self.enabled:
+            return
+        self._sync_generation()
+        self._lru.put(key, value)
+
+    def clear(self):
+        self._lru.clear()
+
+    def stats(self) -> dict:
+        stats = self._lru.stats()
+        stats["generation"] = self.generation
+        stats["invalidations"] = self.invalidations
+        return stats
+
+
+# --- Caché semántica: preguntas parecidas (paráfrasis) con las mismas fuentes ---
+SEMANTIC_CACHE_MAX_ENTRIES = int(os.getenv("SEMANTIC_CACHE_MAX_ENTRIES", "1000"))
+# Similitud coseno mínima entre la consulta nueva y la cacheada
+SEMANTIC_CACHE_THRESHOLD = float(os.getenv("SEMANTIC_CACHE_THRESHOLD", "0.92"))
+# Solapamiento mínimo (Jaccard) entre los chunks recuperados ahora y los de la entrada cacheada
+SEMANTIC_CACHE_MIN_OVERLAP = float(os.getenv("SEMANTIC_CACHE_MIN_OVERLAP", "0.5"))
+# Fracción de aciertos que se auditan regenerando la respuesta con el LLM
+SEMANTIC_CACHE_AUDIT_RATE = float(os.getenv("SEMANTIC_CACHE_AUDIT_RATE", "0.05"))
+# Coincidencia mínima entre la respuesta cacheada y la regenerada para no contarlo como falso acierto
+SEMANTIC_CACHE_MIN_AGREEMENT = float(os.getenv("SEMANTIC_CACHE_MIN_AGREEMENT", "0.5"))
+
+
+class _SemanticEntry:
+    def __init__(self, query: str, chunk_ids, value, expires_at: float):
+        self.query = query
+        self.chunk_ids = frozenset(chunk_ids)
+        self.value = value
+        self.expires_at = expires_at
+
+
+class SemanticProbe:
+    """Resultado de SemanticAnswerCache.lookup; se devuelve a put/record_audit tras generar la respuesta"""
+
+    def __init__(self, query: str, vector, chunk_ids):
+        self.query = query
+        self.vector = vector
+        self.chunk_ids = tuple(chunk_ids)
+        self.entry_id = None
+        self.entry = None
+        self.similarity = 0.0
+        self.overlap = 0.0
+        self.audit = False
+
+
+def chunk_overlap(a, b) -> float:
+    a, b = set(a), set(b)
+    return len(a & b) / len(a | b) if a or b else 0.0
+
+
+class SemanticAnswerCache:
+    """
+    Índice FAISS pequeño (producto interno sobre embeddings normalizados) de consultas
+    pasadas -> respuesta final. Una consulta nueva reutiliza una respuesta si su similitud
+    supera threshold y sus chunks recuperados solapan con los de la entrada (min_overlap).
+    Una fracción audit_rate de los aciertos se regenera para medir falsos aciertos.
+    Igual que AnswerCache, se vacía al cambiar la generación del índice de documentos.
+    """
+
+    def __init__(self, generation_fn=None, embed_fn=None, max_entries: int = None, ttl: float = None,
+                 threshold: float = None, min_overlap: float = None, audit_rate: float = None):
+        self.generation_fn = generation_fn
+        self.embed_fn = embed_fn
+        self.max_entries = SEMANTIC_CACHE_MAX_ENTRIES if max_entries is None else max_entries
+        self.ttl = ANSWER_CACHE_TTL if ttl is None else ttl
+        self.threshold = SEMANTIC_CACHE_THRESHOLD if threshold is None else threshold
+        self.min_overlap = SEMANTIC_CACHE_MIN_OVERLAP if min_overlap is None else min_overlap
+        self.audit_rate = SEMANTIC_CACHE_AUDIT_RATE if audit_rate is None else audit_rate
+        self.generation = None
+        self._index = None
+        self._entries = OrderedDict()  # id -> _SemanticEntry, de menos a más reciente
+        self._next_id = 0
+        self._lock = threading.Lock()
+        self.lookups = 0
+        self.hits = 0
+        self.rejected_overlap = 0
+        self.evictions = 0
+        self.invalidations = 0
+        self.audits = 0
+        self.false_hits = 0
+        self.audit_log = deque(maxlen=50)
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_entries > 0
+
+    def _embed(self, query: str):
+        if self.embed_fn is None:
+            from utils.embeddings import embed_query
+            self.embed_fn = embed_query
+        vector = np.asarray(self.embed_fn(query), dtype="float32").reshape(1, -1)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm > 0 else vector
+
+    def _reset(self):
+        self._index = None
+        self._entries.clear()
+
+    def _sync_generation(self):
+        if self.generation_fn is None:
+            return
+        generation = self.generation_fn()
+        if generation == self.generation:
+            return
+        if self.generation is not None:
+            self._reset()
+            self.invalidations += 1
+        self.generation = generation
+
+    def _remove(self, entry_id: int):
+        if self._entries.pop(entry_id, None) is not None:
+            self._index.remove_ids(np.array([entry_id], dtype="int64"))
+
+    def lookup(self, query: str, chunk_ids) -> SemanticProbe:
+        probe = SemanticProbe(query, None, chunk_ids)
+        if not self.enabled:
+            return probe
+        probe.vector = self._embed(query)
+        with self._lock:
+            self._sync_generation()
+            self.lookups += 1
+            if self._index is None or not self._entries or self._index.d != probe.vector.shape[1]:
+                return probe
+            k = min(8, len(self._entries))
+            scores, ids = self._index.search(probe.vector, k)
+            now = time.monotonic()
+            for score, entry_id in zip(scores[0], ids[0]):
+                if entry_id < 0 or score < self.threshold:
+                    break
+                entry = self._entries.get(int(entry_id))
+                if entry is None:
+                    continue
+                if entry.expires_at and entry.expires_at < now:
+                    self._remove(int(entry_id))
+                    continue
+                overlap = chunk_overlap(chunk_ids, entry.chunk_ids)
+                if overlap < self.min_overlap:
+                    self.rejected_overlap += 1
+                    continue
+                self._entries.move_to_end(int(entry_id))
+                probe.entry_id, probe.entry = int(entry_id), entry
+                probe.similarity, probe.overlap = float(score), overlap
+                probe.audit = random.random() < self.audit_rate
+                if not probe.audit:
+                    self.hits += 1
+                break
+            return probe
+
+    def put(self, probe: SemanticProbe, value):
+        if not self.enabled or probe.vector is None:
+            return
+        with self._lock:
+            self._sync_generation()
+            if self._index is None or self._index.d != probe.vector.shape[1]:
+                self._reset()
+                self._index = faiss.IndexIDMap2(faiss.IndexFlatIP(probe.vector.shape[1]))
+            entry_id = self._next_id
+            self._next_id += 1
+            expires_at = time.monotonic() + self.ttl if self.ttl else 0
+            self._entries[entry_id] = _SemanticEntry(probe.query, probe.chunk_ids, value, expires_at)
+            self._index.add_with_ids(probe.vector, np.array([entry_id], dtype="int64"))
+            while len(self._entries) > self.max_entries:
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+
+    def record_audit(self, probe: SemanticProbe, agreement: float):
+        """Anota un acierto auditado; si la respuesta regenerada no coincide, la entrada se descarta"""
+        false_hit = agreement < SEMANTIC_CACHE_MIN_AGREEMENT
+        with self._lock:
+            self.audits += 1
+            if false_hit:
+                self.false_hits += 1
+                if self._index is not None:
+                    self._remove(probe.entry_id)
+            self.audit_log.append({
+                "query": probe.query,
+                "cached_query": probe.entry.query,
+                "similarity": round(probe.similarity, 4),
+                "overlap": round(probe.overlap, 4),
+                "agreement": round(agreement, 4),
+                "false_hit": false_hit,
+            })
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "threshold": self.threshold,
+                "min_overlap": self.min_overlap,
+                "lookups": self.lookups,
+                "hits": self.hits,
+                "hit_rate": round(self.hits / self.lookups, 4) if self.lookups else 0.0,
+                "rejected_overlap": self.rejected_overlap,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+                "audit_rate": self.audit_rate,
+                "audits": self.audits,
+                "false_hits": self.false_hits,
+                "false_hit_rate": round(self.false_hits / self.audits, 4) if self.audits else 0.0,
+                "recent_audits": list(self.audit_log),
+            }
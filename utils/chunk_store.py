@@ -0,0 +1,349 @@
+import array
+import json
+import numpy as np
+import os
+import pickle
+import sqlite3
+import threading
+import zlib
+
+CHUNK_DB_FILE = "chunks.db"
+# Tamaño máximo que SQLite lee vía mmap (compartido entre procesos en la page cache)
+CHUNK_DB_MMAP_SIZE = int(os.getenv("CHUNK_DB_MMAP_SIZE", str(256 * 1024 * 1024)))
+
+# Campos con columna propia; el resto de la metadata va serializado en "extra"
+COLUMNS = ("source", "source_path", "page", "chunk_index", "page_chunk_index", "section", "namespace")
+# Campos de texto con índice invertido en RAM (valor -> ids) para filtrar dentro de la búsqueda
+INDEXED_FIELDS = ("source", "source_path", "section", "namespace")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS chunks (
+    id INTEGER PRIMARY KEY,
+    source TEXT,
+    source_path TEXT,
+    page INTEGER,
+    chunk_index INTEGER,
+    page_chunk_index INTEGER,
+    section TEXT,
+    namespace TEXT,
+    extra TEXT,
+    text BLOB
+);
+CREATE INDEX IF NOT EXISTS idx_chunks_source ON chunks(source);
+-- Ids borrados que aún ocupan sitio en algún índice FAISS (se purgan al compactar)
+CREATE TABLE IF NOT EXISTS tombstones (
+    id INTEGER PRIMARY KEY
+);
+"""
+
+
+def _int_or_none(value):
+    try:
+        return int(value) if value is not None else None
+    except (TypeError, ValueError):
+        return None
+
+
+class ChunkStore:
+    """
+    Metadata de chunks en SQLite, indexada por id de FAISS.
+    En RAM solo se mantienen columnas compactas (source, page, chunk_index) y el índice
+    invertido de INDEXED_FIELDS; el texto se guarda comprimido y se carga solo para los resultados devueltos.
+    """
+
+    def __init__(self, path: str, read_only: bool = False):
+        self.path = path
+        self.read_only = read_only
+        self._local = threading.local()
+        self._write_lock = threading.Lock()
+        if not read_only:
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+            with self._write_lock:
+                conn = self._connection()
+                conn.executescript(_SCHEMA)
+                conn.commit()
+        self._load_compact()
+
+    # ---------------- Conexiones ----------------
+    def _connect(self):
+        if self.read_only:
+            uri = "file:" + os.path.abspath(self.path).replace("\\", "/") + "?mode=ro"
+            conn = sqlite3.connect(uri, uri=True, check_same_thread=False)
+        else:
+            conn = sqlite3.connect(self.path, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute(f"PRAGMA mmap_size={CHUNK_DB_MMAP_SIZE}")
+        return conn
+
+    def _connection(self):
+        # Una conexión por hilo: las lecturas concurrentes no se bloquean entre sí
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = self._connect()
+            self._local.conn = conn
+        return conn
+
+    # ---------------- Columnas compactas en RAM ----------------
+    def _load_compact(self):
+        self.source_names = []
+        self._source_codes = {}
+        self.sources = array.array("i")
+        self.pages = array.array("i")
+        self.chunk_indexes = array.array("i")
+        self._postings = {field: {} for field in INDEXED_FIELDS}
+        if self.read_only and not os.path.exists(self.path):
+            return
+        rows = self._connection().execute(
+            f"SELECT id, source, page, chunk_index, {', '.join(INDEXED_FIELDS[1:])} FROM chunks ORDER BY id"
+        )
+        for row in rows:
+            self._append_compact(*row)
+
+    def _source_code(self, source) -> int:
+        source = source or ""
+        code = self._source_codes.get(source)
+        if code is None:
+            code = len(self.source_names)
+            self._source_codes[source] = code
+            self.source_names.append(source)
+        return code
+
+    def _append_compact(self, row_id, source, page, chunk_index, source_path=None, section=None, namespace=None):
+        # Los ids son consecutivos; los huecos (si los hubiera) se rellenan con -1
+        while len(self.sources) < row_id:
+            self.sources.append(-1)
+            self.pages.append(-1)
+            self.chunk_indexes.append(-1)
+        self.sources.append(self._source_code(source))
+        self.pages.append(page if page is not None else -1)
+        self.chunk_indexes.append(chunk_index if chunk_index is not None else -1)
+        for field, value in zip(INDEXED_FIELDS, (source, source_path, section, namespace)):
+            if value is not None:
+                self._postings[field].setdefault(value, array.array("i")).append(row_id)
+
+    def _trim_postings(self, count: int):
+        # Los ids se añaden en orden creciente: basta con recortar la cola de cada lista
+        for postings in self._postings.values():
+            for value in list(postings):
+                ids = postings[value]
+                while ids and ids[-1] >= count:
+                    ids.pop()
+                if not ids:
+                    del postings[value]
+
+    def reload_postings(self):
+        """Reconstruye el índice invertido desde SQLite (tras purgar chunks, propios o de otro proceso)"""
+        postings = {field: {} for field in INDEXED_FIELDS}
+        if self.read_only and not os.path.exists(self.path):
+            return
+        rows = self._connection().execute(f"SELECT id, {', '.join(INDEXED_FIELDS)} FROM chunks ORDER BY id")
+        for row_id, *values in rows:
+            for field, value in zip(INDEXED_FIELDS, values):
+                if value is not None:
+                    postings[field].setdefault(value, array.array("i")).append(row_id)
+        # Sustitución de una sola referencia: las consultas en curso siguen con el diccionario anterior
+        self._postings = postings
+
+    @property
+    def count(self) -> int:
+        return len(self.sources)
+
+    def dedup_key(self, chunk_id: int):
+        """Clave (source, page, chunk_index) sin tocar disco"""
+        code = self.sources[chunk_id]
+        return (
+            self.source_names[code] if code >= 0 else "",
+            self.pages[chunk_id] if self.pages[chunk_id] >= 0 else None,
+            self.chunk_indexes[chunk_id] if self.chunk_indexes[chunk_id] >= 0 else None,
+        )
+
+    def refresh(self, count: int):
+        """Carga las columnas compactas de filas añadidas por otro proceso (ids en [self.count, count))"""
+        if count <= self.count or (self.read_only and not os.path.exists(self.path)):
+            return
+        rows = self._connection().execute(
+            f"SELECT id, source, page, chunk_index, {', '.join(INDEXED_FIELDS[1:])} FROM chunks "
+            "WHERE id >= ? AND id < ? ORDER BY id",
+            (self.count, count),
+        )
+        for row in rows:
+            self._append_compact(*row)
+
+    # ---------------- Escritura ----------------
+    def add(self, start_id: int, metadatas):
+        if self.read_only:
+            raise RuntimeError("Chunk store abierto en modo solo lectura")
+        rows = []
+        for offset, meta in enumerate(metadatas):
+            meta = dict(meta)
+            text = meta.pop("text", "") or ""
+            values = [meta.pop(col, None) for col in COLUMNS]
+            values[2] = _int_or_none(values[2])
+            values[3] = _int_or_none(values[3])
+            values[4] = _int_or_none(values[4])
+            extra = json.dumps(meta, ensure_ascii=False, default=str) if meta else None
+            rows.append((start_id + offset, *values, extra, zlib.compress(text.encode("utf-8"))))
+
+        with self._write_lock:
+            conn = self._connection()
+            conn.executemany(
+                f"INSERT OR REPLACE INTO chunks (id, {', '.join(COLUMNS)}, extra, text) "
+                f"VALUES (?, {', '.join('?' for _ in COLUMNS)}, ?, ?)",
+                rows,
+            )
+            conn.commit()
+            for row in rows:
+                # (id, source, source_path, page, chunk_index, page_chunk_index, section, namespace, ...)
+                self._append_compact(row[0], row[1], row[3], row[4], row[2], row[6], row[7])
+
+    def truncate(self, count: int):
+        """Elimina filas con id >= count (escrituras no confirmadas en el manifest)"""
+        if self.read_only:
+            # Un lector no toca la base; solo ignora lo que el manifest aún no confirma
+            if self.count > count:
+                del self.sources[count:]
+                del self.pages[count:]
+                del self.chunk_indexes[count:]
+                self._trim_postings(count)
+            return
+        with self._write_lock:
+            conn = self._connection()
+            cur = conn.execute("DELETE FROM chunks WHERE id >= ?", (count,))
+            conn.commit()
+        if cur.rowcount:
+            print(f"[ChunkStore] Descartados {cur.rowcount} chunks no confirmados")
+        if self.count > count:
+            del self.sources[count:]
+            del self.pages[count:]
+            del self.chunk_indexes[count:]
+            self._trim_postings(count)
+
+    # ---------------- Borrado (tombstones) ----------------
+    def delete(self, ids):
+        """Marca chunks como borrados; dejan de devolverse aunque sigan en el índice"""
+        if self.read_only:
+            raise RuntimeError("Chunk store abierto en modo solo lectura")
+        ids = [(int(i),) for i in ids]
+        with self._write_lock:
+            conn = self._connection()
+            conn.executemany("INSERT OR IGNORE INTO tombstones (id) VALUES (?)", ids)
+            conn.commit()
+
+    def purge(self, ids):
+        """Elimina definitivamente chunks que ya no están en ningún índice"""
+        ids = [(int(i),) for i in ids]
+        if not ids or self.read_only:
+            return
+        with self._write_lock:
+            conn = self._connection()
+            conn.executemany("DELETE FROM chunks WHERE id = ?", ids)
+            conn.executemany("DELETE FROM tombstones WHERE id = ?", ids)
+            conn.commit()
+        self.reload_postings()
+
+    def tombstones(self) -> frozenset:
+        if self.read_only and not os.path.exists(self.path):
+            return frozenset()
+        return frozenset(row[0] for row in self._connection().execute("SELECT id FROM tombstones"))
+
+    def live_ids(self, upto: int) -> list:
+        """Ids < upto que siguen vivos (ni borrados ni purgados)"""
+        rows = self._connection().execute(
+            "SELECT id FROM chunks WHERE id < ? AND id NOT IN (SELECT id FROM tombstones) ORDER BY id", (upto,)
+        )
+        return [row[0] for row in rows]
+
+    def first_live_id(self):
+        row = self._connection().execute(
+            "SELECT MIN(id) FROM chunks WHERE id NOT IN (SELECT id FROM tombstones)"
+        ).fetchone()
+        return row[0] if row else None
+
+    def ids_for_source(self, source: str):
+        """Ids vivos (no borrados) de un documento"""
+        rows = self._connection().execute(
+            "SELECT id FROM chunks WHERE source = ? AND id NOT IN (SELECT id FROM tombstones) ORDER BY id",
+            (source,),
+        )
+        return [row[0] for row in rows]
+
+    # ---------------- Filtros de metadata ----------------
+    def field_values(self, field: str) -> list:
+        """Valores distintos de un campo indexado"""
+        return list(self._postings.get(field, {}))
+
+    def ids_matching(self, field: str, predicate) -> np.ndarray:
+        """
+        Ids (ordenados) cuyo valor de 'field' cumple predicate. Se evalúa sobre los valores
+        distintos, no sobre cada chunk: el coste depende del vocabulario, no del corpus.
+        """
+        postings = self._postings.get(field)
+        if postings is not None:
+            parts = [ids for value, ids in list(postings.items()) if predicate(value)]
+            if not parts:
+                return np.zeros(0, dtype="int64")
+            return np.unique(np.concatenate([np.array(ids, dtype="int64") for ids in parts]))
+
+        # Campos sin índice invertido (enteros o dentro de 'extra'): valores distintos desde SQLite
+        if self.read_only and not os.path.exists(self.path):
+            return np.zeros(0, dtype="int64")
+        if field in COLUMNS:
+            expr, params = field, ()
+        else:
+            expr, params = "json_extract(extra, ?)", (f'$."{field}"',)
+        conn = self._connection()
+        values = [row[0] for row in conn.execute(f"SELECT DISTINCT {expr} FROM chunks", params)]
+        values = [value for value in values if value is not None and predicate(value)]
+        if not values:
+            return np.zeros(0, dtype="int64")
+        placeholders = ", ".join("?" for _ in values)
+        rows = conn.execute(f"SELECT id FROM chunks WHERE {expr} IN ({placeholders})", (*params, *values))
+        return np.unique(np.fromiter((row[0] for row in rows), dtype="int64"))
+
+    # ---------------- Lectura ----------------
+    def get(self, ids):
+        """Devuelve {id: metadata} cargando y descomprimiendo el texto solo de esos ids"""
+        ids = [int(i) for i in ids]
+        if not ids:
+            return {}
+        placeholders = ", ".join("?" for _ in ids)
+        rows = self._connection().execute(
+            f"SELECT id, {', '.join(COLUMNS)}, extra, text FROM chunks WHERE id IN ({placeholders})", ids
+        ).fetchall()
+
+        result = {}
+        for row in rows:
+            meta = json.loads(row[-2]) if row[-2] else {}
+            meta["text"] = zlib.decompress(row[-1]).decode("utf-8") if row[-1] else ""
+            for col, value in zip(COLUMNS, row[1:-2]):
+                if value is not None or col in ("source", "page", "chunk_index", "section", "source_path"):
+                    meta[col] = value
+            result[row[0]] = meta
+        return result
+
+    def close(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+
+
+def convert_metadata_pickle(pickle_path: str, store: ChunkStore, start_id: int = 0) -> int:
+    """Carga un metadata.pkl (lista de dicts) en el chunk store; ids = posición en FAISS"""
+    with open(pickle_path, "rb") as f:
+        metadatas = pickle.load(f)
+    store.add(start_id, metadatas)
+    print(f"[ChunkStore] Convertidos {len(metadatas)} chunks desde {pickle_path}")
+    return len(metadatas)
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Convierte un metadata.pkl al chunk store SQLite")
+    parser.add_argument("--pickle", default="metadata.pkl", help="Ruta del metadata.pkl")
+    parser.add_argument("--db", default=os.path.join("faiss_store", CHUNK_DB_FILE), help="Base de datos destino")
+    parser.add_argument("--start-id", type=int, default=0, help="Id de FAISS del primer chunk")
+    args = parser.parse_args()
+    convert_metadata_pickle(args.pickle, ChunkStore(args.db), args.start_id)
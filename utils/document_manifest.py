@@ -0,0 +1,104 @@
+import hashlib
+import json
+import os
+import threading
+from datetime import datetime
+from utils.segment_store import _atomic_write
+
+# --- Manifest de documentos (junto al índice, en FAISS_INDEX_DIR) ---
+# documents.json -> por cada 'source' indexado: hash del contenido, tamaño, mtime,
+# parámetros de chunking y modelo de embeddings con los que se generaron sus chunks.
+# Al arrancar solo se reprocesan los documentos nuevos o cambiados.
+DOCUMENTS_MANIFEST_FILE = "documents.json"
+DOCUMENTS_MANIFEST_VERSION = 1
+
+# Estados de un documento respecto a su entrada en el manifest
+NEW, CHANGED, TOUCHED, UNCHANGED = "new", "changed", "touched", "unchanged"
+
+
+def file_digest(path: str, block_size: int = 1 << 20) -> str:
+    """sha256 del contenido, leído por bloques"""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def file_stat(path: str) -> dict:
+    stat = os.stat(path)
+    return {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+
+
+class DocumentManifest:
+    """Huella de cada documento indexado; se reescribe de forma atómica en cada cambio"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self.documents = self._read()
+
+    def _read(self) -> dict:
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            return {}
+        except (OSError, ValueError) as e:
+            # Sin manifest válido se reprocesa todo una vez (upsert no duplica chunks)
+            print(f"[FAISS] Manifest de documentos ilegible ({e}); se reindexarán los documentos")
+            return {}
+        if data.get("version") != DOCUMENTS_MANIFEST_VERSION:
+            return {}
+        return data.get("documents", {})
+
+    def _save(self):
+        data = {"version": DOCUMENTS_MANIFEST_VERSION, "documents": self.documents}
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        _atomic_write(self.path, json.dumps(data, indent=1, ensure_ascii=False).encode("utf-8"))
+
+    def get(self, source: str):
+        return self.documents.get(source)
+
+    def sources(self) -> list:
+        return list(self.documents)
+
+    def check(self, source: str, path: str, params: dict):
+        """
+        Compara el fichero con su entrada: (estado, stat, hash). El hash solo se calcula
+        cuando tamaño o mtime cambiaron; TOUCHED = mismo contenido con otro mtime.
+        """
+        stat = file_stat(path)
+        entry = self.documents.get(source)
+        if entry is None:
+            return NEW, stat, None
+        if entry.get("params") != params:
+            return CHANGED, stat, None
+        if all(entry.get(k) == v for k, v in stat.items()):
+            return UNCHANGED, stat, entry.get("sha256")
+        digest = file_digest(path)
+        return (TOUCHED if digest == entry.get("sha256") else CHANGED), stat, digest
+
+    def record(self, source: str, stat: dict, digest: str, params: dict, chunks: int):
+        with self._lock:
+            self.documents[source] = {
+                "sha256": digest,
+                **stat,
+                "params": params,
+                "chunks": chunks,
+                "indexed_at": datetime.now().isoformat(timespec="seconds"),
+            }
+            self._save()
+
+    def touch(self, source: str, stat: dict):
+        """Actualiza tamaño y mtime de un documento cuyo contenido no cambió"""
+        with self._lock:
+            self.documents[source].update(stat)
+            self._save()
+
+    def remove(self, source: str) -> bool:
+        with self._lock:
+            if self.documents.pop(source, None) is None:
+                return False
+            self._save()
+            return True
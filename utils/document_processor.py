@@ -4,13 +4,13 @@ import os
 import re
 from utils.embeddings import generate_embeddings
 from utils.faiss_client import get_client
+from utils.ingest_pipeline import (
+    INGEST_BATCH_QUEUE, INGEST_EMBED_BATCH, INGEST_EMBED_CONCURRENCY, INGEST_INDEX_BATCH, INGEST_PAGE_QUEUE,
+    batched, iter_in_thread, map_ahead
+)
 
-# Librerías adicionales para extracción robusta de PDFs
-try:
-    import fitz  # PyMuPDF
-    HAS_PYMUPDF = True
-except ImportError:
-    HAS_PYMUPDF = False
+# Librerías adicionales para extracción robusta de PDFs (PyMuPDF: ver utils/pdf_extract.py)
+from utils.pdf_extract import HAS_PYMUPDF, iter_pymupdf_pages
 
 try:
     import pdfplumber
@@ -18,132 +18,133 @@ try:
 except ImportError:
     HAS_PDFPLUMBER = False
 
+# Tamaño de los chunks y solapamiento (en palabras); cambiarlos reindexa los documentos al arrancar
+CHUNK_SIZE = int(os.getenv("CHUNK_SIZE", "150"))
+CHUNK_OVERLAP = int(os.getenv("CHUNK_OVERLAP", "30"))
+
+
+def _no_progress(stage: str, **counters):
+    pass
+
 
 class DocumentProcessor:
-    def __init__(self):
-        self.faiss_client = get_client()
+    def __init__(self, faiss_client=None):
+        self.faiss_client = faiss_client or get_client()
 
-    def process(self, file_path: str, metadata: dict):
+    def process(self, file_path: str, metadata: dict, progress=None):
+        """
+        Extrae, trocea, embebe e indexa un documento. progress(stage, **counters) recibe el
+        avance por etapa (extracting, chunking, embedding, indexing) con pages_done/pages_total
+        y chunks_embedded/chunks_total.
+        """
         ext = os.path.splitext(file_path)[1].lower()
 
         if ext == ".pdf":
-            return self._process_pdf(file_path, metadata)
+            return self._process_pdf(file_path, metadata, progress)
         elif ext == ".docx":
-            return self._process_docx(file_path, metadata)
+            return self._process_docx(file_path, metadata, progress)
         elif ext == ".txt":
-            return self._process_txt(file_path, metadata)
+            return self._process_txt(file_path, metadata, progress)
         else:
             raise ValueError("Formato no soportado")
 
-    # ---------------- PDF ----------------
-    def _process_pdf(self, file_path: str, metadata: dict):
-        all_chunks, all_metadatas = [], []
-        
-        # Intentar múltiples métodos de extracción
-        page_texts = self._extract_pdf_text_robust(file_path)
-        
-        for page_num, page_text in enumerate(page_texts, 1):
-            if not page_text.strip():
-                continue
+    # ---------------- Pipeline de ingesta ----------------
+    def _ingest(self, pages, file_path: str, metadata: dict, progress=None):
+        """
+        Indexa las páginas (número, texto) de un documento por etapas concurrentes unidas por
+        colas acotadas (ver utils/ingest_pipeline.py): extracción -> limpieza y chunking ->
+        lotes de embeddings -> escritura en el índice. Si una etapa falla se borran los chunks
+        del documento ya escritos y se relanza el error.
+        """
+        progress = progress or _no_progress
+        all_metadatas, written = [], []
+
+        def chunks():
+            chunk_index = 0
+            for page_num, page_text in iter_in_thread(pages, INGEST_PAGE_QUEUE, "ingest-extract"):
+                if not page_text.strip():
+                    continue
+                page_chunks = self._chunk_text(page_text, chunk_size=CHUNK_SIZE, overlap=CHUNK_OVERLAP)
+                for page_chunk_index, chunk in enumerate(page_chunks):
+                    yield chunk, self._chunk_metadata(chunk, page_num, chunk_index, page_chunk_index, metadata, file_path)
+                    chunk_index += 1
+                progress("chunking", chunks_total=chunk_index)
+
+        def embed(batch):
+            texts = [chunk for chunk, _ in batch]
+            return generate_embeddings(texts), [meta for _, meta in batch]
+
+        batches = iter_in_thread(batched(chunks(), INGEST_EMBED_BATCH), INGEST_BATCH_QUEUE, "ingest-chunk")
+        embedded = map_ahead(embed, batches, INGEST_EMBED_CONCURRENCY, "ingest-embed")
+        pending_vectors, pending_metadatas = [], []
+        try:
+            for vectors, metadatas in embedded:
+                pending_vectors.extend(vectors)
+                pending_metadatas.extend(metadatas)
+                all_metadatas.extend(metadatas)
+                progress("embedding", chunks_embedded=len(all_metadatas))
+                if len(pending_metadatas) >= INGEST_INDEX_BATCH:
+                    written += self._add_to_index(pending_vectors, pending_metadatas, progress)
+                    pending_vectors, pending_metadatas = [], []
+            if pending_metadatas:
+                written += self._add_to_index(pending_vectors, pending_metadatas, progress)
+        except BaseException:
+            if written:
+                self.faiss_client.delete_ids(written)
+            raise
+        finally:
+            # Detiene las etapas anteriores si la escritura terminó antes (p. ej. por un error)
+            embedded.close()
+            batches.close()
+        return all_metadatas
+
+    def _add_to_index(self, embeddings, metadatas, progress=None):
+        (progress or _no_progress)("indexing")
+        return self.faiss_client.add_embeddings(embeddings, metadatas) or []
+
+    def _chunk_metadata(self, chunk, page_num, chunk_index, page_chunk_index, metadata: dict, file_path: str):
+        chunk_metadata = {
+            "text": chunk,
+            "page": page_num,
+            "chunk_index": chunk_index,
+            "page_chunk_index": page_chunk_index,
+            **metadata
+        }
 
-            # Dividir cada página en chunks
-            page_chunks = self._chunk_text(page_text, chunk_size=150, overlap=30)
-
-            for chunk_idx, chunk in enumerate(page_chunks):
-                chunk_metadata = {
-                    "text": chunk,
-                    "page": page_num,
-                    "chunk_index": len(all_chunks),
-                    "page_chunk_index": chunk_idx,
-                    **metadata
-                }
-
-                # Asegurar metadatos mínimos
-                if "source" not in chunk_metadata or not chunk_metadata.get("source"):
-                    chunk_metadata["source"] = os.path.basename(file_path)
-                if "source_path" not in chunk_metadata or not chunk_metadata.get("source_path"):
-                    chunk_metadata["source_path"] = file_path
-
-                # Intentar detectar título/sección
-                title = self._detect_story_title(chunk)
-                if title and "section" not in chunk_metadata:
-                    chunk_metadata["section"] = title
-
-                all_chunks.append(chunk)
-                all_metadatas.append(chunk_metadata)
-
-        # Embeddings
-        if all_chunks:
-            embeddings = generate_embeddings(all_chunks)
-            self.faiss_client.add_embeddings(embeddings, all_metadatas)
+        # Asegurar metadatos mínimos
+        if "source" not in chunk_metadata or not chunk_metadata.get("source"):
+            chunk_metadata["source"] = os.path.basename(file_path)
+        if "source_path" not in chunk_metadata or not chunk_metadata.get("source_path"):
+            chunk_metadata["source_path"] = file_path
 
-        return all_metadatas
+        # Intentar detectar título/sección
+        title = self._detect_story_title(chunk)
+        if title and "section" not in chunk_metadata:
+            chunk_metadata["section"] = title
+        return chunk_metadata
+
+    # ---------------- PDF ----------------
+    def _process_pdf(self, file_path: str, metadata: dict, progress=None):
+        # Cada página se trocea y embebe mientras se extraen las siguientes
+        return self._ingest(self._iter_pdf_pages(file_path, progress), file_path, metadata, progress)
 
     # ---------------- DOCX ----------------
-    def _process_docx(self, file_path: str, metadata: dict):
-        doc = Document(file_path)
-        text = "\n".join([para.text for para in doc.paragraphs if para.text.strip()])
-
-        chunks = self._chunk_text(text, chunk_size=150, overlap=30)
-        embeddings = generate_embeddings(chunks)
-
-        metadatas = []
-        for idx, chunk in enumerate(chunks):
-            meta = {
-                "text": chunk,
-                "page": None,
-                "chunk_index": idx,
-                "page_chunk_index": idx,
-                **metadata
-            }
-
-            if "source" not in meta or not meta.get("source"):
-                meta["source"] = os.path.basename(file_path)
-            if "source_path" not in meta or not meta.get("source_path"):
-                meta["source_path"] = file_path
-
-            title = self._detect_story_title(chunk)
-            if title and "section" not in meta:
-                meta["section"] = title
-
-            metadatas.append(meta)
-
-        if chunks:
-            self.faiss_client.add_embeddings(embeddings, metadatas)
-        return metadatas
+    def _process_docx(self, file_path: str, metadata: dict, progress=None):
+        def pages():
+            (progress or _no_progress)("extracting")
+            doc = Document(file_path)
+            yield None, "\n".join([para.text for para in doc.paragraphs if para.text.strip()])
+
+        return self._ingest(pages(), file_path, metadata, progress)
 
     # ---------------- TXT ----------------
-    def _process_txt(self, file_path: str, metadata: dict):
-        with open(file_path, "r", encoding="utf-8") as f:
-            text = f.read()
-
-        chunks = self._chunk_text(text, chunk_size=150, overlap=30)
-        embeddings = generate_embeddings(chunks)
-
-        metadatas = []
-        for idx, chunk in enumerate(chunks):
-            meta = {
-                "text": chunk,
-                "page": None,
-                "chunk_index": idx,
-                "page_chunk_index": idx,
-                **metadata
-            }
-
-            if "source" not in meta or not meta.get("source"):
-                meta["source"] = os.path.basename(file_path)
-            if "source_path" not in meta or not meta.get("source_path"):
-                meta["source_path"] = file_path
-
-            title = self._detect_story_title(chunk)
-            if title and "section" not in meta:
-                meta["section"] = title
-
-            metadatas.append(meta)
-
-        if chunks:
-            self.faiss_client.add_embeddings(embeddings, metadatas)
-        return metadatas
+    def _process_txt(self, file_path: str, metadata: dict, progress=None):
+        def pages():
+            (progress or _no_progress)("extracting")
+            with open(file_path, "r", encoding="utf-8") as f:
+                yield None, f.read()
+
+        return self._ingest(pages(), file_path, metadata, progress)
 
     # ---------------- Detectar títulos ----------------
     def _detect_story_title(self, text: str) -> str:
@@ -176,7 +177,7 @@ class DocumentProcessor:
         return None
 
     # ---------------- Chunking ----------------
-    def _chunk_text(self, text, chunk_size=150, overlap=30):
+    def _chunk_text(self, text, chunk_size=CHUNK_SIZE, overlap=CHUNK_OVERLAP):
         """
         Divide el texto en fragmentos de ~150 palabras con un solapamiento de 30.
         Preserva mejor el contexto y evita cortar información importante.
@@ -311,85 +312,71 @@ class DocumentProcessor:
         return ' '.join(cleaned_lines).strip()
 
     # ---------------- Extracción robusta de PDF ----------------
-    def _extract_pdf_text_robust(self, file_path: str):
+    def _extract_pdf_text_robust(self, file_path: str, progress=None):
         """Extrae texto usando múltiples métodos como fallback"""
-        page_texts = []
-        
-        # Método 1: PyMuPDF (más robusto)
+        return [text for _, text in self._iter_pdf_pages(file_path, progress)]
+
+    def _iter_pdf_pages(self, file_path: str, progress=None):
+        """
+        Genera (número de página, texto) según se extraen, probando PyMuPDF, pdfplumber y
+        PyPDF2 como fallback. Las páginas de un método se retienen hasta que suman contenido
+        sustancial (más de 100 caracteres); si no se alcanza, se descartan y se prueba el
+        siguiente método. PyPDF2 es el último recurso y entrega lo que extraiga.
+        """
+        progress = progress or _no_progress
+        methods = []
         if HAS_PYMUPDF:
+            methods.append(("PyMuPDF", self._pymupdf_pages))
+        if HAS_PDFPLUMBER:
+            methods.append(("pdfplumber", self._pdfplumber_pages))
+        methods.append(("PyPDF2", self._pypdf2_pages))
+
+        for position, (label, extract) in enumerate(methods):
+            last = position == len(methods) - 1
+            print(f"[PDF] Intentando extracción con {label}: {os.path.basename(file_path)}")
+            buffered, total_chars, delivered = [], 0, 0
             try:
-                print(f"[PDF] Intentando extracción con PyMuPDF: {os.path.basename(file_path)}")
-                doc = fitz.open(file_path)
-                for page_num in range(doc.page_count):
-                    page = doc.load_page(page_num)
-                    # Intentar múltiples métodos de extracción de PyMuPDF
-                    text = page.get_text()
-                    
-                    # Si el texto está vacío o muy corto, intentar con layout preservado
-                    if len(text.strip()) < 50:
-                        text = page.get_text("text", flags=fitz.TEXT_PRESERVE_LIGATURES | fitz.TEXT_PRESERVE_WHITESPACE)
-                    
-                    # Si aún está vacío, intentar extraer de bloques de texto
-                    if len(text.strip()) < 50:
-                        blocks = page.get_text("dict")["blocks"]
-                        text_blocks = []
-                        for block in blocks:
-                            if "lines" in block:
-                                for line in block["lines"]:
-                                    for span in line["spans"]:
-                                        if "text" in span:
-                                            text_blocks.append(span["text"])
-                        text = " ".join(text_blocks)
-                    
-                    page_texts.append(text)
-                doc.close()
-                
-                # Verificar si se extrajo contenido útil
-                total_chars = sum(len(text.strip()) for text in page_texts)
-                if total_chars > 100:  # Si hay contenido sustancial
-                    print(f"[PDF] PyMuPDF exitoso: {total_chars} caracteres extraídos")
-                    return page_texts
-                else:
-                    print(f"[PDF] PyMuPDF extrajo poco contenido, probando siguiente método")
-                    page_texts = []
-            except Exception as e:
-                print(f"[PDF] Error con PyMuPDF: {e}")
-                page_texts = []
-        
-        # Método 2: pdfplumber (bueno para tablas)
-        if HAS_PDFPLUMBER and not page_texts:
-            try:
-                print(f"[PDF] Intentando extracción con pdfplumber: {os.path.basename(file_path)}")
-                with pdfplumber.open(file_path) as pdf:
-                    for page in pdf.pages:
-                        text = page.extract_text() or ""
-                        page_texts.append(text)
-                
-                total_chars = sum(len(text.strip()) for text in page_texts)
-                if total_chars > 100:
-                    print(f"[PDF] pdfplumber exitoso: {total_chars} caracteres extraídos")
-                    return page_texts
-                else:
-                    print(f"[PDF] pdfplumber extrajo poco contenido, probando siguiente método")
-                    page_texts = []
-            except Exception as e:
-                print(f"[PDF] Error con pdfplumber: {e}")
-                page_texts = []
-        
-        # Método 3: PyPDF2 (fallback)
-        if not page_texts:
-            try:
-                print(f"[PDF] Intentando extracción con PyPDF2: {os.path.basename(file_path)}")
-                reader = PdfReader(file_path)
-                for page in reader.pages:
-                    text = page.extract_text() or ""
-                    page_texts.append(text)
-                
-                total_chars = sum(len(text.strip()) for text in page_texts)
-                print(f"[PDF] PyPDF2 completado: {total_chars} caracteres extraídos")
-                return page_texts
+                for text in extract(file_path, progress):
+                    total_chars += len(text.strip())
+                    buffered.append(text)
+                    # Con contenido sustancial (o en el último método) las páginas salen en streaming
+                    if last or total_chars > 100:
+                        for text in buffered:
+                            delivered += 1
+                            yield delivered, text
+                        buffered = []
             except Exception as e:
-                print(f"[PDF] Error con PyPDF2: {e}")
-                return []
-        
-        return page_texts
+                print(f"[PDF] Error con {label}: {e}")
+                if delivered:
+                    # Ya se entregaron páginas de este método: no se pueden mezclar con las de otro
+                    raise
+                if last:
+                    return
+                continue
+
+            if last:
+                print(f"[PDF] {label} completado: {total_chars} caracteres extraídos")
+                return
+            if delivered:
+                print(f"[PDF] {label} exitoso: {total_chars} caracteres extraídos")
+                return
+            print(f"[PDF] {label} extrajo poco contenido, probando siguiente método")
+
+    def _pymupdf_pages(self, file_path: str, progress):
+        # Rangos de páginas en paralelo en procesos del pool (PDF_EXTRACT_WORKERS), reensamblados en orden
+        return iter_pymupdf_pages(file_path, progress)
+
+    def _pdfplumber_pages(self, file_path: str, progress):
+        # pdfplumber: bueno para tablas
+        with pdfplumber.open(file_path) as pdf:
+            progress("extracting", pages_done=0, pages_total=len(pdf.pages))
+            for page_num, page in enumerate(pdf.pages, 1):
+                yield page.extract_text() or ""
+                progress("extracting", pages_done=page_num)
+
+    def _pypdf2_pages(self, file_path: str, progress):
+        reader = PdfReader(file_path)
+        progress("extracting", pages_done=0, pages_total=len(reader.pages))
+        for page_num, page in enumerate(reader.pages, 1):
+            yield page.extract_text() or ""
+            progress("extracting", pages_done=page_num)
@@ -0,0 +1,91 @@
+import asyncio
+import os
+import re
+import unicodedata
+import zlib
+
+import numpy as np
+
+# Dimensión del backend local por hashing
+LOCAL_EMBEDDING_DIM = int(os.getenv("LOCAL_EMBEDDING_DIM", "512"))
+
+
+class EmbeddingBackend:
+    """
+    Interfaz de un proveedor de embeddings.
+    - name: nombre usado en EMBEDDING_BACKEND
+    - model: identificador del modelo (forma parte de la clave de las cachés)
+    - dim: dimensión de los vectores (la usa el índice FAISS)
+    """
+
+    name = ""
+    model = ""
+    dim = 0
+
+    def embed(self, texts) -> list:
+        """Lista de vectores (listas de float) en el mismo orden que texts"""
+        raise NotImplementedError
+
+    async def aembed(self, texts) -> list:
+        """Versión asíncrona de embed; por defecto la ejecuta en un hilo"""
+        return await asyncio.to_thread(self.embed, texts)
+
+
+def reduce_dimensions(vectors, dim: int) -> list:
+    """
+    Trunca embeddings a sus primeras dim componentes y renormaliza (norma L2 = 1).
+    Para los modelos text-embedding-3 (Matryoshka) equivale a pedir dimensions=dim a la API.
+    """
+    vectors = np.asarray(vectors, dtype="float32")
+    if vectors.ndim != 2 or vectors.shape[1] <= dim:
+        return vectors.tolist()
+    reduced = vectors[:, :dim]
+    norms = np.linalg.norm(reduced, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return (reduced / norms).tolist()
+
+
+def _strip_accents(text: str) -> str:
+    text = unicodedata.normalize("NFKD", text)
+    return "".join(c for c in text if not unicodedata.combining(c))
+
+
+class HashingBackend(EmbeddingBackend):
+    """
+    Embeddings locales en CPU sin red ni modelos: proyección por hashing (feature hashing)
+    de palabras, bigramas de palabras y trigramas de caracteres, con signo y norma L2.
+    Captura solapamiento léxico, no semántica; sirve para entornos aislados y pruebas.
+    """
+
+    name = "hashing"
+
+    def __init__(self, dim: int = None):
+        self.dim = dim or LOCAL_EMBEDDING_DIM
+        self.model = f"hashing-v1-{self.dim}"
+
+    def _features(self, text: str):
+        words = re.findall(r"\w+", _strip_accents(text.lower()))
+        features = [(w, 1.0) for w in words]
+        features += [(f"{a} {b}", 0.5) for a, b in zip(words, words[1:])]
+        for w in words:
+            padded = f"#{w}#"
+            grams = [padded[i:i + 3] for i in range(len(padded) - 2)]
+            # Los trigramas de una palabra pesan en total lo mismo que la palabra
+            features += [(f"3:{g}", 1.0 / len(grams)) for g in grams]
+        return features
+
+    def _embed_one(self, text: str) -> np.ndarray:
+        vector = np.zeros(self.dim, dtype="float32")
+        features = self._features(text)
+        if not features:
+            return vector
+        hashes = np.array([zlib.crc32(f.encode("utf-8")) for f, _ in features], dtype="uint64")
+        weights = np.array([w for _, w in features], dtype="float32")
+        # El bit alto decide el signo: las colisiones se cancelan en media
+        signs = np.where(hashes & 0x80000000, -1.0, 1.0).astype("float32")
+        np.add.at(vector, (hashes % self.dim).astype("int64"), signs * weights)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm > 0 else vector
+
+    def embed(self, texts) -> list:
+        return [self._embed_one(text).tolist() for text in texts]
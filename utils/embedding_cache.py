@@ -0,0 +1,158 @@
+import hashlib
+import os
+import re
+import sqlite3
+import threading
+import time
+import unicodedata
+
+import numpy as np
+
+# Caché persistente de embeddings: clave = hash(modelo + texto normalizado); por defecto junto al índice
+EMBEDDING_CACHE_PATH = os.getenv(
+    "EMBEDDING_CACHE_PATH", os.path.join(os.getenv("FAISS_INDEX_DIR", "faiss_store"), "embedding_cache.db")
+)
+# Tamaño máximo de los vectores guardados; al superarlo se expulsan los menos usados (LRU)
+EMBEDDING_CACHE_MAX_MB = float(os.getenv("EMBEDDING_CACHE_MAX_MB", "512"))
+# 0 desactiva la caché
+EMBEDDING_CACHE_ENABLED = os.getenv("EMBEDDING_CACHE_ENABLED", "1").lower() in ("1", "true", "yes")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS embeddings (
+    key TEXT PRIMARY KEY,
+    model TEXT,
+    vector BLOB,
+    last_used REAL
+);
+CREATE INDEX IF NOT EXISTS idx_embeddings_last_used ON embeddings(last_used);
+"""
+
+
+def normalize_text(text: str) -> str:
+    """Normalización que no cambia el embedding: unicode NFKC y espacios colapsados"""
+    text = unicodedata.normalize("NFKC", text or "")
+    return re.sub(r"\s+", " ", text).strip()
+
+
+def cache_key(model: str, text: str) -> str:
+    return hashlib.sha256(f"{model}\0{normalize_text(text)}".encode("utf-8")).hexdigest()
+
+
+class EmbeddingCache:
+    """
+    Caché de embeddings direccionada por contenido en SQLite.
+    Reiniciar o reindexar contenido sin cambios no hace llamadas a la API.
+    """
+
+    def __init__(self, path: str = None, max_mb: float = None):
+        self.path = path or EMBEDDING_CACHE_PATH
+        self.max_bytes = int((EMBEDDING_CACHE_MAX_MB if max_mb is None else max_mb) * 1024 * 1024)
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        directory = os.path.dirname(os.path.abspath(self.path))
+        os.makedirs(directory, exist_ok=True)
+        self._conn = sqlite3.connect(self.path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(_SCHEMA)
+        self._conn.commit()
+        self._size = self._conn.execute("SELECT COALESCE(SUM(LENGTH(vector)), 0) FROM embeddings").fetchone()[0]
+
+    def get_many(self, model: str, texts) -> list:
+        """Lista alineada con texts: el vector si está en caché, None si no"""
+        keys = [cache_key(model, text) for text in texts]
+        found = {}
+        with self._lock:
+            unique = list(dict.fromkeys(keys))
+            # Consultas por bloques: SQLite limita el número de parámetros
+            for i in range(0, len(unique), 500):
+                block = unique[i:i + 500]
+                placeholders = ", ".join("?" for _ in block)
+                rows = self._conn.execute(
+                    f"SELECT key, vector FROM embeddings WHERE key IN ({placeholders})", block
+                ).fetchall()
+                found.update((key, np.frombuffer(blob, dtype="float32").tolist()) for key, blob in rows)
+            if found:
+                now = time.time()
+                self._conn.executemany("UPDATE embeddings SET last_used = ? WHERE key = ?", [(now, k) for k in found])
+                self._conn.commit()
+            results = [found.get(key) for key in keys]
+            hits = sum(1 for r in results if r is not None)
+            self.hits += hits
+            self.misses += len(results) - hits
+        return results
+
+    def put_many(self, model: str, texts, vectors):
+        now = time.time()
+        rows = {}
+        for text, vector in zip(texts, vectors):
+            rows[cache_key(model, text)] = np.asarray(vector, dtype="float32").tobytes()
+        if not rows:
+            return
+        with self._lock:
+            existing = 0
+            keys = list(rows)
+            for i in range(0, len(keys), 500):
+                block = keys[i:i + 500]
+                placeholders = ", ".join("?" for _ in block)
+                existing += self._conn.execute(
+                    f"SELECT COALESCE(SUM(LENGTH(vector)), 0) FROM embeddings WHERE key IN ({placeholders})", block
+                ).fetchone()[0]
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO embeddings (key, model, vector, last_used) VALUES (?, ?, ?, ?)",
+                [(key, model, blob, now) for key, blob in rows.items()],
+            )
+            self._size += sum(len(blob) for blob in rows.values()) - existing
+            self._evict()
+            self._conn.commit()
+
+    def _evict(self):
+        """Expulsa las entradas menos usadas hasta quedar en el 90% del máximo"""
+        if self._size <= self.max_bytes:
+            return
+        target = int(self.max_bytes * 0.9)
+        rows = self._conn.execute("SELECT key, LENGTH(vector) FROM embeddings ORDER BY last_used")
+        victims, freed = [], 0
+        for key, size in rows:
+            if self._size - freed <= target:
+                break
+            victims.append((key,))
+            freed += size
+        self._conn.executemany("DELETE FROM embeddings WHERE key = ?", victims)
+        self._size -= freed
+        self.evictions += len(victims)
+
+    def stats(self) -> dict:
+        with self._lock:
+            entries = self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+            total = self.hits + self.misses
+            return {
+                "path": self.path,
+                "entries": entries,
+                "bytes": self._size,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / total, 4) if total else 0.0,
+                "evictions": self.evictions,
+            }
+
+    def close(self):
+        self._conn.close()
+
+
+_shared_cache = None
+_shared_lock = threading.Lock()
+
+
+def get_embedding_cache():
+    """Caché compartida del proceso (None si EMBEDDING_CACHE_ENABLED=0)"""
+    global _shared_cache
+    if not EMBEDDING_CACHE_ENABLED:
+        return None
+    with _shared_lock:
+        if _shared_cache is None:
+            _shared_cache = EmbeddingCache()
+    return _shared_cache
@@ -1,25 +1,444 @@
 from openai import OpenAI
+import asyncio
+import openai
 import os
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 from dotenv import load_dotenv
+from utils.embedding_backends import EmbeddingBackend, HashingBackend, reduce_dimensions
+from utils.embedding_cache import EmbeddingCache, get_embedding_cache
+from utils.lru_cache import LRUCache
+from utils.micro_batcher import AsyncMicroBatcher, MicroBatcher
+from utils.openai_clients import get_async_client, limiter, request_timeout
 
 # Cargar variables de entorno desde .env si existe
 load_dotenv()
 
-# Crear cliente de OpenAI
-client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+# Proveedor de embeddings: "openai" (API) o "hashing" (local en CPU, sin red)
+EMBEDDING_BACKEND = os.getenv("EMBEDDING_BACKEND", "openai").lower()
 
 # Leer el modelo desde variable de entorno o usar uno por defecto
 EMBEDDING_MODEL = os.getenv("EMBEDDING_MODEL", "text-embedding-3-small")
+# Dimensión nativa de los modelos de OpenAI conocidos (EMBEDDING_DIM la fija para otros)
+OPENAI_EMBEDDING_DIMS = {
+    "text-embedding-3-small": 1536,
+    "text-embedding-3-large": 3072,
+    "text-embedding-ada-002": 1536,
+}
+EMBEDDING_DIM = int(os.getenv("EMBEDDING_DIM", "0"))
+# Dimensión reducida de los embeddings (0 = nativa). Los modelos text-embedding-3 la generan
+# directamente (parámetro dimensions); con otros modelos se trunca y renormaliza en local
+EMBEDDING_DIMENSIONS = int(os.getenv("EMBEDDING_DIMENSIONS", "0"))
 
+# Cliente de OpenAI creado al primer uso: importar el módulo no requiere red ni API key.
+# Los reintentos los gestiona _embed_batch, con backoff y presupuesto de tokens.
+client = None
+_client_lock = threading.Lock()
 
-def generate_embeddings(texts):
-    if not client.api_key:
+# --- Batching por tokens ---
+# Tokens máximos por petición (la API admite 300k por petición y 8191 por input) y inputs por petición
+EMBEDDING_BATCH_TOKENS = int(os.getenv("EMBEDDING_BATCH_TOKENS", "100000"))
+EMBEDDING_BATCH_SIZE = int(os.getenv("EMBEDDING_BATCH_SIZE", "2048"))
+EMBEDDING_MAX_INPUT_TOKENS = 8191
+# Peticiones de embeddings en paralelo
+EMBEDDING_CONCURRENCY = int(os.getenv("EMBEDDING_CONCURRENCY", "4"))
+# Presupuesto de tokens por minuto del proyecto (0 = sin límite)
+EMBEDDING_TPM = int(os.getenv("EMBEDDING_TPM", "1000000"))
+EMBEDDING_MAX_RETRIES = int(os.getenv("EMBEDDING_MAX_RETRIES", "6"))
+# Segundos máximos por petición de embeddings
+EMBEDDING_TIMEOUT = float(os.getenv("EMBEDDING_TIMEOUT", "60"))
+
+# --- Caché de embeddings de consultas (camino de búsqueda) ---
+QUERY_CACHE_MAX_ENTRIES = int(os.getenv("QUERY_CACHE_MAX_ENTRIES", "1000"))
+QUERY_CACHE_TTL = float(os.getenv("QUERY_CACHE_TTL", "3600"))
+# Segundo nivel opcional en SQLite, compartido entre workers y reinicios ("" = solo memoria)
+QUERY_CACHE_PATH = os.getenv("QUERY_CACHE_PATH", "")
+
+def _api_key() -> str:
+    api_key = os.getenv("OPENAI_API_KEY")
+    if not api_key:
         raise RuntimeError(
-            "OPENAI_API_KEY no está configurada. Crea un archivo .env con OPENAI_API_KEY=... o define la variable de entorno."
+            "OPENAI_API_KEY no está configurada. Crea un archivo .env con OPENAI_API_KEY=... "
+            "o define la variable de entorno (o usa EMBEDDING_BACKEND=hashing para trabajar sin red)."
         )
+    return api_key
+
+
+def _get_client():
+    global client
+    with _client_lock:
+        if client is None:
+            client = OpenAI(api_key=_api_key(), max_retries=0, timeout=request_timeout(EMBEDDING_TIMEOUT))
+    return client
+
+
+def _get_async_client():
+    """Cliente asíncrono compartido (mismo pool de conexiones que el LLM), sin reintentos del SDK"""
+    _api_key()
+    return get_async_client().with_options(max_retries=0, timeout=request_timeout(EMBEDDING_TIMEOUT))
+
+
+# --- Micro-batching de consultas concurrentes ---
+# Las consultas que llegan dentro de la ventana se embeben en una sola petición (0 = desactivado)
+QUERY_BATCH_MAX_WAIT_MS = float(os.getenv("QUERY_BATCH_MAX_WAIT_MS", "5"))
+QUERY_BATCH_MAX_SIZE = int(os.getenv("QUERY_BATCH_MAX_SIZE", "64"))
+
+_RETRYABLE = (openai.RateLimitError, openai.APIConnectionError, openai.APITimeoutError, openai.InternalServerError)
+
+# --- Conteo de tokens ---
+_encoding = None
+_encoding_lock = threading.Lock()
+
+
+def _get_encoding():
+    """tiktoken del modelo; sin red para descargar el BPE se usa una estimación por bytes"""
+    global _encoding
+    with _encoding_lock:
+        if _encoding is None:
+            try:
+                import tiktoken
+                try:
+                    _encoding = tiktoken.encoding_for_model(EMBEDDING_MODEL)
+                except KeyError:
+                    _encoding = tiktoken.get_encoding("cl100k_base")
+            except Exception as e:
+                print(f"[Embeddings] tiktoken no disponible ({e.__class__.__name__}): se estiman tokens por bytes")
+                _encoding = False
+    return _encoding
+
+
+def count_tokens(text: str) -> int:
+    encoding = _get_encoding()
+    if encoding:
+        return len(encoding.encode(text, disallowed_special=()))
+    # Estimación conservadora: ~3 bytes UTF-8 por token en español
+    return len(text.encode("utf-8")) // 3 + 1
+
+
+def _truncate(text: str, max_tokens: int = EMBEDDING_MAX_INPUT_TOKENS) -> str:
+    encoding = _get_encoding()
+    if encoding:
+        tokens = encoding.encode(text, disallowed_special=())
+        return encoding.decode(tokens[:max_tokens]) if len(tokens) > max_tokens else text
+    max_bytes = max_tokens * 3
+    data = text.encode("utf-8")
+    return data[:max_bytes].decode("utf-8", errors="ignore") if len(data) > max_bytes else text
+
+
+def make_batches(texts, max_tokens: int = None, max_size: int = None):
+    """Agrupa inputs consecutivos en lotes por tokens; devuelve [(offset, textos, tokens)]"""
+    max_tokens = max_tokens or EMBEDDING_BATCH_TOKENS
+    max_size = max_size or EMBEDDING_BATCH_SIZE
+    batches = []
+    current, current_tokens, offset = [], 0, 0
+    for i, text in enumerate(texts):
+        tokens = count_tokens(text)
+        if tokens > EMBEDDING_MAX_INPUT_TOKENS:
+            text, tokens = _truncate(text), EMBEDDING_MAX_INPUT_TOKENS
+        if current and (current_tokens + tokens > max_tokens or len(current) >= max_size):
+            batches.append((offset, current, current_tokens))
+            current, current_tokens, offset = [], 0, i
+        current.append(text)
+        current_tokens += tokens
+    if current:
+        batches.append((offset, current, current_tokens))
+    return batches
+
 
-    response = client.embeddings.create(
-        model=EMBEDDING_MODEL,
-        input=texts
+class TokenBudget:
+    """Presupuesto de tokens por minuto compartido por los hilos (token bucket)"""
+
+    def __init__(self, tokens_per_minute: int):
+        self.rate = tokens_per_minute / 60.0
+        self.capacity = tokens_per_minute
+        self.available = float(tokens_per_minute)
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _reserve(self, tokens: int) -> float:
+        """Consume tokens si hay presupuesto (devuelve 0) o devuelve los segundos a esperar"""
+        if self.capacity <= 0:
+            return 0.0
+        # Un lote mayor que el presupuesto entero espera a tener el bucket lleno
+        tokens = min(tokens, self.capacity)
+        with self._lock:
+            now = time.monotonic()
+            self.available = min(self.capacity, self.available + (now - self.updated) * self.rate)
+            self.updated = now
+            if self.available >= tokens:
+                self.available -= tokens
+                return 0.0
+            return (tokens - self.available) / self.rate
+
+    def acquire(self, tokens: int):
+        while True:
+            wait = self._reserve(tokens)
+            if not wait:
+                return
+            time.sleep(wait)
+
+    async def aacquire(self, tokens: int):
+        while True:
+            wait = self._reserve(tokens)
+            if not wait:
+                return
+            await asyncio.sleep(wait)
+
+
+_budget = TokenBudget(EMBEDDING_TPM)
+
+
+def _retry_after(error) -> float:
+    """Segundos indicados por la API en Retry-After / retry-after-ms (None si no hay cabecera)"""
+    response = getattr(error, "response", None)
+    headers = getattr(response, "headers", None) or {}
+    try:
+        if headers.get("retry-after-ms"):
+            return float(headers["retry-after-ms"]) / 1000
+        if headers.get("retry-after"):
+            return float(headers["retry-after"])
+    except (TypeError, ValueError):
+        pass
+    return None
+
+
+def _retry_delay(error, attempt: int) -> float:
+    # Backoff exponencial con jitter completo; Retry-After manda si la API lo envía
+    delay = _retry_after(error)
+    if delay is None:
+        delay = random.uniform(0, min(60.0, 0.5 * 2 ** attempt))
+    else:
+        delay += random.uniform(0, 0.25 * delay)
+    print(f"[Embeddings] {error.__class__.__name__}, reintento {attempt + 1} en {delay:.1f}s")
+    return delay
+
+
+def _embed_batch(texts, tokens: int, dimensions: int = None):
+    extra = {"dimensions": dimensions} if dimensions else {}
+    for attempt in range(EMBEDDING_MAX_RETRIES + 1):
+        _budget.acquire(tokens)
+        try:
+            response = _get_client().embeddings.create(model=EMBEDDING_MODEL, input=texts, **extra)
+            return [d.embedding for d in response.data]
+        except _RETRYABLE as e:
+            if attempt == EMBEDDING_MAX_RETRIES:
+                raise
+            time.sleep(_retry_delay(e, attempt))
+
+
+async def _aembed_batch(async_client, texts, tokens: int, dimensions: int = None):
+    extra = {"dimensions": dimensions} if dimensions else {}
+    for attempt in range(EMBEDDING_MAX_RETRIES + 1):
+        await _budget.aacquire(tokens)
+        try:
+            async with limiter("embeddings", EMBEDDING_CONCURRENCY):
+                response = await async_client.embeddings.create(model=EMBEDDING_MODEL, input=texts, **extra)
+            return [d.embedding for d in response.data]
+        except _RETRYABLE as e:
+            if attempt == EMBEDDING_MAX_RETRIES:
+                raise
+            await asyncio.sleep(_retry_delay(e, attempt))
+
+
+def _embed_openai(texts, dimensions: int = None):
+    batches = make_batches(texts)
+    vectors = [None] * len(texts)
+    if len(batches) == 1 or EMBEDDING_CONCURRENCY <= 1:
+        for offset, batch, tokens in batches:
+            vectors[offset:offset + len(batch)] = _embed_batch(batch, tokens, dimensions)
+        return vectors
+
+    # Lotes en paralelo; cada resultado vuelve a su posición original
+    with ThreadPoolExecutor(max_workers=min(EMBEDDING_CONCURRENCY, len(batches))) as pool:
+        futures = [
+            (offset, pool.submit(_embed_batch, batch, tokens, dimensions)) for offset, batch, tokens in batches
+        ]
+        for offset, future in futures:
+            result = future.result()
+            vectors[offset:offset + len(result)] = result
+    return vectors
+
+
+async def _aembed_openai(texts, dimensions: int = None):
+    async_client = _get_async_client()
+    # Contar tokens es CPU: fuera del event loop
+    batches = await asyncio.to_thread(make_batches, texts)
+    # Todos los lotes a la vez; el semáforo "embeddings" limita los que están en vuelo
+    results = await asyncio.gather(
+        *(_aembed_batch(async_client, batch, tokens, dimensions) for _, batch, tokens in batches)
     )
-    return [d.embedding for d in response.data]
+    return [vector for result in results for vector in result]
+
+
+class OpenAIBackend(EmbeddingBackend):
+    """Embeddings de la API de OpenAI, en lotes por tokens con reintentos"""
+
+    name = "openai"
+
+    def __init__(self, model: str = None, dimensions: int = None):
+        model = model or EMBEDDING_MODEL
+        native_dim = EMBEDDING_DIM or OPENAI_EMBEDDING_DIMS.get(model, 1536)
+        dimensions = EMBEDDING_DIMENSIONS if dimensions is None else dimensions
+        self.dim = min(dimensions, native_dim) if dimensions else native_dim
+        # Solo text-embedding-3-* acepta el parámetro dimensions; el resto se trunca en local
+        self.native_reduction = self.dim < native_dim and model.startswith("text-embedding-3")
+        self.truncate = self.dim < native_dim and not self.native_reduction
+        # La dimensión forma parte del modelo: las cachés no mezclan vectores de distinto tamaño
+        self.model = model if self.dim == native_dim else f"{model}@{self.dim}"
+
+    def embed(self, texts) -> list:
+        vectors = _embed_openai(texts, self.dim if self.native_reduction else None)
+        return reduce_dimensions(vectors, self.dim) if self.truncate else vectors
+
+    async def aembed(self, texts) -> list:
+        vectors = await _aembed_openai(texts, self.dim if self.native_reduction else None)
+        return reduce_dimensions(vectors, self.dim) if self.truncate else vectors
+
+
+BACKENDS = {
+    OpenAIBackend.name: OpenAIBackend,
+    HashingBackend.name: HashingBackend,
+}
+_backend = None
+
+
+def get_backend() -> EmbeddingBackend:
+    """Backend seleccionado con EMBEDDING_BACKEND (uno por proceso)"""
+    global _backend
+    if _backend is None:
+        if EMBEDDING_BACKEND not in BACKENDS:
+            raise ValueError(
+                f"EMBEDDING_BACKEND no soportado: {EMBEDDING_BACKEND} (opciones: {', '.join(BACKENDS)})"
+            )
+        _backend = BACKENDS[EMBEDDING_BACKEND]()
+    return _backend
+
+
+def embedding_dim() -> int:
+    """Dimensión de los embeddings del backend activo (la del índice FAISS)"""
+    return get_backend().dim
+
+
+def embedding_model() -> str:
+    """Identificador del modelo activo, con la dimensión si es reducida (p. ej. text-embedding-3-small@512)"""
+    return get_backend().model
+
+
+def _embed_api(texts):
+    return get_backend().embed(list(texts)) if texts else []
+
+
+def generate_embeddings(texts):
+    """Embeddings de texts en el mismo orden; solo los textos que no están en caché van a la API"""
+    texts = list(texts)
+    cache = get_embedding_cache()
+    if cache is None or not texts:
+        return _embed_api(texts)
+
+    model = get_backend().model
+    vectors = cache.get_many(model, texts)
+    missing = list(dict.fromkeys(text for text, vector in zip(texts, vectors) if vector is None))
+    if missing:
+        new_vectors = _embed_api(missing)
+        cache.put_many(model, missing, new_vectors)
+        by_text = dict(zip(missing, new_vectors))
+        vectors = [vector if vector is not None else by_text[text] for text, vector in zip(texts, vectors)]
+    return vectors
+
+
+# ---------------- Consultas ----------------
+query_cache = LRUCache(QUERY_CACHE_MAX_ENTRIES, QUERY_CACHE_TTL)
+_query_tier = None
+_query_tier_lock = threading.Lock()
+
+
+def _get_query_tier():
+    global _query_tier
+    if not QUERY_CACHE_PATH:
+        return None
+    with _query_tier_lock:
+        if _query_tier is None:
+            _query_tier = EmbeddingCache(QUERY_CACHE_PATH)
+    return _query_tier
+
+
+def _embed_query_batch(queries):
+    # Consultas repetidas dentro del mismo lote se envían una sola vez
+    unique = list(dict.fromkeys(queries))
+    by_query = dict(zip(unique, _embed_api(unique)))
+    return [by_query[q] for q in queries]
+
+
+query_batcher = MicroBatcher(
+    _embed_query_batch, QUERY_BATCH_MAX_SIZE, QUERY_BATCH_MAX_WAIT_MS / 1000, name="query-embedding-batcher"
+)
+
+
+async def _aembed_query_batch(queries):
+    # Con el backend openai: cliente asíncrono compartido y semáforo "embeddings"
+    unique = list(dict.fromkeys(queries))
+    by_query = dict(zip(unique, await get_backend().aembed(unique)))
+    return [by_query[q] for q in queries]
+
+
+# Misma ventana que query_batcher, para las consultas de /ask (aembed_query) dentro del event loop
+query_abatcher = AsyncMicroBatcher(
+    _aembed_query_batch, QUERY_BATCH_MAX_SIZE, QUERY_BATCH_MAX_WAIT_MS / 1000, name="query-embedding-abatcher"
+)
+
+
+def embed_query(query: str):
+    """
+    Embedding de una consulta ya preprocesada (QueryPreprocessor.preprocess).
+    LRU en memoria -> SQLite opcional -> backend; la clave incluye el modelo.
+    """
+    model = get_backend().model
+    key = (model, query)
+    vector = query_cache.get(key)
+    if vector is not None:
+        return vector
+
+    tier = _get_query_tier()
+    if tier is not None:
+        vector = tier.get_many(model, [query])[0]
+    if vector is None:
+        vector = query_batcher(query) if QUERY_BATCH_MAX_WAIT_MS > 0 else _embed_api([query])[0]
+        if tier is not None:
+            tier.put_many(model, [query], [vector])
+    query_cache.put(key, vector)
+    return vector
+
+
+async def aembed_query(query: str):
+    """Versión asíncrona de embed_query: la petición a la API se espera sin bloquear el event loop"""
+    model = get_backend().model
+    key = (model, query)
+    vector = query_cache.get(key)
+    if vector is not None:
+        return vector
+
+    tier = _get_query_tier()
+    if tier is not None:
+        vector = (await asyncio.to_thread(tier.get_many, model, [query]))[0]
+    if vector is None:
+        if QUERY_BATCH_MAX_WAIT_MS > 0:
+            # Se agrupa con las consultas concurrentes de otras peticiones en una sola llamada asíncrona
+            vector = await query_abatcher.submit(query)
+        else:
+            vector = (await get_backend().aembed([query]))[0]
+        if tier is not None:
+            await asyncio.to_thread(tier.put_many, model, [query], [vector])
+    query_cache.put(key, vector)
+    return vector
+
+
+def query_cache_stats() -> dict:
+    stats = query_cache.stats()
+    stats["batching"] = query_batcher.stats()
+    stats["async_batching"] = query_abatcher.stats()
+    tier = _get_query_tier()
+    if tier is not None:
+        stats["sqlite"] = tier.stats()
+    return stats
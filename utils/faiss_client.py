@@ -1,111 +1,736 @@
 import faiss
 import numpy as np
 import os
-import pickle
+import threading
 from typing import Optional
+from utils.index_factory import (
+    FAISS_RERANK_FACTOR, INDEX_TYPE, index_memory_bytes, index_type_of, is_quantized, min_train_size,
+    reconstruct_all, search_parameters, train_and_fill
+)
+from utils.embeddings import embedding_dim, embedding_model
+from utils.chunk_store import CHUNK_DB_FILE, ChunkStore, convert_metadata_pickle
+from utils.document_manifest import (
+    CHANGED, DOCUMENTS_MANIFEST_FILE, NEW, TOUCHED, UNCHANGED, DocumentManifest, file_digest, file_stat
+)
+from utils.memory_stats import process_memory
+from utils.micro_batcher import MicroBatcher
+from utils.segment_store import MANIFEST_VERSION, SegmentStore
 
+# Ficheros del formato antiguo (índice + pickle reescritos en cada add); se importan una vez
 INDEX_FILE = "faiss_index.bin"
 META_FILE = "metadata.pkl"
 
-# --- Singleton compartido con autoreload por mtime ---
+INDEX_DIR = os.getenv("FAISS_INDEX_DIR", "faiss_store")
+# Número de segmentos delta a partir del cual se lanza un merge en segundo plano
+FAISS_MERGE_SEGMENTS = int(os.getenv("FAISS_MERGE_SEGMENTS", "8"))
+# Modo de servicio solo lectura: índice y chunk store mapeados en memoria y compartidos entre workers
+FAISS_READ_ONLY = os.getenv("FAISS_READ_ONLY", "0").lower() in ("1", "true", "yes")
+# Cada cuántos segundos el watcher comprueba si otro proceso publicó una generación nueva (0 = desactivado)
+FAISS_WATCH_INTERVAL = float(os.getenv("FAISS_WATCH_INTERVAL", "1.0"))
+# Fracción de ids borrados en la base a partir de la cual se compacta en segundo plano
+FAISS_COMPACT_RATIO = float(os.getenv("FAISS_COMPACT_RATIO", "0.2"))
+# Con filtros que dejan como mucho este número de chunks se calcula la distancia exacta
+# sobre sus vectores del log en lugar de pedir al índice aproximado (IVF/HNSW) que los encuentre
+FAISS_FILTER_EXACT_MAX = int(os.getenv("FAISS_FILTER_EXACT_MAX", "4096"))
+# Ventana para agrupar búsquedas concurrentes en una sola llamada a index.search (0 = desactivado)
+FAISS_COALESCE_WAIT_MS = float(os.getenv("FAISS_COALESCE_WAIT_MS", "0"))
+FAISS_COALESCE_MAX_BATCH = int(os.getenv("FAISS_COALESCE_MAX_BATCH", "64"))
+# Formatos que se indexan desde la carpeta de documentos
+DOCUMENT_EXTENSIONS = (".pdf", ".docx", ".txt")
+
+# --- Singleton compartido: una sola copia del índice por proceso ---
 _shared_client: Optional["FAISSClient"] = None
-_last_index_mtime: Optional[float] = None
-_last_meta_mtime: Optional[float] = None
+_shared_lock = threading.Lock()
 
 
-def get_client(dim: int = 1536) -> "FAISSClient":
+def get_client(dim: int = None) -> "FAISSClient":
+    """Índice compartido del proceso; por defecto con la dimensión del backend de embeddings"""
     global _shared_client
-    if _shared_client is None:
-        _shared_client = FAISSClient(dim)
+    dim = dim or embedding_dim()
+    with _shared_lock:
+        if _shared_client is None:
+            _shared_client = FAISSClient(dim)
+            _shared_client.start_watcher()
+        elif _shared_client.dim != dim:
+            raise ValueError(f"El índice compartido tiene dimensión {_shared_client.dim}, se pidió {dim}")
     return _shared_client
 
 
+class IndexGeneration:
+    """
+    Vista inmutable del índice para una generación del manifest:
+    base compactada (ids < base_upto) + un índice flat por segmento delta, todos con ids de chunk.
+    Los ids borrados (tombstones) se excluyen dentro de la búsqueda con un selector.
+    Nunca se modifica; los cambios publican una generación nueva.
+    """
+
+    def __init__(self, generation: int, base, base_upto: int, segments: tuple, ntotal: int,
+                 tombstones: frozenset = frozenset()):
+        self.generation = generation
+        self.base = base
+        self.base_upto = base_upto
+        self.segments = segments  # ((start, IndexIDMap2 flat), ...)
+        self.ntotal = ntotal
+        self.tombstones = tombstones
+        # Selector de solo lectura compartido por todas las consultas de esta generación
+        self._tombstone_batch = None
+        self._exclude = None
+        if tombstones:
+            self._tombstone_batch = faiss.IDSelectorBatch(np.fromiter(tombstones, dtype="int64", count=len(tombstones)))
+            self._exclude = faiss.IDSelectorNot(self._tombstone_batch)
+
+    def replace(self, **changes) -> "IndexGeneration":
+        fields = dict(
+            generation=self.generation, base=self.base, base_upto=self.base_upto,
+            segments=self.segments, ntotal=self.ntotal, tombstones=self.tombstones,
+        )
+        fields.update(changes)
+        return IndexGeneration(**fields)
+
+    @property
+    def approximate(self) -> bool:
+        """True si la base no es flat (una búsqueda con selector puede no encontrar todos los permitidos)"""
+        return self.base is not None and index_type_of(self.base) != "flat"
+
+    def live_ids(self, ids) -> np.ndarray:
+        """Ids permitidos por un filtro que existen en esta generación y no están borrados"""
+        ids = np.asarray(ids, dtype="int64")
+        ids = ids[ids < self.ntotal]
+        if self.tombstones:
+            ids = ids[~np.isin(ids, np.fromiter(self.tombstones, dtype="int64", count=len(self.tombstones)))]
+        return ids
+
+    def allowed_selector(self, allowed_ids):
+        """
+        Selector bitmap con los ids permitidos (ya sin borrados). Devuelve también el bitmap,
+        que debe seguir referenciado mientras dure la búsqueda.
+        """
+        mask = np.zeros(self.ntotal, dtype=bool)
+        mask[allowed_ids] = True
+        bitmap = np.packbits(mask, bitorder="little")
+        return faiss.IDSelectorBitmap(bitmap), bitmap
+
+    def search(self, query, top_k, selector=None):
+        """Busca en base y segmentos y combina por distancia"""
+        return self.search_batch(query, top_k, selector)[0]
+
+    def search_batch(self, queries, top_k, selector=None):
+        """
+        Búsqueda de una matriz de consultas (n, dim) con una llamada a cada índice:
+        FAISS reparte las filas entre hilos (OpenMP/BLAS). Devuelve una lista de hits por fila.
+        """
+        selector = self._exclude if selector is None else selector
+        hits = [[] for _ in range(len(queries))]
+        if self.base is not None and self.base.ntotal:
+            params = search_parameters(self.base, selector)
+            distances, indices = self.base.search(queries, top_k, params=params)
+            for row, (drow, irow) in enumerate(zip(distances, indices)):
+                hits[row].extend((float(d), int(i)) for d, i in zip(drow, irow) if i >= 0)
+        for _, index in self.segments:
+            params = search_parameters(index, selector)
+            distances, indices = index.search(queries, min(top_k, index.ntotal), params=params)
+            for row, (drow, irow) in enumerate(zip(distances, indices)):
+                hits[row].extend((float(d), int(i)) for d, i in zip(drow, irow) if i >= 0)
+        for row in hits:
+            row.sort()
+            del row[top_k:]
+        return hits
+
+
+def _flat_segment(dim: int, vectors, start: int) -> faiss.IndexIDMap2:
+    return train_and_fill(dim, "flat", vectors, np.arange(start, start + len(vectors), dtype="int64"))
+
+
 class FAISSClient:
-    def __init__(self, dim: int = 1536):
-        self.dim = dim
-        self.index = faiss.IndexFlatL2(dim)
-        self.metadata = []
+    def __init__(self, dim: int = None, index_type: str = None, index_dir: str = None, read_only: bool = None):
+        # Sin dim explícita, dimensión y modelo salen del backend de embeddings y quedan en el manifest
+        model = None if dim else embedding_model()
+        self.dim = dim or embedding_dim()
+        self.index_type = (index_type or INDEX_TYPE).lower()
+        self.read_only = FAISS_READ_ONLY if read_only is None else read_only
+        self.store = SegmentStore(index_dir or INDEX_DIR, self.dim, model)
+        self.chunks = ChunkStore(self.store.path(CHUNK_DB_FILE), read_only=self.read_only)
+        # Qué versión de cada documento está indexada (ver utils/document_manifest.py)
+        self.documents = DocumentManifest(self.store.path(DOCUMENTS_MANIFEST_FILE))
+        # Solo los escritores (add, merge, recarga) toman el lock; las consultas leen self._current
+        self._lock = threading.RLock()
+        self._merge_thread: Optional[threading.Thread] = None
+        self._watcher: Optional[threading.Thread] = None
+        self._stop_watcher = threading.Event()
+        self._manifest_mtime = None
+        self._current = IndexGeneration(0, None, 0, (), 0)
+        self._coalescer = MicroBatcher(
+            self._query_items, FAISS_COALESCE_MAX_BATCH, FAISS_COALESCE_WAIT_MS / 1000, name="faiss-coalescer"
+        )
         self._load_if_available()
 
+    # ---------------- Vista de la generación actual ----------------
+    @property
+    def generation(self) -> int:
+        return self._current.generation
+
+    @property
+    def base(self):
+        return self._current.base
+
+    @property
+    def base_upto(self) -> int:
+        return self._current.base_upto
+
+    @property
+    def segments(self) -> tuple:
+        return self._current.segments
+
+    @property
+    def index(self):
+        """Índice compactado de la generación actual (None si todo está aún en segmentos delta)"""
+        return self._current.base
+
+    @property
+    def ntotal(self) -> int:
+        return self._current.ntotal
+
+    # ---------------- Carga / replay del manifest ----------------
     def _load_if_available(self):
-        global _last_index_mtime, _last_meta_mtime
-        if os.path.exists(INDEX_FILE) and os.path.exists(META_FILE):
-            self.index = faiss.read_index(INDEX_FILE)
-            with open(META_FILE, "rb") as f:
-                self.metadata = pickle.load(f)
-            _last_index_mtime = os.path.getmtime(INDEX_FILE)
-            _last_meta_mtime = os.path.getmtime(META_FILE)
-
-    def _reload_if_changed(self):
-        global _last_index_mtime, _last_meta_mtime
-        try:
-            idx_mtime = os.path.getmtime(INDEX_FILE) if os.path.exists(INDEX_FILE) else None
-            meta_mtime = os.path.getmtime(META_FILE) if os.path.exists(META_FILE) else None
-        except Exception:
-            idx_mtime = meta_mtime = None
-
-        if idx_mtime and meta_mtime and (idx_mtime != _last_index_mtime or meta_mtime != _last_meta_mtime):
-            # Recargar desde disco
-            self.index = faiss.read_index(INDEX_FILE)
-            with open(META_FILE, "rb") as f:
-                self.metadata = pickle.load(f)
-            _last_index_mtime = idx_mtime
-            _last_meta_mtime = meta_mtime
+        if self.read_only:
+            if self.store.exists():
+                self._load()
+            else:
+                print(f"[FAISS] Modo solo lectura: no hay índice en '{self.store.root}'")
+            return
+        if not self.store.exists() and os.path.exists(INDEX_FILE) and os.path.exists(META_FILE):
+            self._import_legacy(INDEX_FILE, META_FILE)
+        if self.store.exists():
+            self._load()
+
+    def _build_generation(self, manifest: dict) -> IndexGeneration:
+        base, base_upto = None, 0
+        if manifest.get("base"):
+            base = self.store.read_index(manifest["base"]["index"], mmap=self.read_only)
+            base_upto = manifest["base"]["upto"]
+        segments = tuple(
+            (seg["start"], _flat_segment(
+                self.dim, self.store.read_vectors(seg["start"], seg["start"] + seg["count"]), seg["start"]
+            ))
+            for seg in manifest["segments"]
+        )
+        return IndexGeneration(
+            manifest["generation"], base, base_upto, segments, manifest["ntotal"], self.chunks.tombstones()
+        )
 
+    def _load(self):
+        with self._lock:
+            mtime = self.store.manifest_mtime()
+            manifest = self.store.load_manifest()
+            if manifest["version"] < MANIFEST_VERSION:
+                if self.read_only:
+                    raise RuntimeError("El índice usa un formato antiguo; ábrelo una vez en modo escritura para migrarlo")
+                manifest = self._upgrade_manifest(manifest)
+                mtime = self.store.manifest_mtime()
+            if not self.read_only:
+                self.store.truncate_log(manifest["ntotal"])
+            self.chunks.truncate(manifest["ntotal"])
+            self.chunks.refresh(manifest["ntotal"])
+
+            self._current = self._build_generation(manifest)
+            self._manifest_mtime = mtime
+
+            if not self.read_only:
+                self.store.remove_unreferenced(manifest)
+            print(f"[FAISS] Cargados {self.ntotal} vectores ({len(manifest['segments'])} segmentos delta)")
+
+    def _import_legacy(self, index_file: str, meta_file: str):
+        """Convierte faiss_index.bin + metadata.pkl al layout por segmentos"""
+        print(f"[FAISS] Importando índice antiguo {index_file} a '{self.store.root}'")
+        legacy = faiss.read_index(index_file)
+
+        manifest = self.store._empty_manifest()
+        self.store.append_vectors(reconstruct_all(legacy))
+        convert_metadata_pickle(meta_file, self.chunks)
+        name = self.store.next_name(manifest, "base")
+        self.store.write_index(name + ".faiss", legacy)
+        manifest["base"] = {"index": name + ".faiss", "upto": legacy.ntotal}
+        manifest["ntotal"] = legacy.ntotal
+        self.store.commit(manifest)
+
+    def _upgrade_manifest(self, manifest: dict) -> dict:
+        """Manifest v1: la metadata estaba en pickles por base/segmento; se pasa al chunk store"""
+        base = manifest.get("base")
+        if base:
+            convert_metadata_pickle(self.store.path(base.pop("meta")), self.chunks, 0)
+        for seg in manifest["segments"]:
+            convert_metadata_pickle(self.store.path(seg.pop("meta")), self.chunks, seg["start"])
+        manifest["version"] = MANIFEST_VERSION
+        return self.store.commit(manifest)
+
+    # ---------------- Hot-swap de generaciones ----------------
+    def refresh(self) -> bool:
+        """
+        Carga la generación que otro proceso haya publicado y la activa de forma atómica.
+        Se ejecuta en el watcher, fuera del camino de las consultas.
+        """
+        mtime = self.store.manifest_mtime()
+        if not mtime or mtime == self._manifest_mtime:
+            return False
+        with self._lock:
+            manifest = self.store.load_manifest()
+            current = self._current
+            if manifest["generation"] == current.generation:
+                # Nuestra propia escritura: la memoria ya está al día
+                self._manifest_mtime = mtime
+                return False
+
+            base = manifest.get("base") or {}
+            if base.get("upto", 0) != current.base_upto or manifest["ntotal"] < current.ntotal:
+                # Otro proceso compactó: se construye la generación completa con la base nueva
+                self.chunks.truncate(manifest["ntotal"])
+                self.chunks.reload_postings()
+                new = self._build_generation(manifest)
+            else:
+                # Solo hay segmentos nuevos: se añaden sin releer la base
+                segments = current.segments
+                if manifest["ntotal"] > current.ntotal:
+                    vectors = self.store.read_vectors(current.ntotal, manifest["ntotal"])
+                    segments = segments + ((current.ntotal, _flat_segment(self.dim, vectors, current.ntotal)),)
+                new = current.replace(
+                    generation=manifest["generation"], segments=segments, ntotal=manifest["ntotal"],
+                    tombstones=self.chunks.tombstones(),
+                )
+
+            self.chunks.refresh(manifest["ntotal"])
+            self._current = new
+            self._manifest_mtime = mtime
+            print(f"[FAISS] Generación {new.generation} activa ({new.ntotal} vectores)")
+            return True
+
+    def start_watcher(self, interval: float = None):
+        """Arranca el hilo que vigila el manifest (polling) y hace hot-swap de generaciones"""
+        interval = FAISS_WATCH_INTERVAL if interval is None else interval
+        if interval <= 0 or (self._watcher is not None and self._watcher.is_alive()):
+            return
+        self._stop_watcher.clear()
+
+        def _watch():
+            while not self._stop_watcher.wait(interval):
+                try:
+                    self.refresh()
+                except Exception as e:
+                    # p. ej. una base borrada mientras se leía: se reintenta en el siguiente ciclo
+                    print(f"[FAISS] Error cargando nueva generación: {e}")
+
+        self._watcher = threading.Thread(target=_watch, name="faiss-watcher", daemon=True)
+        self._watcher.start()
+
+    def stop_watcher(self):
+        self._stop_watcher.set()
+
+    # ---------------- Escritura ----------------
     def add_embeddings(self, embeddings, metadatas):
+        if self.read_only:
+            raise RuntimeError("Índice FAISS abierto en modo solo lectura (FAISS_READ_ONLY)")
         vectors = np.array(embeddings).astype("float32")
-        self.index.add(vectors)
-        self.metadata.extend(metadatas)
-        self._save()
+        if len(vectors) == 0:
+            return
+        with self._lock:
+            manifest = dict(self.store.manifest, segments=list(self.store.manifest["segments"]))
+            # Se comprueba antes de escribir: un log desalineado no debe acumular filas huérfanas
+            start = self.store.append_vectors(vectors, expected_start=manifest["ntotal"])
 
-    def query(self, query_vector, top_k=5, force_min_chunk=True):
-        """Busca en FAISS y devuelve chunks con metadata normalizada"""
-        # Asegurar que estamos leyendo la última versión del índice
-        self._reload_if_changed()
+            # La metadata se escribe antes del manifest: filas sin confirmar se descartan al cargar
+            self.chunks.add(start, metadatas)
+            manifest["segments"].append({"start": start, "count": len(vectors)})
+            manifest["ntotal"] = start + len(vectors)
+            manifest = self.store.commit(manifest)
 
-        if self.index.ntotal == 0:
-            return []
+            # Publicación en memoria: visible para la siguiente consulta sin recargar desde disco
+            current = self._current
+            self._current = current.replace(
+                generation=manifest["generation"],
+                segments=current.segments + ((start, _flat_segment(self.dim, vectors, start)),),
+                ntotal=manifest["ntotal"],
+            )
+            self._manifest_mtime = self.store.manifest_mtime()
 
-        query = np.array([query_vector]).astype("float32")
-        distances, indices = self.index.search(query, top_k)
+            if len(manifest["segments"]) >= FAISS_MERGE_SEGMENTS:
+                self.merge_segments(background=True)
+        return list(range(start, start + len(vectors)))
 
-        results = []
-        seen_keys = set()
+    def delete_ids(self, ids) -> int:
+        """Marca chunks como borrados (tombstones); la compactación libera su espacio"""
+        if self.read_only:
+            raise RuntimeError("Índice FAISS abierto en modo solo lectura (FAISS_READ_ONLY)")
+        with self._lock:
+            current = self._current
+            ids = {int(i) for i in ids} - current.tombstones
+            if not ids:
+                return 0
+            # Primero SQLite, luego el manifest: la nueva generación avisa a los demás procesos
+            self.chunks.delete(ids)
+            manifest = self.store.commit(dict(self.store.manifest))
+            self._current = current.replace(generation=manifest["generation"], tombstones=current.tombstones | ids)
+            self._manifest_mtime = self.store.manifest_mtime()
+
+            dead_in_base = sum(1 for i in self._current.tombstones if i < current.base_upto)
+            if current.base_upto and dead_in_base / current.base_upto > FAISS_COMPACT_RATIO:
+                self.merge_segments(background=True, compact=True)
+            return len(ids)
 
-        for idx, dist in zip(indices[0], distances[0]):
-            if idx < len(self.metadata):
-                meta = self.metadata[idx].copy()
-
-                # --- Score normalizado ---
-                score = 1.0 / (1.0 + float(dist))   # 0 < score <= 1
-                meta["relevance_score"] = round(score, 4)
-
-                # --- Garantizar campos mínimos ---
-                meta.setdefault("text", "")
-                meta.setdefault("source", "")
-                meta.setdefault("page", None)
-                meta.setdefault("chunk_index", None)
-                meta.setdefault("section", None)
-                meta.setdefault("source_path", None)
-
-                # --- Evitar duplicados (mismo texto/página) ---
-                key = f"{meta['source']}_{meta['page']}_{meta['chunk_index']}"
-                if key in seen_keys:
+    def delete_document(self, source: str) -> int:
+        """Borra todos los chunks de un documento (por su 'source')"""
+        removed = self.delete_ids(self.chunks.ids_for_source(source))
+        self.documents.remove(source)
+        print(f"[FAISS] Documento '{source}': {removed} chunks marcados como borrados")
+        return removed
+
+    def upsert_document(self, path: str, metadata: dict = None, progress=None):
+        """
+        Reindexa un documento sin duplicar chunks: añade la versión nueva y después
+        marca como borrados los chunks anteriores del mismo 'source'.
+        progress recibe el avance por etapas (ver DocumentProcessor.process).
+        """
+        # Import diferido: document_processor importa este módulo
+        from utils.document_processor import DocumentProcessor
+
+        metadata = dict(metadata or {})
+        metadata.setdefault("source", os.path.basename(path))
+        # Huella tomada antes de procesar: si el fichero cambia mientras tanto, el siguiente arranque lo reindexa
+        stat, digest = file_stat(path), file_digest(path)
+        old_ids = self.chunks.ids_for_source(metadata["source"])
+        chunks = DocumentProcessor(self).process(path, metadata, progress)
+        if old_ids:
+            self.delete_ids(old_ids)
+            print(f"[FAISS] Documento '{metadata['source']}': {len(old_ids)} chunks anteriores reemplazados")
+        self.documents.record(metadata["source"], stat, digest, self.document_params(), len(chunks))
+        return chunks
+
+    def document_params(self) -> dict:
+        """Parámetros que determinan los chunks de un documento: si cambian, hay que reindexarlo"""
+        from utils.document_processor import CHUNK_OVERLAP, CHUNK_SIZE
+
+        return {
+            "chunk_size": CHUNK_SIZE,
+            "chunk_overlap": CHUNK_OVERLAP,
+            "embedding_model": self.store.embedding_model or embedding_model(),
+        }
+
+    def sync_documents(self, folder: str, extensions=DOCUMENT_EXTENSIONS) -> dict:
+        """
+        Indexación incremental de una carpeta: procesa solo los documentos nuevos o cambiados
+        (según el manifest de documentos) y borra los chunks de los que ya no están.
+        Devuelve los nombres por categoría: added, updated, unchanged, removed, failed.
+        """
+        if self.read_only:
+            raise RuntimeError("Índice FAISS abierto en modo solo lectura (FAISS_READ_ONLY)")
+        params = self.document_params()
+        summary = {"added": [], "updated": [], "unchanged": [], "removed": [], "failed": []}
+        present = set()
+        for name in sorted(os.listdir(folder)):
+            path = os.path.join(folder, name)
+            if not name.lower().endswith(tuple(extensions)) or not os.path.isfile(path):
+                continue
+            present.add(name)
+            try:
+                state, stat, _ = self.documents.check(name, path, params)
+                entry = self.documents.get(name)
+                if state in (UNCHANGED, TOUCHED) and entry.get("chunks") and not self.chunks.ids_for_source(name):
+                    # El manifest lo da por indexado pero sus chunks ya no están en el índice
+                    state = CHANGED
+                if state == TOUCHED:
+                    self.documents.touch(name, stat)
+                if state in (UNCHANGED, TOUCHED):
+                    summary["unchanged"].append(name)
                     continue
-                seen_keys.add(key)
+                print(f"  ➜ Indexando {name}")
+                self.upsert_document(path, {"source": name})
+                summary["added" if state == NEW else "updated"].append(name)
+            except Exception as e:
+                # Un documento ilegible no impide indexar el resto; se reintenta en el siguiente arranque
+                print(f"[FAISS] Error indexando '{name}': {e}")
+                summary["failed"].append(name)
+        for source in self.documents.sources():
+            if source not in present:
+                self.delete_document(source)
+                summary["removed"].append(source)
+        return summary
+
+    def compact(self):
+        """Reconstruye la base sin los ids borrados y purga su metadata"""
+        return self.merge_segments(background=False, compact=True)
+
+    def merge_segments(self, background: bool = False, compact: bool = False):
+        """Compacta los segmentos delta en una nueva base (y con compact, elimina los borrados)"""
+        if self.read_only:
+            return None
+        running = self._merge_thread
+        if not background and running is not None and running.is_alive():
+            # Un merge síncrono (p. ej. compact()) espera al que ya está en curso y luego se ejecuta
+            running.join()
+        with self._lock:
+            if self._merge_thread is not None and self._merge_thread.is_alive():
+                return self._merge_thread
+            if not background:
+                self._merge(compact)
+                return None
+            self._merge_thread = threading.Thread(target=self._merge, args=(compact,), name="faiss-merge", daemon=True)
+            self._merge_thread.start()
+            return self._merge_thread
+
+    def _merge(self, compact: bool = False):
+        with self._lock:
+            current = self._current
+            upto = self.store.manifest["ntotal"]
+            if upto == current.base_upto and not compact:
+                return
+            base, base_upto = current.base, current.base_upto
+            dead = np.array(sorted(i for i in current.tombstones if i < upto), dtype="int64")
+
+        # Construcción y escritura de la nueva base fuera del lock: las consultas siguen sobre la generación actual
+        if not compact and base is not None and isinstance(base, faiss.IndexIDMap2):
+            new_ids = np.setdiff1d(np.arange(base_upto, upto, dtype="int64"), dead)
+            target_type = self.index_type if base.ntotal + len(new_ids) >= min_train_size(self.index_type) else "flat"
+            rebuild = index_type_of(base) != target_type
+        else:
+            rebuild = True
+
+        if rebuild:
+            # Reconstrucción desde el log con los ids vivos: vectores exactos, sin los borrados
+            live_ids = np.array(self.chunks.live_ids(upto), dtype="int64")
+            target_type = self.index_type if len(live_ids) >= min_train_size(self.index_type) else "flat"
+            if target_type != "flat":
+                print(f"[FAISS] Entrenando índice {target_type} con {len(live_ids)} vectores")
+            new_base = train_and_fill(self.dim, target_type, self.store.read_rows(live_ids), live_ids)
+            purged = dead
+        else:
+            new_base = faiss.clone_index(base)
+            if len(new_ids):
+                new_base.add_with_ids(self.store.read_rows(new_ids), new_ids)
+            purged = dead[dead >= base_upto]
+
+        with self._lock:
+            manifest = dict(self.store.manifest)
+            name = self.store.next_name(manifest, "base")
+            self.store.write_index(name + ".faiss", new_base)
+            manifest["base"] = {"index": name + ".faiss", "upto": upto}
+            manifest["segments"] = [seg for seg in self.store.manifest["segments"] if seg["start"] >= upto]
+            manifest = self.store.commit(manifest)
+
+            # Los segmentos y borrados que llegaron durante el merge pasan tal cual a la nueva generación
+            current = self._current
+            purged_set = frozenset(int(i) for i in purged)
+            self._current = current.replace(
+                generation=manifest["generation"], base=new_base, base_upto=upto,
+                segments=tuple(seg for seg in current.segments if seg[0] >= upto),
+                tombstones=current.tombstones - purged_set,
+            )
+            self._manifest_mtime = self.store.manifest_mtime()
+            self.chunks.purge(purged_set)
+            self.store.remove_unreferenced(manifest)
+            print(
+                f"[FAISS] Merge completado: base con {new_base.ntotal} vectores, "
+                f"{len(manifest['segments'])} segmentos delta, {len(purged_set)} borrados purgados"
+            )
+
+    def memory_stats(self) -> dict:
+        """Memoria compartida vs privada del proceso, con el desglose de los ficheros del índice"""
+        stats = process_memory(self.store.root)
+        stats["read_only"] = self.read_only
+        stats["vectors"] = self.ntotal
+        stats["generation"] = self.generation
+        stats["index"] = self.index_memory()
+        return stats
+
+    def index_memory(self) -> dict:
+        """Memoria del índice en RAM frente a guardar los mismos vectores en float32 (IndexFlatL2)"""
+        current = self._current
+        base_bytes = index_memory_bytes(current.base)
+        segment_bytes = sum(index_memory_bytes(index) for _, index in current.segments)
+        vectors = (current.base.ntotal if current.base is not None else 0) + sum(
+            index.ntotal for _, index in current.segments
+        )
+        float32_bytes = vectors * (self.dim * 4 + 8)
+        return {
+            "type": index_type_of(current.base) if current.base is not None else "flat",
+            "quantized": is_quantized(current.base),
+            "rerank_factor": FAISS_RERANK_FACTOR if is_quantized(current.base) else 0,
+            "bytes": base_bytes + segment_bytes,
+            "float32_bytes": float32_bytes,
+            "saved_bytes": float32_bytes - base_bytes - segment_bytes,
+        }
+
+    # ---------------- Búsqueda ----------------
+    def _exact_search(self, query, top_k, allowed_ids):
+        """Distancia L2 exacta sobre los vectores del log de los ids permitidos"""
+        vectors = self.store.read_rows(allowed_ids)
+        distances = ((vectors - query[0]) ** 2).sum(axis=1)
+        order = np.argsort(distances)[:top_k]
+        return [(float(distances[i]), int(allowed_ids[i])) for i in order]
+
+    def _rerank(self, query, hits, top_k):
+        """Reordena candidatos de una base cuantizada con los vectores float32 del log (mapeado en memoria)"""
+        if not hits:
+            return hits
+        return self._exact_search(query, top_k, np.array([idx for _, idx in hits], dtype="int64"))
+
+    def _search(self, current: IndexGeneration, query, top_k, allowed_ids=None):
+        # Base cuantizada (SQ/PQ): primera pasada sobre los códigos y re-rank exacto de los candidatos
+        rerank = FAISS_RERANK_FACTOR if is_quantized(current.base) else 0
+        fetch = top_k * rerank if rerank else top_k
+        if allowed_ids is None:
+            hits = current.search(query, fetch)
+        else:
+            hits = self._filtered_search(current, query, fetch, allowed_ids)
+        return self._rerank(query, hits, top_k) if rerank else hits
+
+    def _filtered_search(self, current: IndexGeneration, query, top_k, allowed_ids):
+        """
+        Búsqueda restringida a allowed_ids dentro del índice (selector bitmap), en una sola pasada.
+        Si el filtro es selectivo y la base es aproximada, se calcula la distancia exacta; si la
+        búsqueda aproximada devuelve menos de los que existen, también.
+        """
+        wanted = min(top_k, len(allowed_ids))
+        if current.approximate and len(allowed_ids) <= FAISS_FILTER_EXACT_MAX:
+            return self._exact_search(query, top_k, allowed_ids)
+        # bitmap sigue referenciado en esta función mientras FAISS usa el selector
+        selector, bitmap = current.allowed_selector(allowed_ids)
+        hits = current.search(query, top_k, selector=selector)
+        if len(hits) < wanted:
+            return self._exact_search(query, top_k, allowed_ids)
+        return hits
 
-                results.append(meta)
+    def _dedup(self, current: IndexGeneration, hits):
+        # Deduplicar con las columnas compactas en RAM, antes de leer texto de disco
+        kept = []
+        seen_keys = set()
+        for dist, idx in hits:
+            if idx >= current.ntotal:
+                continue
+            key = self.chunks.dedup_key(idx)
+            if key in seen_keys:
+                continue
+            seen_keys.add(key)
+            kept.append((dist, idx))
+        return kept
+
+    def _results(self, kept, rows):
+        results = []
+        for dist, idx in kept:
+            meta = rows.get(idx)
+            if meta is None:
+                continue
+            meta = dict(meta)
+            # Id global del chunk: estable mientras el chunk exista (clave de la caché de respuestas)
+            meta["chunk_id"] = int(idx)
 
+            # --- Score normalizado ---
+            score = 1.0 / (1.0 + float(dist))   # 0 < score <= 1
+            meta["relevance_score"] = round(score, 4)
+
+            # --- Garantizar campos mínimos ---
+            meta.setdefault("text", "")
+            meta.setdefault("source", "")
+            meta.setdefault("page", None)
+            meta.setdefault("chunk_index", None)
+            meta.setdefault("section", None)
+            meta.setdefault("source_path", None)
+            results.append(meta)
+        return results
+
+    def _fallback(self):
         # --- Si no pasa ningún chunk y hay metadata disponible, forzar el mejor ---
-        if force_min_chunk and not results and len(self.metadata) > 0:
-            best = self.metadata[0].copy()
-            best["relevance_score"] = 0.1  # mínimo para que pase el filtro
-            results.append(best)
+        first_id = self.chunks.first_live_id()
+        best = self.chunks.get([first_id]).get(first_id) if first_id is not None else None
+        if best is None:
+            return []
+        best["relevance_score"] = 0.1  # mínimo para que pase el filtro
+        best["chunk_id"] = int(first_id)
+        return [best]
+
+    def query(self, query_vector, top_k=5, force_min_chunk=True, allowed_ids=None):
+        """
+        Busca en FAISS y devuelve chunks con metadata normalizada.
+        Con allowed_ids (p. ej. ChunkStore.ids_matching) la búsqueda se limita a esos chunks
+        y devuelve hasta top_k de ellos sin pasadas adicionales sin filtro.
+        """
+        # Una sola lectura de la generación actual: sin syscalls ni locks en el camino de la consulta.
+        # Si el watcher hace swap mientras tanto, esta consulta termina sobre la generación anterior.
+        current = self._current
+        if current.ntotal == 0:
+            return []
 
+        query = np.array([query_vector]).astype("float32")
+        if allowed_ids is not None:
+            allowed_ids = current.live_ids(allowed_ids)
+            if len(allowed_ids) == 0:
+                return []
+
+        # Si la deduplicación deja menos de top_k, se amplía la búsqueda
+        k = top_k
+        while True:
+            hits = self._search(current, query, k, allowed_ids)
+            kept = self._dedup(current, hits)
+            if len(kept) >= top_k or len(hits) < k:
+                break
+            k *= 2
+        kept = kept[:top_k]
+
+        results = self._results(kept, self.chunks.get([idx for _, idx in kept]))
+        if force_min_chunk and not results and allowed_ids is None:
+            results = self._fallback()
         return results
 
-    def _save(self):
-        global _last_index_mtime, _last_meta_mtime
-        faiss.write_index(self.index, INDEX_FILE)
-        with open(META_FILE, "wb") as f:
-            pickle.dump(self.metadata, f)
+    def query_batch(self, vectors, top_k=5, allowed_ids=None, force_min_chunk=True):
+        """
+        Varias consultas a la vez: las que no tienen filtro se resuelven con una sola
+        llamada a index.search sobre la matriz de vectores. allowed_ids es None o una
+        lista (una entrada por consulta, None = sin filtro); cada consulta filtrada usa
+        su propio selector. Devuelve una lista de resultados por consulta, igual que query().
+        """
+        current = self._current
+        queries = np.ascontiguousarray(np.asarray(vectors, dtype="float32").reshape(-1, self.dim))
+        n = len(queries)
+        if current.ntotal == 0 or n == 0:
+            return [[] for _ in range(n)]
+        allowed_ids = list(allowed_ids) if allowed_ids is not None else [None] * n
+        if len(allowed_ids) != n:
+            raise ValueError(f"allowed_ids tiene {len(allowed_ids)} entradas para {n} consultas")
+
+        hits = [None] * n
+        plain = [i for i in range(n) if allowed_ids[i] is None]
+        if plain:
+            rerank = FAISS_RERANK_FACTOR if is_quantized(current.base) else 0
+            fetch = top_k * rerank if rerank else top_k
+            for i, row in zip(plain, current.search_batch(queries[plain], fetch)):
+                hits[i] = self._rerank(queries[i:i + 1], row, top_k) if rerank else row
+        for i in range(n):
+            if allowed_ids[i] is not None:
+                live = current.live_ids(allowed_ids[i])
+                hits[i] = self._search(current, queries[i:i + 1], top_k, live) if len(live) else []
+
+        kept = [self._dedup(current, row)[:top_k] for row in hits]
+        rows = self.chunks.get({idx for row in kept for _, idx in row})
+        results = []
+        for i in range(n):
+            if len(kept[i]) < top_k and len(hits[i]) >= top_k:
+                # La deduplicación dejó huecos: esta consulta se repite sola ampliando k
+                results.append(self.query(queries[i], top_k, force_min_chunk, allowed_ids[i]))
+                continue
+            result = self._results(kept[i], rows)
+            if force_min_chunk and not result and allowed_ids[i] is None:
+                result = self._fallback()
+            results.append(result)
+        return results
+
+    def _query_items(self, items):
+        # items: [(vector, top_k, allowed_ids)] de peticiones concurrentes -> una sola query_batch
+        max_k = max(top_k for _, top_k, _ in items)
+        batch = self.query_batch([v for v, _, _ in items], max_k, [a for _, _, a in items])
+        return [result[:top_k] for result, (_, top_k, _) in zip(batch, items)]
+
+    def query_coalesced(self, query_vector, top_k=5, allowed_ids=None):
+        """
+        Como query(), pero las búsquedas concurrentes de otros hilos dentro de
+        FAISS_COALESCE_WAIT_MS se agrupan en una sola query_batch (0 = búsqueda directa).
+        """
+        if FAISS_COALESCE_WAIT_MS <= 0:
+            return self.query(query_vector, top_k, allowed_ids=allowed_ids)
+        return self._coalescer((np.asarray(query_vector, dtype="float32"), top_k, allowed_ids))
@@ -0,0 +1,208 @@
+import faiss
+import numpy as np
+import os
+import math
+
+# --- Configuración de tipos de índice ---
+# flat  -> IndexFlatL2 (búsqueda exacta, fuerza bruta)
+# ivf   -> IVF-Flat (listas invertidas, requiere entrenamiento)
+# hnsw  -> HNSW-Flat (grafo, sin entrenamiento)
+# ivfpq -> IVF-PQ (listas invertidas + product quantization, requiere entrenamiento)
+# sq8   -> fuerza bruta sobre vectores escalar-cuantizados a int8 (4x menos memoria)
+# fp16  -> fuerza bruta sobre vectores en float16 (2x menos memoria)
+INDEX_TYPES = ("flat", "ivf", "hnsw", "ivfpq", "sq8", "fp16")
+# Tipos que guardan los vectores con pérdida: sus resultados se reordenan con los vectores exactos
+QUANTIZED_TYPES = ("ivfpq", "sq8", "fp16")
+
+INDEX_TYPE = os.getenv("FAISS_INDEX_TYPE", "flat").lower()
+FAISS_NLIST = int(os.getenv("FAISS_NLIST", "0"))  # 0 = calcular según el tamaño del corpus
+FAISS_NPROBE = int(os.getenv("FAISS_NPROBE", "16"))
+FAISS_HNSW_M = int(os.getenv("FAISS_HNSW_M", "32"))
+FAISS_EF_CONSTRUCTION = int(os.getenv("FAISS_EF_CONSTRUCTION", "80"))
+FAISS_EF_SEARCH = int(os.getenv("FAISS_EF_SEARCH", "64"))
+FAISS_PQ_M = int(os.getenv("FAISS_PQ_M", "64"))
+# Por debajo de este número de vectores un índice flat es suficientemente rápido
+# y no hay datos para entrenar bien los centroides de IVF/PQ.
+FAISS_MIN_TRAIN_SIZE = int(os.getenv("FAISS_MIN_TRAIN_SIZE", "10000"))
+# Con una base cuantizada se piden top_k * factor candidatos y se reordenan con distancias exactas (0 = sin re-rank)
+FAISS_RERANK_FACTOR = int(os.getenv("FAISS_RERANK_FACTOR", "4"))
+
+
+def needs_training(index_type: str) -> bool:
+    return index_type in ("ivf", "ivfpq")
+
+
+def auto_nlist(n: int) -> int:
+    """nlist ~ 4*sqrt(n), con al menos 39 puntos de entrenamiento por centroide"""
+    if FAISS_NLIST > 0:
+        return FAISS_NLIST
+    nlist = int(4 * math.sqrt(max(n, 1)))
+    return max(1, min(nlist, n // 39 if n >= 39 else 1))
+
+
+def pq_subquantizers(dim: int, m: int = None) -> int:
+    """Mayor número de subcuantizadores <= m que divide la dimensión"""
+    m = m or FAISS_PQ_M
+    for candidate in range(min(m, dim), 0, -1):
+        if dim % candidate == 0:
+            return candidate
+    return 1
+
+
+def min_train_size(index_type: str) -> int:
+    if not needs_training(index_type):
+        return 0
+    if index_type == "ivfpq":
+        # PQ de 8 bits entrena 256 centroides por subcuantizador
+        return max(FAISS_MIN_TRAIN_SIZE, 256 * 39)
+    return FAISS_MIN_TRAIN_SIZE
+
+
+def build_index(dim: int, index_type: str = None, n_train: int = 0):
+    """Crea un índice vacío del tipo indicado (sin entrenar)"""
+    index_type = (index_type or INDEX_TYPE).lower()
+    if index_type not in INDEX_TYPES:
+        raise ValueError(f"Tipo de índice no soportado: {index_type} (opciones: {', '.join(INDEX_TYPES)})")
+
+    if index_type == "flat":
+        return faiss.IndexFlatL2(dim)
+    if index_type == "hnsw":
+        index = faiss.IndexHNSWFlat(dim, FAISS_HNSW_M)
+        index.hnsw.efConstruction = FAISS_EF_CONSTRUCTION
+        return index
+    if index_type == "sq8":
+        return faiss.IndexScalarQuantizer(dim, faiss.ScalarQuantizer.QT_8bit, faiss.METRIC_L2)
+    if index_type == "fp16":
+        return faiss.IndexScalarQuantizer(dim, faiss.ScalarQuantizer.QT_fp16, faiss.METRIC_L2)
+
+    nlist = auto_nlist(n_train)
+    quantizer = faiss.IndexFlatL2(dim)
+    if index_type == "ivf":
+        return faiss.IndexIVFFlat(quantizer, dim, nlist, faiss.METRIC_L2)
+    return faiss.IndexIVFPQ(quantizer, dim, nlist, pq_subquantizers(dim), 8)
+
+
+def unwrap(index):
+    """Devuelve el índice interno si está envuelto en un IndexIDMap"""
+    if isinstance(index, (faiss.IndexIDMap, faiss.IndexIDMap2)):
+        return faiss.downcast_index(index.index)
+    return index
+
+
+def index_type_of(index) -> str:
+    inner = unwrap(index)
+    if isinstance(inner, faiss.IndexHNSW):
+        return "hnsw"
+    if isinstance(inner, faiss.IndexIVFPQ):
+        return "ivfpq"
+    if isinstance(inner, faiss.IndexIVF):
+        return "ivf"
+    if isinstance(inner, faiss.IndexScalarQuantizer):
+        return "fp16" if inner.sq.qtype == faiss.ScalarQuantizer.QT_fp16 else "sq8"
+    return "flat"
+
+
+def is_quantized(index) -> bool:
+    return index is not None and index_type_of(index) in QUANTIZED_TYPES
+
+
+def index_memory_bytes(index) -> int:
+    """Memoria aproximada de un índice: códigos de los vectores + ids + estructuras (centroides, grafo)"""
+    if index is None:
+        return 0
+    inner = unwrap(index)
+    n = index.ntotal
+    size = n * 8 if inner is not index else 0  # id_map del IndexIDMap2
+    if isinstance(inner, faiss.IndexHNSW):
+        storage = faiss.downcast_index(inner.storage)
+        # Capa 0 con 2*M vecinos por nodo (int32); las capas superiores son despreciables
+        return size + storage.code_size * n + n * 2 * FAISS_HNSW_M * 4
+    if isinstance(inner, faiss.IndexIVF):
+        # Cada lista guarda código + id (int64) por vector, más los centroides del cuantizador
+        return size + n * (inner.code_size + 8) + inner.nlist * inner.d * 4
+    return size + inner.code_size * n
+
+
+def search_parameters(index, selector=None):
+    """Parámetros de búsqueda por tipo de índice (nprobe / efSearch) y selector de ids opcional"""
+    index_type = index_type_of(index)
+    if index_type in ("ivf", "ivfpq"):
+        params = faiss.SearchParametersIVF(nprobe=FAISS_NPROBE)
+    elif index_type == "hnsw":
+        params = faiss.SearchParametersHNSW(efSearch=FAISS_EF_SEARCH)
+    elif selector is not None:
+        params = faiss.SearchParameters()
+    else:
+        return None
+    if selector is not None:
+        params.sel = selector
+    return params
+
+
+def stored_ids(index) -> np.ndarray:
+    """Ids externos de los vectores de un índice (posiciones si no hay IndexIDMap)"""
+    if isinstance(index, (faiss.IndexIDMap, faiss.IndexIDMap2)):
+        return faiss.vector_to_array(index.id_map).astype("int64")
+    return np.arange(index.ntotal, dtype="int64")
+
+
+def reconstruct_all(index) -> np.ndarray:
+    """Recupera los vectores almacenados en un índice, en el orden de stored_ids (exactos salvo en PQ)"""
+    n = index.ntotal
+    if n == 0:
+        return np.zeros((0, index.d), dtype="float32")
+    inner = unwrap(index)
+    if isinstance(inner, faiss.IndexIVF):
+        inner.make_direct_map()
+    return inner.reconstruct_n(0, n)
+
+
+def train_and_fill(dim: int, index_type: str, vectors: np.ndarray, ids: np.ndarray = None):
+    """
+    Construye un índice del tipo indicado, lo entrena con los propios vectores y los añade.
+    Con ids, el índice se envuelve en un IndexIDMap2 para que los ids sobrevivan a borrados y compactaciones.
+    """
+    vectors = np.ascontiguousarray(vectors, dtype="float32")
+    index = build_index(dim, index_type, n_train=len(vectors))
+    if not index.is_trained:
+        index.train(vectors)
+    if ids is not None:
+        index = faiss.IndexIDMap2(index)
+        if len(vectors):
+            index.add_with_ids(vectors, np.ascontiguousarray(ids, dtype="int64"))
+    elif len(vectors):
+        index.add(vectors)
+    return index
+
+
+def rebuild_index(index, index_type: str):
+    """Reconstruye un índice existente en otro tipo sin volver a generar embeddings"""
+    if index_type_of(index) == "ivfpq":
+        print("[FAISS] Aviso: el índice origen es IVF-PQ, los vectores reconstruidos son aproximados")
+    vectors = reconstruct_all(index)
+    ids = stored_ids(index) if isinstance(index, (faiss.IndexIDMap, faiss.IndexIDMap2)) else None
+    return train_and_fill(index.d, index_type, vectors, ids)
+
+
+def migrate_index_file(path: str, index_type: str, output: str = None) -> str:
+    """Migra un faiss_index.bin existente al tipo indicado (escritura atómica)"""
+    index = faiss.read_index(path)
+    print(f"[FAISS] Migrando {path}: {index_type_of(index)} -> {index_type} ({index.ntotal} vectores)")
+    new_index = rebuild_index(index, index_type)
+    output = output or path
+    tmp_path = output + ".tmp"
+    faiss.write_index(new_index, tmp_path)
+    os.replace(tmp_path, output)
+    print(f"[FAISS] Índice migrado guardado en {output}")
+    return output
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Migra un índice FAISS existente a otro tipo")
+    parser.add_argument("--index", default="faiss_index.bin", help="Ruta del índice a migrar")
+    parser.add_argument("--type", required=True, choices=INDEX_TYPES, help="Tipo de índice destino")
+    parser.add_argument("--output", default=None, help="Ruta de salida (por defecto sobrescribe el índice)")
+    args = parser.parse_args()
+    migrate_index_file(args.index, args.type, args.output)
@@ -0,0 +1,102 @@
+import os
+import queue
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from utils.embeddings import EMBEDDING_CONCURRENCY
+
+# --- Ingesta por etapas: extracción -> limpieza/chunking -> embeddings -> escritura en el índice ---
+# Cada etapa corre en su hilo y se comunica con la siguiente por una cola acotada: la extracción
+# (CPU) se solapa con las peticiones de embeddings (red) y la memoria depende de la profundidad
+# de las colas, no del tamaño del documento.
+# Páginas extraídas en espera de trocearse
+INGEST_PAGE_QUEUE = int(os.getenv("INGEST_PAGE_QUEUE", "32"))
+# Chunks por lote de embeddings y lotes troceados en espera de embeberse
+INGEST_EMBED_BATCH = int(os.getenv("INGEST_EMBED_BATCH", "256"))
+INGEST_BATCH_QUEUE = int(os.getenv("INGEST_BATCH_QUEUE", "4"))
+# Lotes de embeddings en vuelo a la vez por documento
+INGEST_EMBED_CONCURRENCY = int(os.getenv("INGEST_EMBED_CONCURRENCY", str(EMBEDDING_CONCURRENCY)))
+# Chunks embebidos que se acumulan antes de escribir un segmento en el índice
+INGEST_INDEX_BATCH = int(os.getenv("INGEST_INDEX_BATCH", "2048"))
+
+_END = object()
+
+
+def iter_in_thread(iterable, maxsize: int, name: str):
+    """
+    Consume iterable en un hilo propio y entrega sus elementos por una cola de maxsize
+    elementos: el productor se bloquea cuando el consumidor va por detrás. Las excepciones
+    del productor se relanzan en el consumidor; si el consumidor abandona, el productor se
+    detiene tras el elemento en curso y cierra su iterable.
+    """
+    items = queue.Queue(maxsize=max(1, maxsize))
+    stop = threading.Event()
+
+    def put(entry) -> bool:
+        while not stop.is_set():
+            try:
+                items.put(entry, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def produce():
+        iterator = iter(iterable)
+        try:
+            for item in iterator:
+                if not put((None, item)):
+                    return
+            put((None, _END))
+        except BaseException as e:
+            put((e, None))
+        finally:
+            # Cierra la etapa anterior (si es otro iter_in_thread, detiene también su hilo)
+            close = getattr(iterator, "close", None)
+            if close is not None:
+                close()
+
+    thread = threading.Thread(target=produce, name=name, daemon=True)
+    thread.start()
+    try:
+        while True:
+            error, item = items.get()
+            if error is not None:
+                raise error
+            if item is _END:
+                return
+            yield item
+    finally:
+        stop.set()
+        thread.join()
+
+
+def batched(items, size: int):
+    """Agrupa un iterable en listas de hasta size elementos"""
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def map_ahead(fn, items, concurrency: int, name: str):
+    """
+    fn(item) para cada elemento con hasta concurrency llamadas en vuelo; los resultados
+    salen en el orden de entrada.
+    """
+    with ThreadPoolExecutor(max_workers=max(1, concurrency), thread_name_prefix=name) as pool:
+        pending = deque()
+        try:
+            for item in items:
+                pending.append(pool.submit(fn, item))
+                if len(pending) >= max(1, concurrency):
+                    yield pending.popleft().result()
+            while pending:
+                yield pending.popleft().result()
+        finally:
+            for future in pending:
+                future.cancel()
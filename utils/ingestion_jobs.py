@@ -0,0 +1,172 @@
+import os
+import queue
+import threading
+import uuid
+from collections import OrderedDict
+from datetime import datetime
+
+# Workers que procesan trabajos de ingesta (extraer, trocear, embeber, indexar) en segundo plano
+INGEST_WORKERS = int(os.getenv("INGEST_WORKERS", "2"))
+# Trabajos en espera admitidos; con la cola llena /upload y /reindex responden 503 (0 = sin límite)
+INGEST_QUEUE_SIZE = int(os.getenv("INGEST_QUEUE_SIZE", "100"))
+# Trabajos terminados que se conservan para consultar su estado en /jobs
+INGEST_JOB_HISTORY = int(os.getenv("INGEST_JOB_HISTORY", "200"))
+
+QUEUED, RUNNING, DONE, FAILED = "queued", "running", "done", "failed"
+
+
+def _now() -> str:
+    return datetime.now().isoformat(timespec="seconds")
+
+
+class IngestionQueueFull(RuntimeError):
+    pass
+
+
+class IngestionJob:
+    """Estado de un trabajo de ingesta: lo actualiza el worker y lo leen /jobs y su stream SSE"""
+
+    FIELDS = (
+        "id", "kind", "source", "status", "stage", "pages_done", "pages_total", "chunks_embedded",
+        "chunks_total", "errors", "result", "created_at", "started_at", "finished_at", "version",
+    )
+
+    def __init__(self, kind: str, path: str, source: str):
+        self.id = uuid.uuid4().hex
+        self.kind = kind
+        self.path = path
+        self.source = source
+        self.status = QUEUED
+        self.stage = None
+        self.pages_done = None
+        self.pages_total = None
+        self.chunks_embedded = None
+        self.chunks_total = None
+        self.errors = []
+        self.result = None
+        self.created_at = _now()
+        self.started_at = None
+        self.finished_at = None
+        # Se incrementa en cada cambio: el stream SSE solo emite cuando cambia
+        self.version = 0
+        self._lock = threading.Lock()
+
+    @property
+    def finished(self) -> bool:
+        return self.status in (DONE, FAILED)
+
+    def update(self, **fields):
+        with self._lock:
+            for name, value in fields.items():
+                setattr(self, name, value)
+            self.version += 1
+
+    def progress(self, stage: str, **counters):
+        """Callback de progreso de DocumentProcessor.process"""
+        self.update(stage=stage, **counters)
+
+    def to_dict(self) -> dict:
+        with self._lock:
+            data = {name: getattr(self, name) for name in self.FIELDS}
+            data["errors"] = list(self.errors)
+        return data
+
+
+class IngestionQueue:
+    """
+    Cola acotada de trabajos de ingesta con un pool fijo de workers (hilos daemon que se
+    arrancan con el primer trabajo). run_fn(job) hace el trabajo e informa del avance con
+    job.progress; su valor de retorno queda en job.result.
+    """
+
+    def __init__(self, run_fn, workers: int = None, max_pending: int = None, history: int = None):
+        self.run_fn = run_fn
+        self.workers = max(1, workers or INGEST_WORKERS)
+        self.history = INGEST_JOB_HISTORY if history is None else history
+        self._queue = queue.Queue(maxsize=max(0, INGEST_QUEUE_SIZE if max_pending is None else max_pending))
+        self._jobs = OrderedDict()
+        self._source_locks = {}
+        self._threads = []
+        self._lock = threading.Lock()
+
+    def _ensure_workers(self):
+        with self._lock:
+            self._threads = [t for t in self._threads if t.is_alive()]
+            while len(self._threads) < self.workers:
+                thread = threading.Thread(target=self._work, name=f"ingest-{len(self._threads)}", daemon=True)
+                thread.start()
+                self._threads.append(thread)
+
+    def submit(self, kind: str, path: str, source: str) -> IngestionJob:
+        job = IngestionJob(kind, path, source)
+        with self._lock:
+            self._jobs[job.id] = job
+            self._trim_history()
+        try:
+            self._queue.put_nowait(job)
+        except queue.Full:
+            with self._lock:
+                self._jobs.pop(job.id, None)
+            raise IngestionQueueFull(f"Cola de ingesta llena ({self._queue.maxsize} trabajos en espera)")
+        self._ensure_workers()
+        return job
+
+    def _trim_history(self):
+        finished = [job_id for job_id, job in self._jobs.items() if job.finished]
+        for job_id in finished[:max(0, len(finished) - self.history)]:
+            del self._jobs[job_id]
+
+    def get(self, job_id: str):
+        return self._jobs.get(job_id)
+
+    def jobs(self) -> list:
+        """Trabajos conocidos, del más reciente al más antiguo"""
+        with self._lock:
+            return list(reversed(self._jobs.values()))
+
+    def _source_lock(self, source: str) -> threading.Lock:
+        with self._lock:
+            return self._source_locks.setdefault(source, threading.Lock())
+
+    def _work(self):
+        while True:
+            job = self._queue.get()
+            if job is None:
+                return
+            try:
+                self._run(job)
+            finally:
+                self._queue.task_done()
+
+    def _run(self, job: IngestionJob):
+        # Dos trabajos del mismo documento no se solapan: el segundo reemplaza los chunks del primero
+        with self._source_lock(job.source):
+            job.update(status=RUNNING, started_at=_now())
+            try:
+                result = self.run_fn(job)
+            except Exception as e:
+                print(f"[INGEST] Error en el trabajo {job.id} ({job.source}): {e}")
+                job.update(status=FAILED, errors=job.errors + [f"{job.stage or 'queued'}: {e}"], finished_at=_now())
+            else:
+                job.update(status=DONE, stage="done", result=result, finished_at=_now())
+
+    def join(self):
+        """Espera a que terminen los trabajos encolados"""
+        self._queue.join()
+
+    def shutdown(self):
+        """Detiene los workers cuando terminan los trabajos ya encolados (los hilos son daemon)"""
+        with self._lock:
+            threads = list(self._threads)
+        for _ in threads:
+            try:
+                self._queue.put_nowait(None)
+            except queue.Full:
+                break
+
+    def stats(self) -> dict:
+        jobs = self.jobs()
+        counts = {status: 0 for status in (QUEUED, RUNNING, DONE, FAILED)}
+        for job in jobs:
+            counts[job.status] += 1
+        return {"workers": self.workers, "max_pending": self._queue.maxsize, **counts}
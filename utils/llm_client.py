@@ -1,15 +1,120 @@
 from openai import OpenAI
+import inspect
 import os
+import threading
+
+from utils.openai_clients import OPENAI_MAX_RETRIES, get_async_client, limiter, request_timeout
+
+# Cliente creado al primer uso: importar el módulo no requiere red ni API key
+client = None
+_client_lock = threading.Lock()
+
+LLM_MODEL = "gpt-4o-mini"
+SYSTEM_PROMPT = "Eres un asistente experto en documentación técnica."
+# Segundos máximos de espera de la respuesta (entre fragmentos, en streaming)
+LLM_TIMEOUT = float(os.getenv("LLM_TIMEOUT", "60"))
+# Llamadas al LLM en curso por worker; el resto espera turno sin bloquear el event loop
+LLM_CONCURRENCY = int(os.getenv("LLM_CONCURRENCY", "16"))
+
+
+def _get_client():
+    global client
+    with _client_lock:
+        if client is None:
+            client = OpenAI(
+                api_key=os.getenv("OPENAI_API_KEY"),
+                timeout=request_timeout(LLM_TIMEOUT),
+                max_retries=OPENAI_MAX_RETRIES,
+            )
+    return client
+
+
+def _messages(prompt: str):
+    return [
+        {"role": "system", "content": SYSTEM_PROMPT},
+        {"role": "user", "content": prompt}
+    ]
+
+
+def _delta_text(chunk):
+    if not chunk.choices:
+        return None
+    return chunk.choices[0].delta.content
+
+
+class AsyncLLMStream:
+    """
+    Respuesta del LLM en streaming: iterar con async for devuelve los fragmentos de texto según
+    los genera el modelo. aclose() cierra la conexión y corta la generación; on_close libera el
+    hueco del semáforo que ocupa el stream.
+    """
+
+    def __init__(self, response, on_close=None):
+        self._response = response
+        self._on_close = on_close
+        self.closed = False
+        # True cuando el modelo terminó la respuesta (no se cortó con aclose())
+        self.completed = False
+
+    async def __aiter__(self):
+        try:
+            async for chunk in self._response:
+                if self.closed:
+                    break
+                content = _delta_text(chunk)
+                if content:
+                    yield content
+            else:
+                self.completed = True
+        except Exception:
+            # Leer de una conexión cerrada por aclose() no es un error
+            if not self.closed:
+                raise
+        finally:
+            await self.aclose()
+
+    async def aclose(self):
+        if self.closed:
+            return
+        self.closed = True
+        try:
+            close = getattr(self._response, "close", None)
+            if close:
+                result = close()
+                if inspect.isawaitable(result):
+                    await result
+        finally:
+            if self._on_close:
+                self._on_close()
 
-# Inicializar cliente con la API key desde la variable de entorno
-client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
 
 def call_llm(prompt: str):
-    response = client.chat.completions.create(
-        model="gpt-4o-mini",
-        messages=[
-            {"role": "system", "content": "Eres un asistente experto en documentación técnica."},
-            {"role": "user", "content": prompt}
-        ]
+    response = _get_client().chat.completions.create(
+        model=LLM_MODEL,
+        messages=_messages(prompt),
     )
     return response.choices[0].message.content
+
+
+async def acall_llm(prompt: str, stream: bool = False):
+    """
+    Versión asíncrona de call_llm sobre el cliente compartido (pool de conexiones, timeout
+    por llamada y reintentos acotados). Como mucho LLM_CONCURRENCY llamadas en curso;
+    con stream=True, el stream ocupa su hueco hasta que se consume o se cierra.
+    """
+    semaphore = limiter("llm", LLM_CONCURRENCY)
+    await semaphore.acquire()
+    try:
+        response = await get_async_client().chat.completions.create(
+            model=LLM_MODEL,
+            messages=_messages(prompt),
+            stream=stream,
+            timeout=request_timeout(LLM_TIMEOUT),
+        )
+    except BaseException:
+        semaphore.release()
+        raise
+    if stream:
+        return AsyncLLMStream(response, on_close=semaphore.release)
+    semaphore.release()
+    return response.choices[0].message.content
@@ -0,0 +1,63 @@
+import os
+
+# Campos de /proc/<pid>/smaps que interesan para separar memoria compartida y privada
+_FIELDS = ("Rss", "Pss", "Shared_Clean", "Shared_Dirty", "Private_Clean", "Private_Dirty", "Anonymous")
+
+
+def _parse_kb(line: str) -> int:
+    # "Shared_Clean:       2140 kB" -> bytes
+    return int(line.split()[1]) * 1024
+
+
+def _empty():
+    return {field.lower(): 0 for field in _FIELDS}
+
+
+def process_memory(mapped_dir: str = None) -> dict:
+    """
+    Memoria del proceso actual separada en compartida/privada (Linux).
+    Si se indica mapped_dir, desglosa además las regiones mapeadas desde ficheros
+    de esa carpeta (índice FAISS, chunks.db), que son las que comparten los workers.
+    """
+    if not os.path.exists("/proc/self/smaps"):
+        return {"available": False}
+
+    totals = _empty()
+    mapped = _empty()
+    mapped_files = set()
+    mapped_dir = os.path.abspath(mapped_dir) if mapped_dir else None
+
+    current_path = None
+    with open("/proc/self/smaps", "r") as f:
+        for line in f:
+            key = line.split(":", 1)[0]
+            if key in _FIELDS:
+                value = _parse_kb(line)
+                totals[key.lower()] += value
+                if current_path is not None:
+                    mapped[key.lower()] += value
+            elif not line[0].isupper() or "-" in key:
+                # Cabecera de región: "addr-addr perms offset dev inode [path]"
+                parts = line.split(None, 5)
+                path = parts[5].strip() if len(parts) > 5 else ""
+                in_dir = bool(mapped_dir and path.startswith(mapped_dir + os.sep))
+                current_path = path if in_dir else None
+                if in_dir:
+                    mapped_files.add(os.path.basename(path))
+
+    result = {
+        "available": True,
+        "rss_bytes": totals["rss"],
+        "pss_bytes": totals["pss"],
+        "shared_bytes": totals["shared_clean"] + totals["shared_dirty"],
+        "private_bytes": totals["private_clean"] + totals["private_dirty"],
+        "anonymous_bytes": totals["anonymous"],
+    }
+    if mapped_dir:
+        result["index_mapped"] = {
+            "files": sorted(mapped_files),
+            "rss_bytes": mapped["rss"],
+            "shared_bytes": mapped["shared_clean"] + mapped["shared_dirty"],
+            "private_bytes": mapped["private_clean"] + mapped["private_dirty"],
+        }
+    return result
@@ -0,0 +1,167 @@
+import asyncio
+import queue
+import threading
+import time
+import weakref
+from concurrent.futures import Future
+
+
+class MicroBatcher:
+    """
+    Agrupa peticiones concurrentes de un elemento en una sola llamada por lotes.
+    El primer elemento abre una ventana de max_wait segundos (o hasta max_batch elementos);
+    fn recibe la lista de elementos y devuelve los resultados en el mismo orden,
+    que se reparten a cada llamante a través de su Future.
+    """
+
+    def __init__(self, fn, max_batch: int = 32, max_wait: float = 0.005, name: str = "micro-batcher"):
+        self.fn = fn
+        self.max_batch = max(1, max_batch)
+        self.max_wait = max_wait
+        self.name = name
+        self.batches = 0
+        self.items = 0
+        self._queue = queue.Queue()
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def _ensure_worker(self):
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+                self._thread.start()
+
+    def submit(self, item) -> Future:
+        future = Future()
+        self._ensure_worker()
+        self._queue.put((item, future))
+        return future
+
+    def __call__(self, item):
+        return self.submit(item).result()
+
+    def _collect(self):
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            items = [item for item, _ in batch]
+            try:
+                results = self.fn(items)
+                if len(results) != len(items):
+                    raise RuntimeError(f"{self.name}: {len(results)} resultados para {len(items)} elementos")
+            except Exception as e:
+                for _, future in batch:
+                    future.set_exception(e)
+                continue
+            finally:
+                self.batches += 1
+                self.items += len(items)
+            for (_, future), result in zip(batch, results):
+                future.set_result(result)
+
+    def stats(self) -> dict:
+        return {
+            "batches": self.batches,
+            "items": self.items,
+            "avg_batch_size": round(self.items / self.batches, 2) if self.batches else 0.0,
+            "max_batch": self.max_batch,
+            "max_wait_ms": self.max_wait * 1000,
+        }
+
+
+class _Window:
+    def __init__(self):
+        self.items = []
+        self.full = asyncio.Event()
+
+
+class AsyncMicroBatcher:
+    """
+    Versión para asyncio de MicroBatcher: fn es una corrutina y las llamadas que llegan
+    dentro de la ventana esperan su resultado sin ocupar hilos. Cada event loop tiene su
+    propia ventana (los futures y el cliente asíncrono no pueden cruzar de loop).
+    """
+
+    def __init__(self, fn, max_batch: int = 32, max_wait: float = 0.005, name: str = "async-micro-batcher"):
+        self.fn = fn
+        self.max_batch = max(1, max_batch)
+        self.max_wait = max_wait
+        self.name = name
+        self.batches = 0
+        self.items = 0
+        self._windows = weakref.WeakKeyDictionary()
+        self._tasks = set()
+
+    async def submit(self, item):
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        window = self._windows.get(loop)
+        if window is None:
+            window = self._windows[loop] = _Window()
+            task = loop.create_task(self._flush(loop, window))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+        window.items.append((item, future))
+        if len(window.items) >= self.max_batch:
+            # Ventana llena: se envía ya y las siguientes llamadas abren otra
+            del self._windows[loop]
+            window.full.set()
+        return await future
+
+    async def _flush(self, loop, window: _Window):
+        batch = window.items
+        try:
+            try:
+                await asyncio.wait_for(window.full.wait(), self.max_wait)
+            except asyncio.TimeoutError:
+                pass
+            self._close(loop, window)
+            items = [item for item, _ in batch]
+            self.batches += 1
+            self.items += len(items)
+            results = await self.fn(items)
+            if len(results) != len(items):
+                raise RuntimeError(f"{self.name}: {len(results)} resultados para {len(items)} elementos")
+        except BaseException as e:
+            # También si se cancela la tarea (cierre del loop): ningún llamante se queda esperando
+            self._close(loop, window)
+            for _, future in batch:
+                if future.done():
+                    continue
+                if isinstance(e, Exception):
+                    future.set_exception(e)
+                else:
+                    future.cancel()
+            if not isinstance(e, Exception):
+                raise
+            return
+        for (_, future), result in zip(batch, results):
+            # Un llamante cancelado ya no espera su resultado
+            if not future.done():
+                future.set_result(result)
+
+    def _close(self, loop, window: _Window):
+        """Las llamadas siguientes abren otra ventana"""
+        if self._windows.get(loop) is window:
+            del self._windows[loop]
+
+    def stats(self) -> dict:
+        return {
+            "batches": self.batches,
+            "items": self.items,
+            "avg_batch_size": round(self.items / self.batches, 2) if self.batches else 0.0,
+            "max_batch": self.max_batch,
+            "max_wait_ms": self.max_wait * 1000,
+        }
@@ -0,0 +1,60 @@
+import asyncio
+import os
+import weakref
+
+import openai
+from openai import AsyncOpenAI
+
+# Timeouts por llamada (segundos): lectura/escritura y establecimiento de la conexión
+OPENAI_TIMEOUT = float(os.getenv("OPENAI_TIMEOUT", "60"))
+OPENAI_CONNECT_TIMEOUT = float(os.getenv("OPENAI_CONNECT_TIMEOUT", "5"))
+# Reintentos del SDK ante 429, 5xx, timeouts y errores de conexión (backoff exponencial)
+OPENAI_MAX_RETRIES = int(os.getenv("OPENAI_MAX_RETRIES", "3"))
+
+
+def request_timeout(read: float = None) -> openai.Timeout:
+    """Timeout de una llamada: read segundos para leer/escribir (OPENAI_TIMEOUT por defecto)"""
+    return openai.Timeout(read or OPENAI_TIMEOUT, connect=OPENAI_CONNECT_TIMEOUT)
+
+
+class _LoopState:
+    """Cliente y semáforos de un event loop: un AsyncOpenAI no puede usarse desde otro loop"""
+
+    def __init__(self):
+        self.client = None
+        self.semaphores = {}
+
+
+_loops = weakref.WeakKeyDictionary()
+
+
+def _loop_state() -> _LoopState:
+    loop = asyncio.get_running_loop()
+    state = _loops.get(loop)
+    if state is None:
+        state = _loops[loop] = _LoopState()
+    return state
+
+
+def get_async_client() -> AsyncOpenAI:
+    """
+    Cliente asíncrono compartido por todas las llamadas del event loop: un único pool de
+    conexiones keep-alive para LLM y embeddings. with_options() crea variantes (otros
+    reintentos o timeouts) que reutilizan el mismo pool.
+    """
+    state = _loop_state()
+    if state.client is None:
+        state.client = AsyncOpenAI(
+            api_key=os.getenv("OPENAI_API_KEY"),
+            timeout=request_timeout(),
+            max_retries=OPENAI_MAX_RETRIES,
+        )
+    return state.client
+
+
+def limiter(name: str, limit: int) -> asyncio.Semaphore:
+    """Semáforo con nombre que limita las llamadas concurrentes de un tipo dentro del event loop"""
+    semaphores = _loop_state().semaphores
+    if name not in semaphores:
+        semaphores[name] = asyncio.Semaphore(max(1, limit))
+    return semaphores[name]
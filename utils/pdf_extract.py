@@ -0,0 +1,136 @@
+import multiprocessing
+import os
+import threading
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+# Módulo ligero (solo PyMuPDF): es lo que importan los procesos del pool de extracción
+try:
+    import pymupdf as fitz
+    HAS_PYMUPDF = True
+except ImportError:
+    try:
+        import fitz  # PyMuPDF < 1.24
+        HAS_PYMUPDF = True
+    except ImportError:
+        HAS_PYMUPDF = False
+
+# Procesos que extraen rangos de páginas en paralelo (1 = en el propio proceso)
+PDF_EXTRACT_WORKERS = int(os.getenv("PDF_EXTRACT_WORKERS", str(min(4, os.cpu_count() or 1))))
+# Páginas por tarea y número mínimo de páginas para usar el pool (en PDFs cortos no compensa)
+PDF_EXTRACT_PAGES_PER_TASK = int(os.getenv("PDF_EXTRACT_PAGES_PER_TASK", "16"))
+PDF_EXTRACT_MIN_PAGES = int(os.getenv("PDF_EXTRACT_MIN_PAGES", "32"))
+
+_pool = None
+_pool_workers = 0
+_pool_lock = threading.Lock()
+# En cada proceso del pool: último documento abierto, para no volver a parsearlo en cada rango
+_worker_doc = None
+
+
+def pymupdf_page_text(page) -> str:
+    # Intentar múltiples métodos de extracción de PyMuPDF
+    text = page.get_text()
+
+    # Si el texto está vacío o muy corto, intentar con layout preservado
+    if len(text.strip()) < 50:
+        text = page.get_text("text", flags=fitz.TEXT_PRESERVE_LIGATURES | fitz.TEXT_PRESERVE_WHITESPACE)
+
+    # Si aún está vacío, intentar extraer de bloques de texto
+    if len(text.strip()) < 50:
+        blocks = page.get_text("dict")["blocks"]
+        text_blocks = []
+        for block in blocks:
+            if "lines" in block:
+                for line in block["lines"]:
+                    for span in line["spans"]:
+                        if "text" in span:
+                            text_blocks.append(span["text"])
+        text = " ".join(text_blocks)
+    return text
+
+
+def _open_in_worker(file_path: str):
+    global _worker_doc
+    stat = os.stat(file_path)
+    key = (file_path, stat.st_size, stat.st_mtime_ns)
+    if _worker_doc is None or _worker_doc[0] != key:
+        if _worker_doc is not None:
+            _worker_doc[1].close()
+        _worker_doc = (key, fitz.open(file_path))
+    return _worker_doc[1]
+
+
+def extract_page_range(file_path: str, start: int, stop: int) -> list:
+    """Texto de las páginas [start, stop); se ejecuta en un proceso del pool con su propio documento"""
+    doc = _open_in_worker(file_path)
+    return [pymupdf_page_text(doc.load_page(page_num)) for page_num in range(start, stop)]
+
+
+def _get_pool(workers: int) -> ProcessPoolExecutor:
+    """
+    Pool compartido entre documentos. Se usa 'spawn': hacer fork de un proceso con hilos
+    (FAISS, ingesta, servidor) puede heredar locks tomados. Cada proceso reimporta el módulo
+    principal, que no debe abrir el índice ni arrancar hilos al importarse (ver api.init_nodes).
+    """
+    global _pool, _pool_workers
+    with _pool_lock:
+        if _pool is None or _pool_workers != workers:
+            if _pool is not None:
+                _pool.shutdown(wait=False, cancel_futures=True)
+            _pool = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"))
+            _pool_workers = workers
+        return _pool
+
+
+def shutdown_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.shutdown(wait=True, cancel_futures=True)
+            _pool = None
+
+
+def iter_pymupdf_pages(file_path: str, progress, workers: int = None):
+    """
+    Genera el texto de cada página en orden. Con varios workers y suficientes páginas, los
+    rangos de PDF_EXTRACT_PAGES_PER_TASK páginas se extraen en procesos del pool (como mucho
+    dos tareas por worker en vuelo) y se reensamblan en orden.
+    """
+    workers = PDF_EXTRACT_WORKERS if workers is None else workers
+    doc = fitz.open(file_path)
+    try:
+        page_count = doc.page_count
+        progress("extracting", pages_done=0, pages_total=page_count)
+        if workers <= 1 or page_count < PDF_EXTRACT_MIN_PAGES:
+            for page_num in range(page_count):
+                yield pymupdf_page_text(doc.load_page(page_num))
+                progress("extracting", pages_done=page_num + 1)
+            return
+    finally:
+        doc.close()
+
+    pool = _get_pool(workers)
+    step = max(1, PDF_EXTRACT_PAGES_PER_TASK)
+    ranges = iter([(start, min(start + step, page_count)) for start in range(0, page_count, step)])
+    pending = deque()
+
+    def submit_next():
+        bounds = next(ranges, None)
+        if bounds is not None:
+            pending.append(pool.submit(extract_page_range, file_path, *bounds))
+
+    pages_done = 0
+    try:
+        for _ in range(2 * workers):
+            submit_next()
+        while pending:
+            texts = pending.popleft().result()
+            submit_next()
+            for text in texts:
+                yield text
+            pages_done += len(texts)
+            progress("extracting", pages_done=pages_done)
+    finally:
+        for future in pending:
+            future.cancel()
@@ -0,0 +1,35 @@
+import asyncio
+import functools
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+# Hilos para las etapas bloqueantes de la consulta (búsqueda FAISS, filtrado, formateo).
+# FAISS y numpy liberan el GIL; el límite evita que una ráfaga de peticiones cree hilos sin control.
+PIPELINE_WORKERS = int(os.getenv("PIPELINE_WORKERS", str(min(32, (os.cpu_count() or 1) + 4))))
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_executor() -> ThreadPoolExecutor:
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=max(1, PIPELINE_WORKERS), thread_name_prefix="pipeline")
+    return _executor
+
+
+async def run_blocking(fn, *args, **kwargs):
+    """Ejecuta fn en el pool acotado de la pipeline y espera el resultado sin bloquear el event loop"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(get_executor(), functools.partial(fn, *args, **kwargs))
+
+
+def executor_stats() -> dict:
+    executor = _executor
+    return {
+        "workers": PIPELINE_WORKERS,
+        "threads": len(executor._threads) if executor is not None else 0,
+        "queued": executor._work_queue.qsize() if executor is not None else 0,
+    }
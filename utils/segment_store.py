@@ -0,0 +1,186 @@
+import faiss
+import json
+import numpy as np
+import os
+from utils.chunk_store import CHUNK_DB_FILE
+
+# --- Layout en disco (append-only) ---
+# manifest.json      -> qué base y qué segmentos están vivos (se reescribe de forma atómica)
+# vectors.f32        -> log de vectores float32, la fila i es el vector i
+# base-NNNNNN.faiss  -> índice compactado que cubre las filas [0, base.upto)
+# chunks.db          -> metadata de los chunks (ver utils/chunk_store.py), id = fila del log
+# Los segmentos delta son rangos [start, start+count) del log aún no compactados en la base.
+MANIFEST_FILE = "manifest.json"
+VECTOR_LOG_FILE = "vectors.f32"
+# v1 guardaba la metadata en pickles por base/segmento
+MANIFEST_VERSION = 2
+
+
+def _fsync_dir(path: str):
+    # En Windows no se pueden abrir directorios; el rename ya es atómico allí
+    if os.name != "nt":
+        fd = os.open(path, os.O_RDONLY)
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+
+def _atomic_write(path: str, data: bytes):
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+    _fsync_dir(os.path.dirname(os.path.abspath(path)))
+
+
+class SegmentStore:
+    """Persistencia append-only: log de vectores + base compactada + manifest"""
+
+    def __init__(self, root: str, dim: int, embedding_model: str = None):
+        self.root = root
+        self.dim = dim
+        # Modelo (y dimensión) de los embeddings del log; None si no se conoce (p. ej. pruebas con dim fija)
+        self.embedding_model = embedding_model
+        self.manifest = self._empty_manifest()
+
+    def _empty_manifest(self) -> dict:
+        return {
+            "version": MANIFEST_VERSION,
+            "generation": 0,
+            "dim": self.dim,
+            "embedding_model": self.embedding_model,
+            "ntotal": 0,
+            "next_seq": 1,
+            "base": None,
+            "segments": [],
+        }
+
+    def path(self, name: str) -> str:
+        return os.path.join(self.root, name)
+
+    # ---------------- Manifest ----------------
+    def exists(self) -> bool:
+        return os.path.exists(self.path(MANIFEST_FILE))
+
+    def manifest_mtime(self):
+        try:
+            return os.path.getmtime(self.path(MANIFEST_FILE))
+        except OSError:
+            return None
+
+    def load_manifest(self) -> dict:
+        with open(self.path(MANIFEST_FILE), "r", encoding="utf-8") as f:
+            manifest = json.load(f)
+        manifest.setdefault("version", 1)
+        if manifest.get("dim") != self.dim:
+            raise ValueError(
+                f"El índice en '{self.root}' tiene dimensión {manifest.get('dim')}, se esperaba {self.dim} "
+                "(¿cambió el backend o el modelo de embeddings? usa otro FAISS_INDEX_DIR o reindexa)"
+            )
+        if self.embedding_model:
+            stored = manifest.get("embedding_model")
+            if stored and stored != self.embedding_model:
+                raise ValueError(
+                    f"El índice en '{self.root}' se creó con embeddings de '{stored}', "
+                    f"el backend actual usa '{self.embedding_model}'; usa otro FAISS_INDEX_DIR o reindexa"
+                )
+            # Manifests anteriores no lo registraban: se guarda en el siguiente commit
+            manifest["embedding_model"] = self.embedding_model
+        self.manifest = manifest
+        return manifest
+
+    def commit(self, manifest: dict):
+        """Publica un nuevo manifest (nueva generación) con escritura atómica"""
+        os.makedirs(self.root, exist_ok=True)
+        manifest = dict(manifest, generation=manifest.get("generation", 0) + 1)
+        _atomic_write(self.path(MANIFEST_FILE), json.dumps(manifest, indent=1).encode("utf-8"))
+        self.manifest = manifest
+        return manifest
+
+    def next_name(self, manifest: dict, prefix: str) -> str:
+        seq = manifest["next_seq"]
+        manifest["next_seq"] = seq + 1
+        return f"{prefix}-{seq:06d}"
+
+    # ---------------- Log de vectores ----------------
+    def append_vectors(self, vectors: np.ndarray, expected_start: int = None) -> int:
+        """
+        Añade vectores al final del log y devuelve la fila inicial. Con expected_start, si el
+        log no termina en esa fila se lanza el error sin escribir nada.
+        """
+        os.makedirs(self.root, exist_ok=True)
+        vectors = np.ascontiguousarray(vectors, dtype="float32")
+        with open(self.path(VECTOR_LOG_FILE), "ab") as f:
+            size = f.tell()
+            start = size // (4 * self.dim)
+            if expected_start is not None and size != expected_start * 4 * self.dim:
+                raise RuntimeError(f"Log de vectores desalineado: {size} bytes, manifest {expected_start} filas")
+            f.write(vectors.tobytes())
+            f.flush()
+            os.fsync(f.fileno())
+        return start
+
+    def read_vectors(self, start: int, stop: int) -> np.ndarray:
+        if stop <= start:
+            return np.zeros((0, self.dim), dtype="float32")
+        log = np.memmap(self.path(VECTOR_LOG_FILE), dtype="float32", mode="r")
+        return np.array(log[start * self.dim:stop * self.dim]).reshape(-1, self.dim)
+
+    def read_rows(self, ids) -> np.ndarray:
+        """Vectores de filas sueltas del log (ids de chunk)"""
+        ids = np.asarray(ids, dtype="int64")
+        if len(ids) == 0:
+            return np.zeros((0, self.dim), dtype="float32")
+        rows = int(ids.max()) + 1
+        log = np.memmap(self.path(VECTOR_LOG_FILE), dtype="float32", mode="r", shape=(rows, self.dim))
+        return np.ascontiguousarray(log[ids])
+
+    def truncate_log(self, nrows: int):
+        """Descarta filas escritas tras el último manifest (escritura interrumpida)"""
+        log_path = self.path(VECTOR_LOG_FILE)
+        if os.path.exists(log_path) and os.path.getsize(log_path) > nrows * 4 * self.dim:
+            print(f"[FAISS] Recortando log de vectores a {nrows} filas confirmadas")
+            with open(log_path, "r+b") as f:
+                f.truncate(nrows * 4 * self.dim)
+
+    # ---------------- Ficheros de base y segmentos ----------------
+    def write_index(self, name: str, index):
+        tmp_path = self.path(name + ".tmp")
+        faiss.write_index(index, tmp_path)
+        # El manifest que lo referencia se publica después: el índice debe estar ya en disco
+        with open(tmp_path, "r+b") as f:
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.path(name))
+        _fsync_dir(os.path.dirname(os.path.abspath(self.path(name))))
+
+    def read_index(self, name: str, mmap: bool = False):
+        if mmap:
+            # Los códigos de índices flat/HNSW se mapean del fichero: la page cache se comparte
+            # entre procesos (workers de uvicorn) en lugar de copiarse en memoria privada
+            return faiss.read_index(self.path(name), faiss.IO_FLAG_MMAP_IFC | faiss.IO_FLAG_READ_ONLY)
+        return faiss.read_index(self.path(name))
+
+    def live_files(self, manifest: dict) -> set:
+        files = {MANIFEST_FILE, VECTOR_LOG_FILE, CHUNK_DB_FILE}
+        if manifest.get("base"):
+            files.add(manifest["base"]["index"])
+        return files
+
+    def remove_unreferenced(self, manifest: dict):
+        """
+        Borra ficheros que ningún manifest vivo referencia (merges antiguos o escrituras a medias).
+        Solo toca los ficheros del propio store: en el directorio viven otros (p. ej. documents.json)
+        cuyos .tmp se escriben sin este lock.
+        """
+        if not os.path.isdir(self.root):
+            return
+        live = self.live_files(manifest)
+        for name in os.listdir(self.root):
+            if name not in live and (name.startswith(("base-", "seg-")) or name == MANIFEST_FILE + ".tmp"):
+                try:
+                    os.remove(self.path(name))
+                except OSError:
+                    pass